@@ -11,13 +11,9 @@
     # Folder where to save & 
     # File of interest (i.e. .txt, .spec)
 
-import pandas as pd
-import urllib      # download from a specific web file 
-#pip install wget  # use this to add wget (first time only)
-import wget        # batch download web files 
-import glob
-import os
-import csv
+import time
+import ndbc_parse     # bytes -> DataFrame, no intermediate .csv
+import ndbc_download  # concurrent, keep-alive downloads (replaces wget loop)
 
 #%%
 ##
@@ -29,8 +25,7 @@ import csv
 # Get file from web with all buoys and respective lat&long (.txt)
 #
 
-response = urllib.request.urlopen(' https://www.ndbc.noaa.gov/data/latest_obs/latest_obs.txt ')
-data = response.read()
+data = ndbc_download.fetch_latest_obs()
 filename = 'latest_obs.txt'
 fh = open(filename, 'wb')
 fh.write(data)
@@ -39,35 +34,16 @@ fh.close()
 #%%
 
 #
-# Create master list for wget to download currently reporting stations
+# Parse master list of buoys (in memory, no intermediate .csv)
 # 
 
-path = filename
+debug_csv = False   # True = also write data_clean/latest_obs.csv
 
-# Blank dataframe to append all .spec files
-buoy_data = pd.DataFrame()
+latest_obs = ndbc_parse.parse(data)
+print('\n latest_obs.txt:', len(latest_obs), 'stations')
 
-for file in glob.glob(path):
-    print(file)
-    n = 0
-    
-    # Read file, delete 2nd row & add column w/file name
-    
-    with open(file, 'r') as input_file:
-        stem = os.path.splitext(os.path.basename(file))[0]
-        o_name = stem + '.csv'
-        print(o_name)
-        out = open('data_clean/'+ o_name,'w',newline='')
-        o_csv = csv.writer(out)
-        
-        for line in input_file:
-            parts = line.split()        # similar to deliminator, but cooler
-            if n == 0:
-                o_csv.writerow(parts)
-            elif n > 1:                 # skip 2nd row with units of measure
-                o_csv.writerow(parts)
-            n += 1    
-        out.close()
+if debug_csv:
+    latest_obs.to_csv('data_clean/latest_obs.csv', index=False)
         
 #%%
 
@@ -80,60 +56,58 @@ for file in glob.glob(path):
     # wave specifics "'station id'.spec" (i.e. wave height, steepness, period)
     
 
-# Create master list [] of stations for wget to download
-stations = pd.read_csv('data_clean//latest_obs.csv', dtype=(str), usecols=[0])
-
-''' sample used for proof of concept '''
-stations = stations.sample(frac=.2)
-stations = stations['#STN'].to_list()
+# Create master list [] of stations to download
+    # latest_obs.txt doubles as a change index: only stations that reported
+    # since the last ingested row are fetched, stale stations are dropped
+max_age_hours = 6   # skip stations w/no report in this many hours
+incremental = True  # only pull rows newer than the last run
+    # per-file state (ETag, newest row) kept in data_raw/fetch_state.json
+    # delete that file (or set False) to force a full 72 hr download
+
+state = ndbc_download.load_state() if incremental else {}
+latest = ndbc_download.latest_obs_times(data)
+stations, stale = ndbc_download.plan_fetch(latest, state, max_age_hours=max_age_hours)
+print('\n Stations reporting:', len(latest),
+      '| due for download:', len(stations),
+      '| stale (>', max_age_hours, 'hrs):', len(stale))
 
 #%%
 
 #
-# Download all 'general info .txt' files in repository
+# Download all '.txt' & '.spec' files in repository, concurrently
 #
-no_csv_data = []
-
-for station in stations:
-    try:
-        url = 'https://www.ndbc.noaa.gov/data/realtime2/'
-        file_type = '.txt'
-        payload= url + station + file_type
-        wget.download(payload, out= 'data_raw/')  # saves specified to folder
-    
-    except:
-        no_csv_data.append(station)
-    
-#    assert False       # stops for loop after 1 interation
-    
-# Export missing station report
-print('\n Stations missing .csv files:', len(no_csv_data))
-missing_csv = pd.DataFrame(no_csv_data)
-missing_csv = missing_csv.rename({0:'station_id'}, axis= 'columns')
-missing_csv.to_csv('stations_missing_.csv', index=False)
+
+# Tuning
+max_workers = 32    # concurrent downloads (keep-alive connection each)
+timeout = 10        # seconds per file
+retries = 3         # retries w/exponential backoff (0.5s, 1s, 2s)
+
+start = time.perf_counter()
+if incremental:
+    deltas, unchanged, missing = ndbc_download.fetch_all_delta(stations, state,
+                                                               max_workers=max_workers,
+                                                               timeout=timeout,
+                                                               retries=retries)
+    ndbc_download.apply_deltas(deltas)      # new rows added to top of data_raw/ files, > 72 hrs dropped
+    ndbc_download.save_state(state)
+    print('\n Updated', sum(len(d) for d in deltas.values()), 'files,',
+          sum(len(rows) for d in deltas.values() for _, rows in d.values()), 'new rows,',
+          sum(len(u) for u in unchanged.values()), 'unchanged, in',
+          round(time.perf_counter() - start, 1), 'sec')
+else:
+    payloads, missing = ndbc_download.fetch_all(stations,
+                                                max_workers=max_workers,
+                                                timeout=timeout,
+                                                retries=retries)
+    ndbc_download.save_payloads(payloads)   # saves to data_raw/ & data_raw/spec/
+    print('\n Downloaded', sum(len(p) for p in payloads.values()), 'files in',
+          round(time.perf_counter() - start, 1), 'sec')
 
 #%%
 
-#
-# Download all 'wave specific info .spec' files in repository
-#
-no_spec_data = []
-
-for station in stations:
-    try:
-        url = 'https://www.ndbc.noaa.gov/data/realtime2/'
-        file_type = '.spec'
-        payload= url + station + file_type
-        wget.download(payload, out= 'data_raw/spec/')
-    except:
-        no_spec_data.append(station)
-
-#    assert False
-
-# Export report of missing stations
-print('\n Stations missing .spec files:', len(no_spec_data))
-missing_spec = pd.DataFrame(no_spec_data)
-missing_spec = missing_spec.rename({0:'station_id'}, axis= 'columns')
-missing_spec.to_csv('stations_missing_.spec', index=False)
+# Export missing station reports (stations_missing_.csv & stations_missing_.spec)
+print('\n Stations missing .csv files:', len(missing['.txt']))
+print('\n Stations missing .spec files:', len(missing['.spec']))
+ndbc_download.save_missing(missing)
 
 print("Download Complete: Great success!")
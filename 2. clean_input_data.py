@@ -3,33 +3,47 @@
 #
     # 1. Batch process files from 2 input folders (glob)
     # 2. Merge/Append data & join lat/long on each entry
-    # 3. Export result (geopackage, csv & .pkl)
+    # 3. Export result (geopackage & Parquet observation store)
+    # 4. Interpolate wind & wave readings onto a lat/long grid, per 10 min
         # Note: merged dataframe is > 1.6 million records.
         # A 10% sample is used in this case study for proof of concept
 
-    # Note. All EPSG set to 3597 (Web Mercator)
+    # Note. Coordinates are lat/long degrees, EPSG:4326 (WGS84)
 
 ## User-input:
-    # Folder where to save cleaned data
+    # Files of interest (i.e. .txt, .spec)
+    # debug_csv = True to also write per-station .csv files
         # data_clean/csv
         # data_clean/spec
-    # Files of interest (i.e. .txt, .spec)
+    # production = True to skip the CHECK figures (or SPLASHDOWN_PRODUCTION=1)
+    # backfill_archives = True to also load NDBC yearly archives into obs_store/
+        # data_raw/historical/<station>h<year>.txt.gz (see backfill.py)
+    # incremental = True to parse only the rows '1. get_web_data.py' added
+        # (data_raw/new/) & merge them into the last run's 72 hr window
 
 ## Outputs:
     # CHECK_buoy_all.svg to verify active reporting wx stations on map
+        # figures are drawn in the background & only when their data changed
     # splash_down.gpkg with layers 'buoys_all' & 'wx_data'
-    # 'cleaned_wx_data.csv'     # 10% sample version
-    # 'cleaned_wx_data.pkl.zip' # 10% sample version
+    # 'obs_store/' Parquet store, by station & date  # 10% sample version
+    # data_clean/wx_grid.npz - gridded wind & wave fields (see wx_grid.py)
 
 ## Next .py is 'landing_sites.py'
 
 import pandas as pd
-import csv
-import os
-import glob
 import geopandas
-import matplotlib.pyplot as plt
-import numpy as np
+import ndbc_parse   # raw bytes -> DataFrame in memory
+import obs_store    # Parquet observation store (by station & date)
+import obs_schema   # dtypes for every column (NOAA_columns.csv)
+import wx_grid      # gridded (raster) wind & wave fields
+import figures      # background figure rendering
+import pipeline     # in-memory handoff when run by pipeline.py
+import obs_join     # sorted .txt/.spec join
+import gpkg_export  # bulk GeoPackage writer (pyogrio, Arrow)
+import ndbc_download    # queue of new rows from '1. get_web_data.py'
+import os
+import subprocess
+import sys
 
 #
 # 1. Import multiple files & create dataframes
@@ -38,12 +52,29 @@ import numpy as np
 # Steps:
     # create dictionary of new column names 
     # define path for input files
-    # loop through each file & append to new Dataframe
+    # parse each file in memory & append to new Dataframe
  
 # create dictionary of old & new column names
-mydict = pd.read_csv('NOAA_columns.csv', header=None, index_col=0, squeeze=True).to_dict()
+mydict = ndbc_parse.column_names('NOAA_columns.csv')
 #print(mydict)
 
+debug_csv = False   # True = also write per-station .csv (old intermediate files)
+backfill_archives = False   # True = historical archives -> obs_store/ (multi-year)
+incremental = True  # True = parse only new rows, merged into the last window
+
+production = figures.PRODUCTION    # True = skip CHECK figures
+render = figures.Renderer(production=production)
+    # before any Parquet read - the figure workers are forked here & pyarrow
+    # starts threads on its 1st read (see figures.py)
+
+# Last run's cleaned 72 hr window (incremental mode merges new rows into it)
+window_file = 'cache/wx_window.parquet'
+window = None
+if incremental and ndbc_download.pending() and os.path.exists(window_file):
+    window = pd.read_parquet(window_file)
+raw_dirs = ndbc_download.OUT_DIRS if window is None else ndbc_download.PENDING_DIRS
+print('\n Parsing:', 'new rows only' if window is not None else 'all of data_raw/')
+
 #%%
 
 #
@@ -53,51 +84,17 @@ mydict = pd.read_csv('NOAA_columns.csv', header=None, index_col=0, squeeze=True)
 
 ## Buoy Data - GENERAL readings
 
-# Path of input files
-path = 'data_raw/*.txt'
+# Path of input files (data_raw/new/ in incremental mode)
+path = raw_dirs['.txt'] + '*.txt'
 
-# Process all files
-for file in glob.glob(path):
-    print(file)
-    n = 0
-    
-    # Read each file, delete 2nd row & add column w/file name in each row
-    #   - Necessary step to create one master dataframe
-    with open(file, 'r') as input_file:
-        stem = os.path.splitext(os.path.basename(file))[0]
-        o_name = stem + '.csv'
-#        print(o_name)
-        out = open('data_clean/csv/'+ o_name,'w',newline='')
-        o_csv = csv.writer(out)
-        
-        for line in input_file:
-            parts = line.split()
-            if n == 0:
-                o_csv.writerow(['station_id'] + parts)
-            elif n > 1:
-                o_csv.writerow([stem] + parts)
-            n += 1    
-        out.close()
-        
-#        assert False   # stops code after 1 iteration
+# Parse all files straight from bytes, station_id added to each row
+    # one table built in a single pass (no DataFrame.append per file)
+buoy_data = ndbc_parse.build_table(ndbc_parse.read_raw(path), names=mydict)
 
-#%%
-# Append files into a Dataframe
-buoy_data = pd.DataFrame()
-
-path = 'data_clean/csv/*.csv'
-
-for file in glob.glob(path):
-    raw_data = pd.read_csv(file)
-    raw_data = raw_data.rename(mydict, axis='columns')
-    buoy_data = buoy_data.append(raw_data)
+if debug_csv:
+    ndbc_parse.write_debug_csv(buoy_data, 'data_clean/csv/')
     
-# create timestamp for index
-buoy_data['timestamp'] = pd.to_datetime(buoy_data[['year', 
-                                                     'month',
-                                                     'day', 
-                                                     'hour',
-                                                     'minute']])
+# Note: 'timestamp' already built at parse time (replaces year/month/day/hour/minute)
 
 print('\n Number of .txt records:', buoy_data.count())
     # Note the lat/long count = 792. Those are the records in latest_obs.txt.
@@ -106,7 +103,7 @@ print('\n Number of .txt records:', buoy_data.count())
     # is the first observation in each station's record.
     
 ''' ```` remove when complete'''
-buoy_data = buoy_data.sample(frac=.1)
+buoy_data = buoy_data.sample(frac=.1, random_state=1)  # same sample for the same data
 ''' ^^^^ remove when complete '''
 
 #%%
@@ -114,51 +111,20 @@ buoy_data = buoy_data.sample(frac=.1)
 ## Buoy Data - WAVE SPECIFICS
 
 # Path of input files
-path = 'data_raw/spec/*.spec'
-out_path = 'data_clean/spec/'
+path = raw_dirs['.spec'] + '*.spec'
 
-# Process & append each file
-for file in glob.glob(path):
-    print(file)
-    n = 0
-    
-    with open(file, 'r') as input_file:
-        stem = os.path.splitext(os.path.basename(file))[0]
-        o_name = stem + '.csv'
-#        print(o_name)
-        out = open(out_path + o_name,'w',newline='')
-        o_csv = csv.writer(out)
-        
-        for line in input_file:
-            parts = line.split()
-            if n == 0:
-                o_csv.writerow(['station_id'] + parts)
-            elif n > 1:
-                o_csv.writerow([stem] + parts)
-            n += 1    
-        out.close()
-        
-#        assert False   # stops code after 1 iteration
-        
-# Append files into a Dataframe
-spec_data = pd.DataFrame()
-
-for file in glob.glob(out_path + '*.csv'):
-    raw_data = pd.read_csv(file)
-    raw_data = raw_data.rename(mydict, axis='columns')
-    spec_data = spec_data.append(raw_data)
-
-# create timestamp for index
-spec_data['timestamp'] = pd.to_datetime(spec_data[['year', 
-                                                     'month',
-                                                     'day', 
-                                                     'hour',
-                                                     'minute']])
+# Parse all files into one table
+spec_data = ndbc_parse.build_table(ndbc_parse.read_raw(path), names=mydict)
+
+if debug_csv:
+    ndbc_parse.write_debug_csv(spec_data, 'data_clean/spec/')
+
+# Note: 'timestamp' already built at parse time (replaces year/month/day/hour/minute)
 
 print('\n Number of .spec records:', spec_data.count())
 
 ''' ```` remove when complete'''
-spec_data = spec_data.sample(frac=.1)
+spec_data = spec_data.sample(frac=.1, random_state=1)
 ''' ^^^^ remove when complete '''
 
 #%%
@@ -167,29 +133,27 @@ spec_data = spec_data.sample(frac=.1)
 #
 
 ## Master list of buoys with lat/long
-buoys_raw = pd.read_csv('data_clean//latest_obs.csv')
-buoys_raw = buoys_raw.rename(mydict, axis='columns')
+with open('latest_obs.txt', 'rb') as fh:
+    buoys_raw = ndbc_parse.parse(fh.read(), names=mydict)
 buoys_all = buoys_raw[['station_id','latitude','longitude']]
 
 # Convert DataFrame to GeoDataFrame
 buoys_all = geopandas.GeoDataFrame(buoys_all, geometry=geopandas.points_from_xy(buoys_all.longitude,buoys_all.latitude))
-buoys_all = buoys_all.set_crs(epsg=3857, inplace= True)     
+buoys_all = buoys_all.set_crs(epsg=4326, inplace= True)  # lat/long degrees     
     # not having inplace= True killed me for hours! haha.
 buoys_all.crs
 
 ''' 
 buoys_all does not project the same as sites, buffers or wx_data
 '''
-# CHECK. Plot buoy locations
-fig,ax1 = plt.subplots(dpi=300, figsize=(12,12))
+# CHECK. Plot buoy locations (drawn in the background, skipped in production)
 print('\n buoys_all.crs: ', buoys_all.crs)
-buoys_all.plot(ax=ax1, edgecolors= 'black')
-plt.title('All NOAA Buoys')
-fig.savefig('2a_CHECK_buoy_all.svg', format='svg')
+render.add(figures.map_figure('2a_CHECK_buoy_all.svg',
+                              [(buoys_all, dict(edgecolors= 'black'))],
+                              title='All NOAA Buoys'))
 
 
-# Export layer to geopackage 
-buoys_all.to_file('splash_down.gpkg', layer='buoys_all', driver='GPKG')
+# Exported w/wx_data below, in one write (pipeline.py hands buoys_all to the next stage in memory)
 
 #%%
 
@@ -197,58 +161,56 @@ buoys_all.to_file('splash_down.gpkg', layer='buoys_all', driver='GPKG')
 # 2.b Merge datasets, attach lat/long & export
 #
 
-# Ensure merge column data types are the same
+# CHECK. Data types (same schema for all, see NOAA_columns.csv)
 print('\nbuoy_data:\n', buoy_data.dtypes)
 print('\nspec_data:\n', spec_data.dtypes)
 print('\nbuoys:\n', buoys_all.dtypes)
-convert_type = {'station_id':str}
-buoy_data = buoy_data.astype(convert_type)
-buoy_data.dtypes
-spec_data = spec_data.astype(convert_type)
-buoys_all = buoys_all.astype(convert_type)
-
-# Merge data w/same station id & timestamp
-merge = pd.merge(buoy_data, spec_data, how='left',on=['station_id', 'timestamp'])
-
-# Attach lat/long to entry, by station
-data = pd.merge(merge, buoys_all, how='left',on=['station_id'])
-
-# Look for duplicates
-dups = data.duplicated( subset=['station_id','timestamp'], keep=False )
-print( '\nduplicate records:', dups.sum() ) 
-data = data.drop_duplicates( subset=['station_id','timestamp'] )
-
-# CHECK. Duplicates
-dups = data.duplicated( subset=['station_id','timestamp'], keep=False )
-print( '\nduplicate records:', dups.sum() ) 
 
 # Keep pertinent data 
-keep = ['station_id','timestamp', 'latitude', 'longitude', 
-        'wind_spd', 'wind_gust', 'swell_height', 'swell_period',
-        'wind_wave_height', 'ave_period_x','steepness']
-data = data[ keep ]
-fix_names = {'latitude_y':'latitude', 
-             'longitude_y':'longitude' , 
-             'ave_period_x':'ave_period'}
-data = data.rename( fix_names, axis='columns' )
+keep_txt = ['wind_spd', 'wind_gust', 'ave_period']
+keep_spec = ['swell_height', 'swell_period', 'wind_wave_height', 'steepness']
+
+# Join .spec onto .txt w/same station id & timestamp & attach lat/long
+    # sorted merge per station, duplicates dropped & columns kept during the join
+if not len(spec_data):     # no new .spec rows
+    spec_data = pd.DataFrame(columns=['station_id', 'timestamp'] + keep_spec)
+if len(buoy_data):
+    data = obs_join.join(buoy_data, spec_data, buoys_raw, keep_txt, keep_spec)
+    print( '\nduplicate records dropped:', data.attrs['duplicates'] )
+else:
+    data = window.iloc[:0].copy()     # no new rows since the last run
 
 
 #
 ## Clean merged data
 #
 
-# Replace missing data with None
-data = data.replace(to_replace= 'MM' ,value= np.nan)# MM = missing measurement
-#data = data.fillna(0)
+# Note: 'MM' (missing measurement) is already NaN & columns are float,
+#       ndbc_parse types each column as the file is read
 
-# Ensure data types are correct for rasterizing
-col_name = ['wind_spd','wind_gust', 'swell_height', 'swell_period', 'wind_wave_height', 'ave_period']
+# Convert units
+data['wind_spd'] = round(data['wind_spd'] * obs_schema.KNOTS_TO_FTS,2)  # convert units: knots -> ft/sec
 
-for col in col_name:
-    data[ col ] = data[ col ].astype('float')
+# Incremental: new rows on top of the last window, repeats keep the newest reading
+if window is not None:
+    data = pd.concat([window, data], ignore_index=True)
+    data = data.drop_duplicates(subset=['station_id', 'timestamp'], keep='last')
+    data = obs_schema.apply(data).sort_values(['station_id', 'timestamp'], ignore_index=True)
+    # late .spec rows, for .txt rows already in the window
+    data, late = obs_join.update(data, spec_data, keep_spec)
+    print('\n .spec rows merged into the window:', int(late.sum()))
 
-# Convert units
-data['wind_spd'] = round(data['wind_spd'] * 1.68781,2)  # convert units: 1 knot = 1.68781 ft/sec
+# Keep the last 72 hrs (the realtime window)
+data = data[data['timestamp'] > data['timestamp'].max() - pd.Timedelta(hours=ndbc_download.KEEP_HOURS)]
+data = data.reset_index(drop=True)
+
+# Save the window, then empty the queue (rows in it are now part of the window)
+os.makedirs(os.path.dirname(window_file), exist_ok=True)
+data.to_parquet(window_file)
+ndbc_download.clear_pending()
+
+# CHECK. Compact schema (category ids, float32 measurements), same as every stage
+print('\n Memory (MB):', round(data.memory_usage(deep=True).sum() / 1e6, 1))
 
 #%%
 
@@ -258,14 +220,44 @@ data['wind_spd'] = round(data['wind_spd'] * 1.68781,2)  # convert units: 1 knot
 
 # Convert to GeoDataFrame 
 data = geopandas.GeoDataFrame(data,geometry=geopandas.points_from_xy(data.longitude, data.latitude))
-data = data.set_crs(epsg = 3857) # inplace=True?
+data = data.set_crs(epsg = 4326) # lat/long degrees
     # was MISSING this set_crs step
 
 print("\n Exporting 'wx_data':", data.crs)
 
-# Export
-data.to_file('splash_down.gpkg', layer='wx_data', driver='GPKG')
-data.to_pickle('cleaned_wx_data.pkl.zip')   #.zip auto compresses
+# Export - both layers written through Arrow (see gpkg_export.py)
+if pipeline.persist():
+    gpkg_export.write({'buoys_all': buoys_all, 'wx_data': data})
+    added = obs_store.append_new(data)    # only rows newer than obs_store/ holds per station
+    print('\n obs_store rows added:', added)
 
 print('\n Total:', len(data), 'records in file.')
+
+# Historical archives (yearly .txt.gz per station) -> obs_store/, same join & units
+    # streamed & parsed in chunks by a process pool; archives already loaded are skipped
+    # run as its own process - the pool's workers need backfill.py's __main__ guard
+    # (this script has none, a 'spawn' worker would run it all again)
+if backfill_archives and pipeline.persist():
+    subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backfill.py')],
+                   check=True)
 print('\n Column names:', list(data.columns))
+
+#%%
+
+#
+# 4. Raster interpolation
+#
+
+# Grid over the Gulf of Mexico & western Atlantic, 0.25 degree cells
+lat, lon = wx_grid.grid(**wx_grid.AREA, step=0.25)
+
+# Each cell: 8 nearest stations, weighted 1/distance^2, every 10 min
+    # evaluated in tiles of cells x chunks of time steps (bounded memory)
+field = wx_grid.interpolate(data, lat, lon, variables=wx_grid.VARIABLES, k=8, power=2)
+if pipeline.persist():
+    field.save()    # data_clean/wx_grid.npz
+
+print('\n Grid:', len(field.times), 'time steps x', len(lat), 'x', len(lon), 'cells')
+
+# Wait for the figures still being drawn
+print('\n Figures:', render.wait())
@@ -11,9 +11,11 @@
 ## User-input:
     # Landing sites as .csv 
     # Files of interest (i.e. .txt, .spec)
+    # production = True to skip the CHECK maps (or SPLASHDOWN_PRODUCTION=1)
 
 ## Outputs:
     # CHECK_buoy_all.svg to verify active reporting wx stations on map
+        # maps are drawn in the background & only when their data changed
     # splash_down.gpkg with layers:
         'sites',                   # All active buoys
         'buoy_selection_rings',    # Buffer rings around NASA sites
@@ -28,10 +30,19 @@
     # To add, (1) Open Anacoda Command Window, (2) enter commands below
     # `conda install contextily -c conda-forge`
     
+import numpy as np
 import pandas as pd
 import geopandas
-import matplotlib.pyplot as plt
-import fiona
+import station_index    # KD-tree, stations w/in R nm of each site
+import site_distance    # geodesic range rings
+import basemap          # pre-clipped, cached basemap layers (states)
+import figures          # background figure rendering
+import pipeline         # in-memory handoff when run by pipeline.py
+import gpkg_export      # bulk GeoPackage writer (pyogrio, Arrow)
+
+production = figures.PRODUCTION    # True = skip CHECK maps
+render = figures.Renderer(production=production)
+export = {}     # layers for splash_down.gpkg, written together at the end
 
 #%%
 #
@@ -56,42 +67,31 @@ sites = sites.drop(columns='Description')
 sites = pd.read_csv('NASA_sites.csv')
 
 # Convert DataFrame to GeoDataFrame
-sites = geopandas.GeoDataFrame(sites, geometry=geopandas.points_from_xy(sites.latitude,sites.longitude))
+sites = geopandas.GeoDataFrame(sites, geometry=geopandas.points_from_xy(sites.longitude,sites.latitude))
 sites = sites.set_index('Name')
-sites = sites.set_crs(epsg=3857, inplace= True) # EPSG:3857 for basemap
+sites = sites.set_crs(epsg=4326, inplace= True) # lat/long degrees (WGS84)
     # not having inplace= True killed me for hours! haha.
 print('\nsites.crs: ',sites.crs)
 
 ## CHECK Start - plot results on a map
 
-    # Basemap layer - U.S. States
-states = geopandas.read_file('cb_2018_us_state_500k.zip')
-
-fig,ax1 = plt.subplots(dpi=300, figsize=(12,12))
-
-    # Zoom into Continential US Area of Interest
-xlim = ([sites.total_bounds[0],  sites.total_bounds[2]])
-ylim = ([sites.total_bounds[1],  sites.total_bounds[3]])
-
-ax1.set_xlim(xlim)
-ax1.set_ylim(ylim)
-
-    # Stack layers
-sites.plot(ax=ax1, alpha= 0.9, facecolor='lightcoral', edgecolors= 'none', markersize=100)
-states.plot(ax=ax1, alpha= 0.2, facecolor='whitesmoke', edgecolors= 'grey', hatch= '///', markersize=50)
-
-    # Annotate Figure
-plt.title('NASA/SpaceX Splashdown Sites')
-# Label each lat/long point
-for x, y, label in zip(sites.geometry.x, sites.geometry.y, sites.index):
-    ax1.annotate(label, xy=(x, y), xytext=(3, 3), textcoords="offset points")
+    # Basemap layer - U.S. States, clipped to the area around the sites
+        # cached in cache/ after the 1st run (see basemap.py)
+bounds = basemap.aoi(sites)
+states = basemap.load('states', bounds)
+
+    # Zoom into Continential US Area of Interest, label each lat/long point
+render.add(figures.map_figure('3a_CHECK_sites_shapefile.png',
+                              [(sites, dict(alpha= 0.9, facecolor='lightcoral', edgecolors= 'none', markersize=100)),
+                               (states, dict(alpha= 0.2, facecolor='whitesmoke', edgecolors= 'grey', hatch= '///', markersize=50))],
+                              title='NASA/SpaceX Splashdown Sites', zoom=sites,
+                              labels=[(0, dict(xytext=(3, 3)))]))
     # code reference: https://matplotlib.org/stable/tutorials/text/annotations.html#plotting-guide-annotation
 
 # CHECK End
 
 # Export: 
-fig.savefig('3a_CHECK_sites_shapefile.png', format='png')
-sites.to_file('splash_down.gpkg', layer='NASA_sites', driver='GPKG')
+export['NASA_sites'] = sites
 
 #%%
 #
@@ -99,43 +99,32 @@ sites.to_file('splash_down.gpkg', layer='NASA_sites', driver='GPKG')
 #
 
 
-# Buffer: 2 degrees = 120 nautical miles (crs)
+radius_nm = 120     # selection radius around each site
+    # other radii & site lists side by side: scenario.py
+
+# Range rings: geodesic circles of radius_nm (was a planar 2 degree buffer)
 sites.crs
-site_buffers = sites.buffer( 2 ) 
-site_buffers.crs
-site_buffers = site_buffers.to_crs(epsg=3857)
+site_buffers = geopandas.GeoSeries(site_distance.circles(sites.latitude, sites.longitude, radius_nm),
+                                   index=sites.index, crs=4326)
 print('\n site_buffers.crs: ',site_buffers.crs)
 
 
 ## CHECK Start - plot results on a map
 
-fig,ax1 = plt.subplots(dpi=300, figsize=(12,12))
-
     # Auto zoom into Continential US Area of Interest
         # uses the 'bounds' or extent of the site_buffers' layer
-xlim = ([site_buffers.total_bounds[0],  site_buffers.total_bounds[2]])
-ylim = ([site_buffers.total_bounds[1],  site_buffers.total_bounds[3]])
-
-ax1.set_xlim(xlim)
-ax1.set_ylim(ylim)
-
-    # Stack layers
     # Plot rings & sites
-site_buffers.plot(ax=ax1, alpha= 0.2, facecolor='red', edgecolors= 'none', markersize=50 )
-sites.plot(ax=ax1, alpha= 0.9, facecolor='red', edgecolors= 'none', markersize=100)
-states.plot(ax=ax1, alpha= 0.2, facecolor='whitesmoke', edgecolors= 'grey', hatch= '///', markersize=50)
-
-    # Annotate Figure
-plt.title('NASA/SpaceX Splashdown Sites, buffer')
-for x, y, label in zip(sites.geometry.x, sites.geometry.y, sites.index):
-    ax1.annotate(label, xy=(x, y), xytext=(3, 3), textcoords="offset points")    
-
-fig.savefig('3b_CHECK_buoy_selection_rings.png', format='png')
+render.add(figures.map_figure('3b_CHECK_buoy_selection_rings.png',
+                              [(site_buffers, dict(alpha= 0.2, facecolor='red', edgecolors= 'none', markersize=50)),
+                               (sites, dict(alpha= 0.9, facecolor='red', edgecolors= 'none', markersize=100)),
+                               (states, dict(alpha= 0.2, facecolor='whitesmoke', edgecolors= 'grey', hatch= '///', markersize=50))],
+                              title='NASA/SpaceX Splashdown Sites, buffer', zoom=site_buffers,
+                              labels=[(1, dict(xytext=(3, 3)))]))
 
 ## CHECK End
 
 # Export: add new layer to geopackage 
-site_buffers.to_file('splash_down.gpkg', layer='buoy_selection_rings', driver='GPKG')
+export['buoy_selection_rings'] = site_buffers
 
 
 #%%
@@ -145,93 +134,85 @@ site_buffers.to_file('splash_down.gpkg', layer='buoy_selection_rings', driver='G
 #
 
 
-# Import buoys from geopackage.
-buoys = geopandas.read_file('splash_down.gpkg', layer='buoys_all')
+# Buoys from '2. clean_input_data.py' - in memory from pipeline.py, else the geopackage
+buoys = pipeline.handoff('buoys_all', lambda: geopandas.read_file('splash_down.gpkg', layer='buoys_all'))
 buoys.crs
-buoys = buoys.to_crs(epsg=3857)
+buoys = buoys.to_crs(epsg=4326)
 print('\n buoys.crs: ', buoys.crs)
 
 ## CHECK Start - plot results on a map
 
-fig,ax1 = plt.subplots(dpi=300, figsize=(12,12))
-buoys.plot(ax=ax1, edgecolors= 'black')
-
-    # Confirm buffers crs matches points.
-site_buffers = geopandas.read_file('splash_down.gpkg', layer='buoy_selection_rings')
+    # Confirm buffers crs matches points (site_buffers still in memory, no read back)
 site_buffers.crs
-site_buffers = site_buffers.to_crs(epsg=3857)
 
-    # CHECK: plot both together
-fig,ax1 = plt.subplots(dpi=300, figsize=(12,12))
-plt.title('All NOAA Buoys & NASA Site range rings (red)')
-
-    # Zoom into Continential US Area of Interest
-xlim = ([site_buffers.total_bounds[0],  site_buffers.total_bounds[2]])
-ylim = ([site_buffers.total_bounds[1],  site_buffers.total_bounds[3]])
-
-ax1.set_xlim(xlim)
-ax1.set_ylim(ylim)
-
-    # Stack layers
-buoys.plot(ax=ax1, facecolor='none', edgecolors= 'black', markersize=5)
-sites.plot(ax=ax1, alpha= 0.9, facecolor='red', edgecolors= 'none', markersize=100)
-states.plot(ax=ax1, alpha= 0.2, facecolor='whitesmoke', edgecolors= 'grey', hatch= '///', markersize=50)
-site_buffers.plot(ax=ax1, alpha= 0.1, facecolor='red', edgecolors= 'none', markersize=50 )
-
-    # Annotate Figure
-plt.title('NASA/SpaceX Splashdown Sites, buffer')
-for x, y, label in zip(sites.geometry.x, sites.geometry.y, sites.index):
-    ax1.annotate(label, xy=(x, y), xytext=(3, 3), textcoords="offset points")    
-    
-fig.savefig('3c_CHECK_buoys_&_selection_rings.png', format='png')
+    # CHECK: plot both together, zoom into Continential US Area of Interest
+render.add(figures.map_figure('3c_CHECK_buoys_&_selection_rings.png',
+                              [(buoys, dict(facecolor='none', edgecolors= 'black', markersize=5)),
+                               (sites, dict(alpha= 0.9, facecolor='red', edgecolors= 'none', markersize=100)),
+                               (states, dict(alpha= 0.2, facecolor='whitesmoke', edgecolors= 'grey', hatch= '///', markersize=50)),
+                               (site_buffers, dict(alpha= 0.1, facecolor='red', edgecolors= 'none', markersize=50))],
+                              title='NASA/SpaceX Splashdown Sites, buffer', zoom=site_buffers,
+                              labels=[(1, dict(xytext=(3, 3)))]))
 
 ## CHECK End
 
 #%%
 #
-# Select buoys within buffers
+# Select buoys within radius_nm of each site
 #
 
-in_buffer = geopandas.overlay(site_buffers, buoys, how='intersection', keep_geom_type=False)
-   # Ref: https://geopandas.org/docs/user_guide/set_operations.html
+# Spatial index (KD-tree) over station lat/long, built once
+    # great-circle distance, no buffer polygons or overlay needed
+index = station_index.StationIndex.from_frame(buoys)
+in_range = index.within_sites(sites, radius_nm)
+
+# Attach station layer (lat/long & point) to each site/station pair
+in_buffer = buoys.merge(in_range, on='station_id', how='inner')
+in_buffer = in_buffer[['Name', 'station_id', 'distance_nm', 'latitude', 'longitude', 'geometry']]
 
 print('\nNOAA Stations near Splashdown Sites:\n', in_buffer.count())
 
 # CHECK Start - plot results on a map
 
-fig,ax1 = plt.subplots(dpi=300, figsize=(12,12))
-plt.title('NOAA Buoys in NASA Site range rings (red)')
-
     # Zoom into Continential US Area of Interest
-xlim = ([site_buffers.total_bounds[0],  site_buffers.total_bounds[2]])
-ylim = ([site_buffers.total_bounds[1],  site_buffers.total_bounds[3]])
-
-ax1.set_xlim(xlim)
-ax1.set_ylim(ylim)
-
-    # Stack layers
     # Plot rings & sites
-in_buffer.plot(ax=ax1, facecolor='none', edgecolors= 'black', markersize=5)
-sites.plot(ax=ax1, alpha= 0.9, facecolor='red', edgecolors= 'none', markersize=100)
-states.plot(ax=ax1, alpha= 0.2, facecolor='whitesmoke', edgecolors= 'grey', hatch= '///', markersize=50)
-site_buffers.plot(ax=ax1, alpha= 0.1, facecolor='red', edgecolors= 'none', markersize=50 )
-
-
-fig.savefig('3d_CHECK_buoys_inBuffer.svg', format='svg')
+render.add(figures.map_figure('3d_CHECK_buoys_inBuffer.svg',
+                              [(in_buffer, dict(facecolor='none', edgecolors= 'black', markersize=5)),
+                               (sites, dict(alpha= 0.9, facecolor='red', edgecolors= 'none', markersize=100)),
+                               (states, dict(alpha= 0.2, facecolor='whitesmoke', edgecolors= 'grey', hatch= '///', markersize=50)),
+                               (site_buffers, dict(alpha= 0.1, facecolor='red', edgecolors= 'none', markersize=50))],
+                              title='NOAA Buoys in NASA Site range rings (red)', zoom=site_buffers))
 
 ## CHECK End
 
 # Export: add new layer to geopackage 
-in_buffer.to_file('splash_down.gpkg', layer='nearby_wx_stations', driver='GPKG')
+export['nearby_wx_stations'] = in_buffer
 in_buffer.columns
 
 #%%
 
-# List all layers within a geopackage
-for layername in fiona.listlayers('splash_down.gpkg'):
-    with fiona.open('splash_down.gpkg', layer=layername) as src:
-        print('layer name:', layername, '|| records:', len(src))
-        
-    # Ref: https://fiona.readthedocs.io/en/latest/README.html#reading-multilayer-data
-    
+#
+# Nearest stations per site
+#
+
+# Same KD-tree as the selection above (no site x station matrix needed)
+rows, dist = index.nearest(sites.latitude, sites.longitude, k=3)
+nearest = pd.DataFrame({'Name': np.repeat(sites.index, rows.shape[1]),
+                        'rank': np.tile(np.arange(1, rows.shape[1] + 1), len(sites)),
+                        'station_id': index.station_ids[rows.ravel()],
+                        'distance_nm': dist.ravel()})
+print('\n Nearest 3 NOAA stations per site:\n', nearest)
+
+#%%
+
+# Write the new layers & list all layers within the geopackage
+    # (only written when persisting; counts come from the gpkg metadata, no layer is read)
+if pipeline.persist():
+    gpkg_export.write(export)
+    for layername, records in gpkg_export.layer_counts().items():
+        print('layer name:', layername, '|| records:', records)
+
+# Wait for the maps still being drawn
+print('\n Figures:', render.wait())
+
 print('\n .py Complete')
\ No newline at end of file
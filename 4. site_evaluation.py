@@ -4,18 +4,27 @@
 
 import pandas as pd
 import geopandas
-import matplotlib.pyplot as plt
-import seaborn as sns
-import fiona
+import obs_store    # Parquet observation store (by station & date)
+import wx_grid      # gridded wind & wave fields from '2. clean_input_data.py'
+import cg_coverage  # cached CG response areas (land clipped)
+import basemap      # pre-clipped, cached basemap layers
+import figures      # background figure rendering (charts & maps)
+import pipeline     # in-memory handoff when run by pipeline.py
+import gpkg_export  # bulk GeoPackage writer (pyogrio, Arrow)
+import criteria     # splashdown Go / Marginal / No-Go rules
+import site_window  # rolling 72 hr per-site aggregates
+import site_series  # site time series on a common 10 min grid
+
+# Figures are drawn in the background & only when their data changed
+render = figures.Renderer(production=figures.PRODUCTION)
 
 #%%
 
-# List all layers within a geopackage
-for layername in fiona.listlayers('splash_down.gpkg'):
-    with fiona.open('splash_down.gpkg', layer=layername) as src:
-        print('layer name:', layername, '|| records:', len(src))
-        
-    # Ref: https://fiona.readthedocs.io/en/latest/README.html#reading-multilayer-data
+# List all layers within a geopackage (only written when persisting)
+    # counts come from the gpkg metadata, no layer is read
+if pipeline.persist():
+    for layername, records in gpkg_export.layer_counts().items():
+        print('layer name:', layername, '|| records:', records)
     
 #%%%
 
@@ -23,22 +32,17 @@ for layername in fiona.listlayers('splash_down.gpkg'):
 # Number of weather stations per site
 #
 
-nearby = geopandas.read_file('splash_down.gpkg', layer='nearby_wx_stations')
+# From '3. landing_site_data.py' - in memory from pipeline.py, else the geopackage
+nearby = pipeline.handoff('nearby', lambda: geopandas.read_file('splash_down.gpkg', layer='nearby_wx_stations'))
 nearby.crs
 
 per_site = nearby.value_counts('Name')
 
 # Plot Bar Chart
 
-fig, ax1 = plt.subplots(dpi=300)
-fig.subplots_adjust(left=0.25)
-ax = per_site.plot.barh()
-ax.set_ylabel('Splashdown Site')
-ax.set_xlabel('NOAA Stations within 120nm')
-ax.set_title('Nearby Active NOAA Weather Stations')
-ax.tick_params(axis='y', rotation= 40)
-
-fig.savefig('4a_WxStations_per_site.svg', format='svg')
+render.add(figures.chart('4a_WxStations_per_site.svg', 'barh', per_site,
+                         ylabel='Splashdown Site', xlabel='NOAA Stations within 120nm',
+                         title='Nearby Active NOAA Weather Stations'))
 
 
 
@@ -48,8 +52,17 @@ fig.savefig('4a_WxStations_per_site.svg', format='svg')
 #   Join & pull last 72 hr weather reports from stations in buffer
 #
 
-# Read in data
-wx = pd.read_pickle( 'cleaned_wx_data.pkl.zip' )
+# Read in data - only nearby stations & the columns used below
+    # in memory from '2. clean_input_data.py' via pipeline.py, else obs_store/
+    # (only its last 72 hrs - it may hold years, see backfill.py)
+stations = nearby['station_id'].unique()
+columns = ['latitude', 'longitude', 'wind_spd', 'wind_gust',
+           'swell_height', 'swell_period', 'wind_wave_height',
+           'ave_period', 'steepness']
+wx = pipeline.handoff('wx_data', lambda: obs_store.read(
+    stations=stations, start=obs_store.window_start(stations=stations), columns=columns))
+wx = wx.loc[wx['station_id'].isin(stations), ['station_id', 'timestamp'] + columns]
+wx = geopandas.GeoDataFrame(wx, geometry=geopandas.points_from_xy(wx.longitude, wx.latitude), crs=4326)
 wx.columns
 wx.shape
 
@@ -89,123 +102,132 @@ nearby_wx.sample(10)
 # By Timestamp per location, wind and waves last 72 hours
 #
 
-# Group by datetime & site, wind
-by_site_wind = nearby_wx.groupby([nearby_wx['timestamp'], 'Name'])['wind_bin'].mean()
-by_site_wind = by_site_wind.to_frame()
+# Every station put on a common 10 min grid (stations report at different minutes),
+# all metrics averaged per site in one pass -> dense site x time x metric array
+    # see site_series.py; replaces the groupby on raw timestamps
+series = site_series.resample(wx, nearby, ['wind_spd', 'wind_gust', 'wind_wave_height',
+                                           'swell_height', 'ave_period'], freq='10min')
+print('\nSite series (sites, 10 min steps, metrics):', series.values.shape)
 
-# Group by datetime & site, wave height
-by_site_waveHt = nearby_wx.groupby([nearby_wx['timestamp'], 'Name'])['wave_ht_bin'].mean()
-by_site_waveHt = by_site_waveHt.to_frame()
+# Long table for the timeseries plots, index (timestamp, Name)
+by_timestamp = series.long()[['wind_spd', 'wind_wave_height']]
 
-# Combine (merge) both databases
-by_timestamp = by_site_wind.merge(by_site_waveHt, 
-                      on=['timestamp','Name'], 
-                      how='inner', 
-                      validate='1:1', 
-                      indicator=True)
-# CHECK
-print('\nResult of Inner Join:', by_timestamp.value_counts('_merge'))
-by_timestamp = by_timestamp.drop(['_merge'], axis='columns')
+#
+# Current 72 hr picture per site, kept up to date between runs
+#
+
+# Ring buffer per station & running per-site aggregates (see site_window.py)
+    # only observations not seen by the last run are added, expired ones evicted
+window = site_window.SiteWindow.load(nearby)
+added = window.update(wx)
+if pipeline.persist():
+    window.save()    # cache/site_window.pkl
 
+site_picture = window.snapshot(q=(50, 90))
+print('\n72 hrs to', window.latest, '| new observations:', added)
+print('\nWind (ft/sec) & wave ht per site:\n', site_picture.round(2))
 
 #%%
 
 #
-# Plots
+# Wind & waves at each site from the interpolated grid
+#   (every site gets a value, not only the ones w/nearby buoys)
 #
 
+field = pipeline.handoff('field', wx_grid.Field.load)    # data_clean/wx_grid.npz
+sites = pipeline.handoff('sites', lambda: geopandas.read_file('splash_down.gpkg', layer='NASA_sites')
+                                           .set_index('Name'))
 
-#
-# Violin. Location with wind & wave
-#
+# Bilinear sample at each site -> rows timestamp, columns site Name
+site_wind = field.at(sites['latitude'], sites['longitude'], 'wind_spd')
+site_wind.columns = sites.index
+site_waveHt = field.at(sites['latitude'], sites['longitude'], 'wind_wave_height')
+site_waveHt.columns = sites.index
 
-#   Reference: https://seaborn.pydata.org/generated/seaborn.violinplot.html
-#              https://datavizpyr.com/how-to-make-violinpot-with-data-points-in-seaborn/
+# CHECK. Max over last 72 hrs per site
+print('\nGridded max wind (ft/sec):\n', site_wind.max().round(1))
+print('\nGridded max wave ht (ft):\n', site_waveHt.max().round(2))
 
-fig, ax1 = plt.subplots()
-sns.set_context('paper') # quality of output
 
-ax1 = sns.violinplot(y='wind_bin', x='Name',data= nearby_wx)
-fig.suptitle('Previous 72 hours, wind')
-ax1.set_ylabel('ft/sec')
-ax1.set_xlabel('Splashdown Site')
-ax1.tick_params(axis='x', rotation= 20)
-ax1.axhline(15)
-fig.tight_layout()
-fig.savefig("4b_wind_byLocation_violinplot.png", format='png',dpi=300)
+#%%
 
 #
-# BoxenPlot. Location with wind & wave
+# Splashdown criteria. Go / Marginal / No-Go per site, every 10 min
 #
 
-fig, ax1 = plt.subplots()
-sns.set_context('paper') # quality of output
-ax1 = sns.boxenplot(y='wave_ht_bin', x='Name',data= nearby_wx)
-    # usage = Y variable
-    # by= = X variable
-    # ax=ax1 - put the graph on ax1
-    # grid=False - no grid lines
-fig.suptitle('Previous 72 hours, swell height')
-ax1.set_ylabel('feet')
-ax1.set_xlabel('Splashdown Site')
-ax1.tick_params(axis='x', rotation= 20)
-fig.tight_layout()
-fig.savefig("4c_wave_byLocation_boxenplot.png", format='png',dpi=300)
+# Thresholds from splashdown_criteria.csv (README requirements, enabled rules only)
+    # Marginal = between the Go & No-Go limits, or no data for a rule
+rules = criteria.load()
+print('\nSplashdown criteria:\n', rules[['rule', 'metric', 'op', 'go', 'no_go', 'units']])
+
+# Site x time arrays of each metric the rules need, from the grid
+site_metrics = {name: field.at(sites['latitude'], sites['longitude'], name).to_numpy().T
+                for name in criteria.inputs(rules) if name in field.data}
+status = criteria.evaluate(site_metrics, rules, sites.index, field.times)
+
+# Timeline (rows timestamp, columns site Name) & which rule failed, when
+site_status = status.timeline()
+status_report = status.report()
+site_latest = status.latest()
+print('\nLatest status per site:\n', site_latest[['Name', 'status', 'rule', 'value', 'limit', 'reason']])
+print('\nTime steps per status:\n', site_status.apply(pd.Series.value_counts).fillna(0).astype(int).T)
+print('\nNo-Go periods:\n', status_report[status_report['status'] == 'No-Go']
+      .groupby(['Name', 'rule'])['steps'].sum())
+
+# Same rules on the station readings near each site (10 min series, no grid)
+    # sites w/o nearby stations are left out
+observed = criteria.evaluate(series.arrays(), rules, series.sites, series.times)
+print('\nLatest status per site, nearby stations:\n',
+      observed.latest()[['Name', 'status', 'rule', 'value', 'limit', 'reason']])
 
 
 #%%
 
 #
-# Timeseries plot of 72 hours
+# Plots
 #
 
-#All Data
 
-# hourly timestamp 
-by_time = by_timestamp.sample(frac= 1)
+#
+# Violin. Location with wind & wave
+#
 
-# Wind, by location
-fig, ax1 = plt.subplots()
-fig.suptitle('Previous 72 hours, average wind by site')
-ax1.set_title('All 1.6 million records')
-sns.set_context('paper') # quality of output
-ax1.axhline(15)
-ax1 = by_time.groupby('Name')['wind_bin'].plot(legend=True)
-plt.legend(loc='upper left', prop={'size':6})
-fig.tight_layout()
-fig.savefig("4d_timeseries_wind_byLocation.png", format='png',dpi=300)
+#   Reference: https://seaborn.pydata.org/generated/seaborn.violinplot.html
+#              https://datavizpyr.com/how-to-make-violinpot-with-data-points-in-seaborn/
 
-#Sample #1
+render.add(figures.chart('4b_wind_byLocation_violinplot.png', 'violin',
+                         nearby_wx[['Name', 'wind_bin']], y='wind_bin', x='Name',
+                         suptitle='Previous 72 hours, wind', ylabel='ft/sec',
+                         xlabel='Splashdown Site', axhline=15))
 
-# hourly timestamp 
-by_time = by_timestamp.sample(frac= 0.1)
+#
+# BoxenPlot. Location with wind & wave
+#
 
-# Wind, by location
-fig, ax1 = plt.subplots()
-fig.suptitle('Previous 72 hours, average wind by site')
-ax1.set_title('Sample #1 - 10% of 1.6 million records')
-sns.set_context('paper') # quality of output
-ax1.axhline(15)
-ax1 = by_time.groupby('Name')['wind_bin'].plot(legend='left')
-plt.legend(loc='upper left', prop={'size':6})
-fig.tight_layout()
-fig.savefig("4e_timeseries_wind_byLocation.png", format='png',dpi=300)
+render.add(figures.chart('4c_wave_byLocation_boxenplot.png', 'boxen',
+                         nearby_wx[['Name', 'wave_ht_bin']], y='wave_ht_bin', x='Name',
+                         suptitle='Previous 72 hours, swell height', ylabel='feet',
+                         xlabel='Splashdown Site'))
+    # y = Y variable, x = X variable (by site)
 
-## Sample #2
 
-# hourly timestamp 
-by_time = by_timestamp.sample(frac= 0.1)
+#%%
 
-# Wind, by location
-fig, ax1 = plt.subplots()
-fig.suptitle('Previous 72 hours, average wind by site')
-ax1.set_title('Sample #2 - 10% of 1.6 million records')
-sns.set_context('paper') # quality of output
-ax1.axhline(15)
-ax1 = by_time.groupby('Name')['wind_bin'].plot(legend=True)
-plt.legend(loc='upper left', prop={'size':6})
-fig.tight_layout()
-fig.savefig("4f_timeseries_wind_byLocation.png", format='png',dpi=300)
+#
+# Timeseries plot of 72 hours
+#
+
+# Wind, by location - all data & two 10% samples
+    # fixed random_state, so the samples (& figures) only change w/the data
+timeseries = [('4d_timeseries_wind_byLocation.png', 1, 'All 1.6 million records'),
+              ('4e_timeseries_wind_byLocation.png', 0.1, 'Sample #1 - 10% of 1.6 million records'),
+              ('4f_timeseries_wind_byLocation.png', 0.1, 'Sample #2 - 10% of 1.6 million records')]
+
+for n, (path, frac, title) in enumerate(timeseries):
+    by_time = by_timestamp.sample(frac= frac, random_state=n)
+    render.add(figures.chart(path, 'timeseries', by_time, by='Name', y='wind_spd',
+                             suptitle='Previous 72 hours, average wind by site',
+                             title=title, axhline=15))
 
 
 
@@ -251,72 +273,56 @@ plt.show()
  
 # Basemap layers
 
+    # NASA/SpaceX Sites (already read above)
+sites.crs
+
+    # Area of interest around the sites - basemaps are clipped to it & cached
+        # see basemap.py; 1st run reads the national .zip files, later runs cache/
+bounds = basemap.aoi(sites)
+
     # States polygons
-states = geopandas.read_file('cb_2018_us_state_500k.zip')
-states.plot()
+states = basemap.load('states', bounds)
  
     # 12nm Territorial Sea
-territorial_sea = geopandas.read_file('US_Maritime_Limits_Boundaries_Map_Service_Layer.zip')
+territorial_sea = basemap.load('territorial_sea', bounds)
         # https://hub.arcgis.com/datasets/44f58c599b1e4f7192df9d4d10b7ddcf_1?geometry=-161.895%2C-12.805%2C161.895%2C73.355
-territorial_sea.plot()
-   
-    # NASA/SpaceX Sites
-sites = geopandas.read_file('splash_down.gpkg', layer='NASA_sites')
-sites = sites.set_index('Name')
-sites.plot()
 
 
 #
 #  CG 1hr transit time
 # 
 
-# Created GeoDataFrame from .csv
-CG_units_raw = pd.read_csv('CG_units.csv')
-CG_units = geopandas.GeoDataFrame(CG_units_raw, geometry=geopandas.points_from_xy(CG_units_raw.Longitude,CG_units_raw.Latitude))
-CG_units = CG_units.set_crs(epsg=3857, inplace= True)     
+# Land-clipped 1hr response areas, built once per CG_units.csv version
+    # range = Transit_Spd (knots) x 1 hr, geodesic ring in lat/long (EPSG:4326)
+    # cached in cache/ - no overlay against states unless the inputs change
+coverage = cg_coverage.Coverage.load('CG_units.csv', 'cb_2018_us_state_500k.zip', minutes=60)
+
+CG_units = coverage.units.set_index("Unit")
 CG_units.crs
-CG_units = CG_units.set_index("Unit")
+CG_buffer = coverage.areas
 
-# Calculate & Create 1hr CG response range
-CG_units['1hr_resp'] = CG_units['Transit_Spd']*.05
-CG_buff = CG_units.buffer( CG_units['1hr_resp'] )
- 
-# Convert to Dataframe, for clipping with state polygons
-CG_buff = CG_buff.to_frame()
-    # Convert to GeoDataFrame, for overlay module 
-CG_buffer = geopandas.GeoDataFrame(CG_buff, crs=3857,geometry= CG_buff[ 0 ] )
-    # Remove any buffer over land
-CG_buffer = geopandas.overlay(CG_buff, states, how='difference')
-CG_buffer.plot()
+# Which units reach each site within 1 hr
+site_units = coverage.reach_sites(sites)
+print('\nCG units w/in 1hr of each site:\n', site_units.round(1))
+print('\nUnits per site:\n', site_units.value_counts('Name').reindex(sites.index, fill_value=0))
 #%%
-## CHECK Start - plot results on a map
-
-fig,ax1 = plt.subplots(dpi=300, figsize=(12,12))
-plt.title('NASA/SpaceX Splashdown Sites vs USCG 1-hr range')
-
-    # Zoom into Continential US Area of Interest
-xlim = ([CG_buffer.total_bounds[0],  CG_buffer.total_bounds[2]])
-ylim = ([CG_buffer.total_bounds[1],  CG_buffer.total_bounds[3]])
-
-ax1.set_xlim(xlim)
-ax1.set_ylim(ylim)
-
-    # Stack layers
-CG_units.plot(ax=ax1, alpha= 0.9, facecolor='lightskyblue', edgecolors= 'blue', markersize=75)
-CG_buffer.plot(ax=ax1, alpha= 0.2, facecolor='lightskyblue', edgecolors= 'none', markersize=50 )
-
-sites.plot(ax=ax1, alpha= 0.9, facecolor='red', edgecolors= 'red', markersize=100)
-territorial_sea.plot(ax=ax1, alpha= 0.8)
-states.plot(ax=ax1, alpha= 0.2, facecolor='whitesmoke', edgecolors= 'grey', hatch= '///', markersize=50)
+## Plot results on a map
+
+    # Zoom into Continential US Area of Interest (CG response areas)
+    # Stack layers, annotate sites & CG units
+render.add(figures.map_figure('4g_SpaceXsites_vs-USCG.png',
+                              [(CG_units, dict(alpha= 0.9, facecolor='lightskyblue', edgecolors= 'blue', markersize=75)),
+                               (CG_buffer, dict(alpha= 0.2, facecolor='lightskyblue', edgecolors= 'none', markersize=50)),
+                               (sites, dict(alpha= 0.9, facecolor='red', edgecolors= 'red', markersize=100)),
+                               (territorial_sea, dict(alpha= 0.8)),
+                               (states, dict(alpha= 0.2, facecolor='whitesmoke', edgecolors= 'grey', hatch= '///', markersize=50))],
+                              title='NASA/SpaceX Splashdown Sites vs USCG 1-hr range', zoom=CG_buffer,
+                              labels=[(2, dict(xytext=(3, 3))), (0, dict(xytext=(1, 1), size= 5))]))
         # Color options: https://matplotlib.org/stable/gallery/color/named_colors.html
 
-    # Annotate figure
-for x, y, label in zip(sites.geometry.x, sites.geometry.y, sites.index):
-    ax1.annotate(label, xy=(x, y), xytext=(3, 3), textcoords="offset points")    
-
-for x, y, label in zip(CG_units.geometry.x, CG_units.geometry.y, CG_units.index):
-    ax1.annotate(label, xy=(x, y), xytext=(1, 1), textcoords="offset points", size= 5)
-
 # Export 
-fig.savefig('4g_SpaceXsites_vs-USCG.png', format='png')
-CG_units.to_file('splash_down.gpkg', layer='CG_units', driver='GPKG')
+if pipeline.persist():
+    gpkg_export.write({'CG_units': CG_units})
+
+# Wait for the figures still being drawn
+print('\n Figures:', render.wait())
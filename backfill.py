@@ -0,0 +1,187 @@
+#
+## Purpose
+#
+    # Backfill obs_store/ w/NDBC historical archives (multi-year context,
+    # realtime2 only holds the last 45 days & the scripts use 72 hrs)
+    # 1. Yearly archives per station, same columns as realtime2:
+        # stdmet  <station>h<year>.txt.gz    (wind, gust, periods ...)
+        # spec    spec/<station>h<year>.spec.gz, joined if present (NDBC
+        #         archives no wave summary files; collected ones can be added)
+    # 2. Read as streams: gzip decompressed & parsed chunk by chunk
+    #    (ndbc_parse.read_stream), local files or straight from the NDBC
+    #    site - no unzipped copy, memory ~ chunk_rows x workers
+    # 3. Process pool: one task per station & year archive, so stations
+    #    are parsed in parallel; each task writes its chunks to obs_store/
+    # 4. Resumable: a manifest (obs_store/_backfill.json) lists finished
+    #    archives, a rerun skips them. An archive cut off midway has its
+    #    chunk files (bf-<archive>-...) removed & is written again - no duplicates
+    # 5. Same join, columns & units as '2. clean_input_data.py'
+
+## Run from the data folder (as for the scripts):
+    # python backfill.py                                         # archives in data_raw/historical/
+    # python backfill.py --stations 42036 41009 --years 2019 2020  # streamed from NDBC
+    # python backfill.py --workers 4 --chunk-rows 100000
+    # or backfill_archives = True in '2. clean_input_data.py' (runs python backfill.py)
+
+import argparse
+import glob
+import gzip
+import os
+import re
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import ndbc_download
+import ndbc_parse
+import obs_join
+import obs_schema
+import obs_store
+
+ARCHIVE_DIR = 'data_raw/historical/'
+HISTORICAL_URL = 'https://www.ndbc.noaa.gov/data/historical/stdmet/'
+MANIFEST = os.path.join(obs_store.STORE, '_backfill.json')  # '_' files are not read as data
+CHUNK_ROWS = 200_000
+
+# Same columns & units as '2. clean_input_data.py'
+KEEP_TXT = ['wind_spd', 'wind_gust', 'ave_period']
+KEEP_SPEC = ['swell_height', 'swell_period', 'wind_wave_height', 'steepness']
+
+ARCHIVE_NAME = re.compile(r'^(?P<station>\w+?)h(?P<year>\d{4})\.txt\.gz$', re.IGNORECASE)
+
+
+def local_archives(folder=ARCHIVE_DIR):
+    """Archive jobs for the .txt.gz files in folder (spec/ counterparts attached)."""
+    jobs = []
+    for path in sorted(glob.glob(os.path.join(folder, '*.txt.gz'))):
+        match = ARCHIVE_NAME.match(os.path.basename(path))
+        if not match:
+            continue
+        spec = os.path.join(folder, 'spec', os.path.basename(path)[:-len('.txt.gz')] + '.spec.gz')
+        stat = os.stat(path)
+        jobs.append({'name': os.path.basename(path), 'station': match['station'].upper(),
+                     'txt': path, 'spec': spec if os.path.exists(spec) else None,
+                     'version': '%d|%d' % (stat.st_size, stat.st_mtime_ns)})
+    return jobs
+
+
+def remote_archives(stations, years, base_url=HISTORICAL_URL):
+    """Archive jobs streamed from the NDBC historical stdmet folder."""
+    return [{'name': '%sh%d.txt.gz' % (str(s).lower(), y), 'station': str(s).upper(),
+             'txt': base_url + '%sh%d.txt.gz' % (str(s).lower(), y), 'spec': None, 'version': 'remote'}
+            for s in stations for y in years]
+
+
+def _open(source, timeout=60):
+    # binary stream of the decompressed archive
+    if re.match(r'https?://', source):
+        try:
+            return gzip.GzipFile(fileobj=urllib.request.urlopen(source, timeout=timeout))
+        except urllib.error.HTTPError as e:     # plain error, it goes back from a worker process
+            raise OSError('HTTP %d %s' % (e.code, source)) from None
+    return gzip.open(source, 'rb')
+
+
+def ingest(job, positions, store=obs_store.STORE, chunk_rows=CHUNK_ROWS):
+    """One archive -> obs_store/ chunk by chunk (runs in a worker process).
+
+    positions  station_id, latitude, longitude (i.e. from latest_obs.txt)
+    Returns (name, rows written, duplicates dropped, seconds).
+    """
+    started = time.time()
+    names = ndbc_parse.column_names()
+    spec = pd.DataFrame(columns=['station_id', 'timestamp'] + KEEP_SPEC)
+    if job['spec']:     # one station & year of wave summaries, small
+        with _open(job['spec']) as stream:
+            parts = list(ndbc_parse.read_stream(stream, job['station'], names, chunk_rows))
+        spec = pd.concat(parts, ignore_index=True) if parts else spec
+
+    # Files of an earlier, unfinished run of this archive (any chunk size)
+    stem = job['name'].split('.')[0]
+    for path in glob.glob(os.path.join(store, 'station_id=%s' % job['station'], '*', 'bf-%s-*.parquet' % stem)):
+        os.remove(path)
+
+    rows = dups = 0
+    with _open(job['txt']) as stream:
+        for k, txt in enumerate(ndbc_parse.read_stream(stream, job['station'], names, chunk_rows)):
+            if not len(txt):
+                continue
+            data = obs_join.join(txt, spec, positions, KEEP_TXT, KEEP_SPEC)
+            data['wind_spd'] = round(data['wind_spd'] * obs_schema.KNOTS_TO_FTS, 2)
+            obs_store.write(data, path=store, basename='bf-%s-%d-{i}.parquet' % (stem, k))
+            rows += len(data)
+            dups += data.attrs['duplicates']
+    return job['name'], rows, dups, time.time() - started
+
+
+def run(jobs, positions, store=obs_store.STORE, manifest=MANIFEST, workers=None,
+        chunk_rows=CHUNK_ROWS, redo=False, log=print):
+    """Ingest the archives not done yet, in parallel -> manifest entries of this run.
+
+    Call under an `if __name__ == '__main__'` guard (python backfill.py does) -
+    on spawn platforms (Windows) every worker imports the main module again.
+    """
+    done = {} if redo else ndbc_download.load_state(manifest)
+    todo = [j for j in jobs if done.get(j['name'], {}).get('version') != j['version']]
+    log(' Archives: %d, already in the store: %d, to ingest: %d'
+        % (len(jobs), len(jobs) - len(todo), len(todo)))
+    if not todo:
+        return {}
+
+    positions = pd.DataFrame(positions[['station_id', 'latitude', 'longitude']])
+    positions['station_id'] = positions['station_id'].astype(str)
+    finished = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # each task gets only its own station's position
+        futures = {pool.submit(ingest, job, positions[positions['station_id'] == job['station']],
+                               store, chunk_rows): job for job in todo}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                name, rows, dups, seconds = future.result()
+            except Exception as e:     # i.e. missing year on the NDBC site, bad file
+                log('   %-20s failed: %r' % (job['name'], e))
+                continue
+            finished[name] = done[name] = {'version': job['version'], 'rows': rows,
+                                           'duplicates': dups, 'seconds': round(seconds, 1),
+                                           'ingested': pd.Timestamp.now(tz='UTC').isoformat()}
+            ndbc_download.save_state(done, manifest)    # after every archive -> resumable
+            log('   %-20s %9d rows  %5.1f s' % (name, rows, seconds))
+    return finished
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Backfill obs_store/ w/NDBC historical archives')
+    parser.add_argument('--folder', default=ARCHIVE_DIR, help='local .txt.gz archives')
+    parser.add_argument('--stations', nargs='+', help='stream these stations from NDBC instead')
+    parser.add_argument('--years', nargs='+', type=int, help='w/--stations')
+    parser.add_argument('--base-url', default=HISTORICAL_URL)
+    parser.add_argument('--positions', default='latest_obs.txt', help='station lat/long')
+    parser.add_argument('--store', default=obs_store.STORE)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--redo', action='store_true', help='ignore the manifest')
+    args = parser.parse_args(argv)
+
+    if args.stations:
+        if not args.years:
+            parser.error('--stations needs --years')
+        jobs = remote_archives(args.stations, args.years, args.base_url)
+    else:
+        jobs = local_archives(args.folder)
+    with open(args.positions, 'rb') as fh:
+        positions = ndbc_parse.parse(fh.read(), names=ndbc_parse.column_names())
+
+    started = time.time()
+    finished = run(jobs, positions, store=args.store,
+                   manifest=os.path.join(args.store, os.path.basename(MANIFEST)),
+                   workers=args.workers, chunk_rows=args.chunk_rows, redo=args.redo)
+    rows = sum(f['rows'] for f in finished.values())
+    print('\n Backfill: %d archives, %d rows in %.1f s' % (len(finished), rows, time.time() - started))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#
+## Purpose
+#
+    # Small, pre-clipped basemap layers for the maps (states, 12nm territorial sea)
+    # 1. Area of interest (AOI) from the site (& station) bounds + a margin,
+    #    snapped outward to whole 5 degrees so small changes reuse the cache
+    # 2. National shapefile read only once: features in the AOI (bbox read),
+    #    clipped to it, simplified to the figure resolution
+    # 3. Saved as GeoParquet in cache/, keyed on the source file, AOI & resolution
+    #    - later runs load the small layer instead of reparsing the .zip
+
+## Used by '3. landing_site_data.py' & '4. site_evaluation.py'
+
+import hashlib
+import os
+
+import geopandas
+import numpy as np
+from shapely.geometry import box
+
+CACHE_DIR = 'cache'
+VERSION = 1     # bump when load() changes, old caches are then ignored
+
+LAYERS = {'states': 'cb_2018_us_state_500k.zip',
+          'territorial_sea': 'US_Maritime_Limits_Boundaries_Map_Service_Layer.zip'}
+
+
+def aoi(*frames, margin=4.0, snap=5.0):
+    """Bounds (minx, miny, maxx, maxy) in lat/long degrees around all frames,
+    + margin degrees, snapped outward to a multiple of snap."""
+    bounds = np.array([f.to_crs(4326).total_bounds for f in frames])
+    lo = np.floor((bounds[:, :2].min(axis=0) - margin) / snap) * snap
+    hi = np.ceil((bounds[:, 2:].max(axis=0) + margin) / snap) * snap
+    return (float(lo[0]), float(lo[1]), float(hi[0]), float(hi[1]))
+
+
+def _cache_path(path, bounds, pixels, cache_dir):
+    stat = os.stat(path)
+    key = '%s|%d|%d|%s|%d|%d' % (os.path.basename(path), stat.st_size, stat.st_mtime_ns,
+                                 bounds, pixels, VERSION)
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, 'basemap_%s_%s.parquet'
+                        % (name, hashlib.sha1(key.encode()).hexdigest()[:12]))
+
+
+def load(layer, bounds, pixels=3600, cache_dir=CACHE_DIR):
+    """Basemap layer clipped to bounds (EPSG:4326), from cache if possible.
+
+    layer   key of LAYERS (e.g. 'states') or a path to any vector file
+    bounds  from aoi()
+    pixels  figure width in pixels (12 in @ 300 dpi) - sets the simplify tolerance
+    """
+    path = LAYERS.get(layer, layer)
+    cache = _cache_path(path, bounds, pixels, cache_dir)
+    if os.path.exists(cache):
+        return geopandas.read_parquet(cache)
+
+    # Only features touching the AOI are read (bbox in lat/long, reprojected by geopandas)
+    area = geopandas.GeoSeries([box(*bounds)], crs=4326)
+    data = geopandas.read_file(path, bbox=area)
+    data = data.to_crs(4326).clip(box(*bounds))
+
+    # ~1 pixel tolerance at the output resolution
+    tolerance = (bounds[2] - bounds[0]) / pixels
+    data['geometry'] = data.geometry.simplify(tolerance, preserve_topology=True)
+    data = data[~data.geometry.is_empty].reset_index(drop=True)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    data.to_parquet(cache)
+    return data
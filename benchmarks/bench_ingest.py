@@ -0,0 +1,82 @@
+#
+## Purpose
+#
+    # Benchmark building the combined .txt table from 100 -> 800 stations
+    # 1. old way - add each station to the running table (DataFrame.append)
+    # 2. TableBuilder - collect files, build the table once
+    # 3. timestamp - pd.to_datetime vs vector math from the date fields
+    # Synthetic realtime2 files (72 hrs @ 10 min = 432 rows per station)
+
+## Run from the repository folder:
+    # python benchmarks/bench_ingest.py
+
+import os
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import ndbc_parse
+import obs_schema
+
+HEADER = (b'#YY  MM DD hh mm WDIR WSPD GST  WVHT   DPD   APD MWD   PRES  ATMP  WTMP  DEWP  VIS PTDY  TIDE\n'
+          b'#yr  mo dy hr mn degT m/s  m/s     m   sec   sec degT   hPa  degC  degC  degC  nmi  hPa    ft\n')
+ROWS = 432
+
+
+def fake_file(i):
+    # Newest-first rows, one every 10 min, some 'MM'
+    rows = []
+    for r in range(ROWS):
+        t = pd.Timestamp('2021-05-18 16:00') - pd.Timedelta(minutes=10 * r)
+        gst = b'MM' if (r + i) % 7 == 0 else b'%4.1f' % ((r + i) % 20 / 2)
+        rows.append(b'%s 160 %4.1f %s   0.5     6   4.2 150 1012.0  25.0  26.0  20.0   MM   MM    MM\n'
+                    % (t.strftime('%Y %m %d %H %M').encode(), (r * i) % 15 / 2, gst))
+    return HEADER + b''.join(rows)
+
+
+def old_way(files, names):
+    # one append per station (pd.concat - DataFrame.append is gone in pandas 2)
+    data = pd.DataFrame()
+    for station, body in files.items():
+        data = pd.concat([data, ndbc_parse.parse(body, station, names)])
+    return data
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+names = ndbc_parse.column_names(os.path.join(os.path.dirname(__file__), '..', 'NOAA_columns.csv'))
+template = [fake_file(i) for i in range(50)]
+
+print('%9s %10s %12s %10s %12s %12s' % ('stations', 'append s', 'ms/station',
+                                        'builder s', 'ms/station', 'peak/table'))
+for n in (100, 200, 400, 800):
+    files = {'S%04d' % i: template[i % 50] for i in range(n)}
+    _, t_old, _ = measure(old_way, files, names)
+    table, t_new, peak = measure(ndbc_parse.build_table, files, names)
+    size = table.memory_usage(deep=True).sum()
+    print('%9d %10.2f %12.2f %10.2f %12.2f %11.1fx' % (n, t_old, 1000 * t_old / n,
+                                                      t_new, 1000 * t_new / n, peak / size))
+
+# Timestamp from year/month/day/hour/minute on the 800 station table
+parts = pd.DataFrame({'year': table['timestamp'].dt.year, 'month': table['timestamp'].dt.month,
+                      'day': table['timestamp'].dt.day, 'hour': table['timestamp'].dt.hour,
+                      'minute': table['timestamp'].dt.minute})
+start = time.perf_counter()
+old = pd.to_datetime(parts)
+t_old = time.perf_counter() - start
+start = time.perf_counter()
+new = obs_schema.timestamps(*(parts[c].to_numpy() for c in parts.columns))
+t_new = time.perf_counter() - start
+print('\ntimestamp, %d rows: pd.to_datetime %.3f s | vector math %.3f s | same: %s'
+      % (len(parts), t_old, t_new, bool((old.to_numpy() == new).all())))
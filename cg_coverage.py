@@ -0,0 +1,123 @@
+#
+## Purpose
+#
+    # Coast Guard response coverage - which units reach a site/point in T minutes
+    # 1. Range per unit = Transit_Spd (knots) x T minutes, as a geodesic
+    #    ring in lat/long (EPSG:4326) - replaces 'Transit_Spd * .05' degree buffers
+    # 2. Rings clipped against land (states) once & cached in cache/,
+    #    keyed on the unit file contents, the land file & T
+    #    - a new cg_units.csv (or T) builds a new cache, otherwise no overlay
+    # 3. reach() - spatial index lookup of points in the clipped areas,
+    #    vectorized over any number of points
+
+## Used by '4. site_evaluation.py'
+
+import hashlib
+import os
+
+import geopandas
+import numpy as np
+import pandas as pd
+
+from site_distance import circles
+from station_index import haversine_nm
+
+CACHE_DIR = 'cache'
+VERSION = 1     # bump when build() changes, old caches are then ignored
+
+
+def load_units(path='CG_units.csv'):
+    """Unit table (Latitude, Longitude, Unit, Transit_Spd ...) -> GeoDataFrame, EPSG:4326."""
+    units = pd.read_csv(path)
+    return geopandas.GeoDataFrame(units, crs=4326,
+                                  geometry=geopandas.points_from_xy(units.Longitude, units.Latitude))
+
+
+def build(units, land, minutes=60):
+    """Land-clipped response areas, one row per unit (same order as units).
+
+    units  from load_units()
+    land   polygons to remove (e.g. states), any CRS
+    """
+    range_nm = units['Transit_Spd'].to_numpy(np.float64) * minutes / 60
+    rings = geopandas.GeoSeries(circles(units['Latitude'], units['Longitude'], range_nm), crs=4326)
+
+    # Only the land polygons near a ring, dissolved once
+    land = land.to_crs(4326)
+    near = np.unique(land.sindex.query(rings, predicate='intersects')[1])
+    land_union = land.geometry.iloc[near].union_all() if len(near) else None
+
+    areas = rings.difference(land_union) if land_union is not None else rings
+    return geopandas.GeoDataFrame({'Unit': units['Unit'].to_numpy(),
+                                   'Asset': units['Asset'].to_numpy(),
+                                   'Transit_Spd': units['Transit_Spd'].to_numpy(),
+                                   'range_nm': range_nm},
+                                  geometry=areas.to_numpy(), crs=4326)
+
+
+def cache_key(units_path, land_path, minutes):
+    # unit file contents + land file identity (size, modified time) + T
+    with open(units_path, 'rb') as f:
+        digest = hashlib.sha1(f.read())
+    stat = os.stat(land_path)
+    digest.update(('%s|%d|%d|%s|%d' % (os.path.basename(land_path), stat.st_size,
+                                      stat.st_mtime_ns, minutes, VERSION)).encode())
+    return digest.hexdigest()[:16]
+
+
+class Coverage:
+    """Cached land-clipped CG response areas w/fast point lookups."""
+
+    def __init__(self, units, areas, minutes):
+        self.units, self.areas, self.minutes = units, areas, minutes
+        self.areas.sindex   # build the spatial index once
+
+    @classmethod
+    def load(cls, units_path='CG_units.csv', land_path='cb_2018_us_state_500k.zip',
+             minutes=60, cache_dir=CACHE_DIR):
+        """Areas from cache, or built (& cached) if the unit file, land file or T changed."""
+        units = load_units(units_path)
+        path = os.path.join(cache_dir, 'cg_coverage_%s.parquet'
+                            % cache_key(units_path, land_path, minutes))
+        if os.path.exists(path):
+            areas = geopandas.read_parquet(path)
+        else:
+            areas = build(units, geopandas.read_file(land_path), minutes)
+            os.makedirs(cache_dir, exist_ok=True)
+            areas.to_parquet(path)
+        return cls(units, areas, minutes)
+
+    def reach(self, lat, lon):
+        """Units that reach each point within T minutes (point inside the clipped area).
+
+        Returns DataFrame: point (position in lat/lon), Unit, distance_nm, transit_min
+        """
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        points = geopandas.points_from_xy(lon, lat, crs=4326)
+        point, row = self.areas.sindex.query(points, predicate='intersects')
+        order = np.lexsort((row, point))
+        point, row = point[order], row[order]
+
+        nm = haversine_nm(lat[point], lon[point],
+                          self.units['Latitude'].to_numpy()[row],
+                          self.units['Longitude'].to_numpy()[row])
+        return pd.DataFrame({'point': point,
+                             'Unit': self.areas['Unit'].to_numpy()[row],
+                             'distance_nm': nm,
+                             'transit_min': nm / self.areas['Transit_Spd'].to_numpy()[row] * 60})
+
+    def reach_sites(self, sites):
+        """reach() for a site table (Name, latitude, longitude; Name may be the index).
+
+        Returns DataFrame: Name, Unit, distance_nm, transit_min
+        """
+        sites = sites.reset_index() if 'Name' not in sites.columns else sites
+        hits = self.reach(sites['latitude'], sites['longitude'])
+        hits.insert(0, 'Name', sites['Name'].to_numpy()[hits.pop('point')])
+        return hits
+
+    def covered(self, lat, lon):
+        """Number of units reaching each point within T minutes."""
+        n = len(np.atleast_1d(lat))
+        return np.bincount(self.reach(lat, lon)['point'], minlength=n)
@@ -0,0 +1,153 @@
+#
+## Purpose
+#
+    # Splashdown Go / Marginal / No-Go rule engine
+    # 1. Thresholds come from splashdown_criteria.csv (README requirements):
+    #    one row per rule - metric, comparison, Go limit & No-Go limit
+        # value meets go     -> Go
+        # meets no_go only   -> Marginal (close to the limit)
+        # fails no_go        -> No-Go
+        # no data (NaN)      -> Marginal
+        # no time steps      -> 'No data' (latest())
+    # 2. Every rule is evaluated for every site & time step at once
+    #    (boolean numpy arrays, sites x times) - cheap enough to rerun on
+    #    each 10 min update for hundreds of candidate sites
+    # 3. Site status = worst rule; the rule that set it is kept, so the
+    #    report says which rule failed (or had no data) & when
+
+## Used by '4. site_evaluation.py'
+
+import operator
+
+import numpy as np
+import pandas as pd
+
+CRITERIA = 'splashdown_criteria.csv'
+
+GO, MARGINAL, NO_GO = 0, 1, 2
+STATUS = np.array(['Go', 'Marginal', 'No-Go'])
+NO_DATA = 'No data'     # latest() of a site w/no time steps at all
+
+OPS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+
+def wave_slope(height, period):
+    """Max slope (degrees) of a deep-water wave: atan(pi H / L), L = g T^2 / 2 pi.
+    height in m (NDBC), period in sec."""
+    length = 9.80665 * np.asarray(period, dtype=np.float64) ** 2 / (2 * np.pi)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.degrees(np.arctan(np.pi * np.asarray(height, dtype=np.float64) / length))
+    return np.where(length > 0, slope, np.nan)
+
+
+# Metrics computed from others: name -> (inputs, function)
+DERIVED = {'wave_slope': (('wind_wave_height', 'ave_period'), wave_slope)}
+
+
+def load(path=CRITERIA, enabled_only=True):
+    """Rules table from the criteria file (only enabled rules by default)."""
+    rules = pd.read_csv(path, dtype={'rule': str, 'metric': str, 'op': str})
+    bad = set(rules['op']) - set(OPS)
+    if bad:
+        raise ValueError('%s: unknown comparison %s' % (path, sorted(bad)))
+    rules['enabled'] = rules['enabled'].astype(bool)
+    if enabled_only:
+        rules = rules[rules['enabled']]
+    return rules.reset_index(drop=True)
+
+
+def inputs(rules):
+    """Metrics that must be supplied to evaluate() for these rules."""
+    names = []
+    for metric in rules['metric']:
+        for name in DERIVED[metric][0] if metric in DERIVED else (metric,):
+            if name not in names:
+                names.append(name)
+    return names
+
+
+class Evaluation:
+    """Result of evaluate() - arrays are (rule, site, time) or (site, time).
+
+    status    rule status per site & time (GO / MARGINAL / NO_GO)
+    values    metric value each rule was tested on
+    overall   worst rule status per site & time
+    failing   rule (row of rules) that set overall, -1 when Go
+    """
+
+    def __init__(self, rules, sites, times, status, values):
+        self.rules, self.sites, self.times = rules, sites, times
+        self.status, self.values = status, values
+        self.overall = status.max(axis=0) if len(rules) else np.zeros(status.shape[1:], np.int8)
+        self.failing = np.where(self.overall > GO,
+                                np.argmax(status == self.overall, axis=0), -1)
+
+    def timeline(self):
+        """Go / Marginal / No-Go per time step (rows) & site (columns)."""
+        return pd.DataFrame(STATUS[self.overall.T], index=self.times, columns=self.sites)
+
+    def latest(self):
+        """Status & failing rule per site at the last time step
+        ('No data' for every site when there are no time steps)."""
+        if not len(self.times):
+            return pd.DataFrame({'Name': np.asarray(self.sites, dtype=object),
+                                 'timestamp': pd.Series(pd.NaT, index=range(len(self.sites)),
+                                                        dtype=self.times.dtype),
+                                 'status': NO_DATA, 'rule': '', 'value': np.nan,
+                                 'limit': np.nan, 'reason': 'no data'})
+        return self._rows(np.arange(len(self.sites)), np.full(len(self.sites), len(self.times) - 1))
+
+    def report(self):
+        """Periods of unchanged status & failing rule, per site (start, end inclusive)."""
+        key = self.overall.astype(np.int64) * (len(self.rules) + 1) + self.failing + 1
+        start = np.ones(key.shape, dtype=bool)
+        start[:, 1:] = key[:, 1:] != key[:, :-1]
+        site, first = np.nonzero(start)
+        last = np.append(first[1:] - 1, 0)[:len(first)]
+        new_site = np.append(site[1:] != site[:-1], True)[:len(first)]
+        last[new_site] = len(self.times) - 1
+        out = self._rows(site, first)
+        out.insert(2, 'end', self.times[last])
+        out.insert(3, 'steps', last - first + 1)
+        return out.rename(columns={'timestamp': 'start'})
+
+    def _rows(self, site, t):
+        rule = self.failing[site, t]
+        has_rule = rule >= 0
+        value = np.where(has_rule, self.values[rule.clip(0), site, t], np.nan)
+        limits = self.rules['no_go'].to_numpy(np.float64)
+        return pd.DataFrame({
+            'Name': np.asarray(self.sites)[site],
+            'timestamp': self.times[t],
+            'status': STATUS[self.overall[site, t]],
+            'rule': np.where(has_rule, self.rules['rule'].to_numpy(object)[rule.clip(0)], ''),
+            'value': value,
+            'limit': np.where(has_rule, limits[rule.clip(0)], np.nan),
+            'reason': np.where(~has_rule, '', np.where(np.isnan(value), 'no data', 'limit')),
+        })
+
+
+def evaluate(metrics, rules, sites, times):
+    """Evaluate all rules for all sites & times.
+
+    metrics  {name: (site, time) array} - see inputs(); derived metrics
+             (e.g. wave_slope) are computed here. A missing metric = no data.
+    rules    from load()
+    """
+    shape = (len(sites), len(times))
+    nan = np.full(shape, np.nan)
+    status = np.empty((len(rules),) + shape, dtype=np.int8)
+    values = np.empty((len(rules),) + shape, dtype=np.float32)
+
+    for r, (metric, op, go, no_go) in enumerate(rules[['metric', 'op', 'go', 'no_go']].itertuples(index=False)):
+        if metric in DERIVED:
+            names, func = DERIVED[metric]
+            v = func(*(metrics.get(n, nan) for n in names))
+        else:
+            v = np.asarray(metrics.get(metric, nan), dtype=np.float64)
+        compare = OPS[op]
+        s = np.where(compare(v, go), GO, np.where(compare(v, no_go), MARGINAL, NO_GO))
+        s[np.isnan(v)] = MARGINAL
+        status[r], values[r] = s, v
+
+    return Evaluation(rules, pd.Index(sites), pd.DatetimeIndex(times), status, values)
@@ -0,0 +1,242 @@
+#
+## Purpose
+#
+    # Render the figures off the main script, headless & in parallel
+    # 1. Each figure is a job: output file + kind of plot + its input data
+    #    + options (titles, styles), see map_figure() & chart()
+    # 2. Renderer.add() hands the job to a process pool (Agg backend),
+    #    so the script keeps going while figures are drawn
+    # 3. Input data & options are hashed - a figure whose inputs did not
+    #    change since the last run is not drawn again (cache/figures.json)
+    # 4. Production mode skips the diagnostic CHECK figures
+        # set SPLASHDOWN_PRODUCTION=1, or Renderer(production=True)
+
+## Used by '2. clean_input_data.py', '3. landing_site_data.py' & '4. site_evaluation.py'
+
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+MANIFEST = 'cache/figures.json'
+VERSION = 1     # bump when a draw function changes, every figure is drawn again
+PRODUCTION = os.environ.get('SPLASHDOWN_PRODUCTION', '0') not in ('', '0')
+
+
+class Job:
+    """One figure: output path, draw function name, input data & options."""
+
+    def __init__(self, path, draw, data, options, check=None):
+        self.path, self.draw, self.data, self.options = path, draw, data, options
+        self.check = 'CHECK' in os.path.basename(path) if check is None else check
+
+    def digest(self):
+        h = hashlib.sha1(('%s|%s|%r|%d' % (self.path, self.draw, sorted(self.options.items()),
+                                           VERSION)).encode())
+        for key in sorted(self.data):
+            h.update(key.encode())
+            hash_frame(self.data[key], h)
+        return h.hexdigest()
+
+
+def hash_frame(obj, h):
+    """Add the contents of a (Geo)DataFrame / Series / Index to hashlib object h
+    (geometry as WKB) - same data, same hash, in any process."""
+    if isinstance(obj, pd.Index):
+        obj = obj.to_series(index=pd.RangeIndex(len(obj)))
+    if isinstance(obj, pd.Series):
+        obj = obj.to_frame()
+    if not isinstance(obj, pd.DataFrame):
+        h.update(repr(obj).encode())
+        return
+    h.update(repr(list(obj.columns)).encode())
+    h.update(pd.util.hash_pandas_object(obj.index).to_numpy().tobytes())
+    for col in obj.columns:
+        values = obj[col]
+        if values.dtype.name == 'geometry':
+            h.update(b''.join(values.to_wkb().to_numpy()))
+        else:
+            h.update(pd.util.hash_pandas_object(values, index=False).to_numpy().tobytes())
+
+
+def map_figure(path, layers, title, zoom=None, labels=(), check=None, figsize=(12, 12), dpi=300):
+    """Map job.
+
+    layers  [(GeoDataFrame, plot kwargs), ...] drawn in order
+    zoom    GeoDataFrame/GeoSeries whose bounds set the map extent (None = auto)
+    labels  [(layer position, annotate kwargs), ...] - index values as labels
+    """
+    data = {'layer%d' % i: frame for i, (frame, _) in enumerate(layers)}
+    options = {'styles': [style for _, style in layers], 'title': title,
+               'bounds': None if zoom is None else tuple(np.round(zoom.total_bounds, 6)),
+               'labels': list(labels), 'figsize': figsize, 'dpi': dpi}
+    return Job(path, 'map', data, options, check)
+
+
+def chart(path, draw, data, check=None, figsize=None, dpi=300, **options):
+    """Chart job - draw is 'barh', 'violin', 'boxen' or 'timeseries' (see below)."""
+    return Job(path, draw, {'data': data}, dict(options, figsize=figsize, dpi=dpi), check)
+
+
+#
+# Draw functions (run in the worker) - fig, ax, data, options
+#
+
+def _map(fig, ax, data, o):
+    ax.set_title(o['title'])
+    if o['bounds'] is not None:
+        ax.set_xlim([o['bounds'][0], o['bounds'][2]])
+        ax.set_ylim([o['bounds'][1], o['bounds'][3]])
+    for i, style in enumerate(o['styles']):
+        data['layer%d' % i].plot(ax=ax, **style)
+    for i, style in o['labels']:
+        layer = data['layer%d' % i]
+        for x, y, label in zip(layer.geometry.x, layer.geometry.y, layer.index):
+            ax.annotate(label, xy=(x, y), textcoords="offset points", **style)
+
+
+def _barh(fig, ax, data, o):
+    fig.subplots_adjust(left=0.25)
+    data['data'].plot.barh(ax=ax)
+    ax.set_ylabel(o['ylabel'])
+    ax.set_xlabel(o['xlabel'])
+    ax.set_title(o['title'])
+    ax.tick_params(axis='y', rotation=40)
+
+
+def _distribution(fig, ax, data, o, kind):
+    import seaborn as sns
+    sns.set_context('paper')
+    getattr(sns, kind)(y=o['y'], x=o['x'], data=data['data'], ax=ax)
+    fig.suptitle(o['suptitle'])
+    ax.set_ylabel(o['ylabel'])
+    ax.set_xlabel(o['xlabel'])
+    ax.tick_params(axis='x', rotation=20)
+    if o.get('axhline') is not None:
+        ax.axhline(o['axhline'])
+    fig.tight_layout()
+
+
+def _timeseries(fig, ax, data, o):
+    import seaborn as sns
+    sns.set_context('paper')
+    fig.suptitle(o['suptitle'])
+    ax.set_title(o['title'])
+    ax.axhline(o['axhline'])
+    data['data'].groupby(o['by'])[o['y']].plot(ax=ax, legend=True)
+    ax.legend(loc='upper left', prop={'size': 6})
+    fig.tight_layout()
+
+
+DRAW = {'map': _map, 'barh': _barh, 'timeseries': _timeseries,
+        'violin': lambda *a: _distribution(*a, kind='violinplot'),
+        'boxen': lambda *a: _distribution(*a, kind='boxenplot')}
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+
+def _render(path, draw, data, options):
+    _init_worker()
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(dpi=options['dpi'], figsize=options['figsize'])
+    try:
+        DRAW[draw](fig, ax, data, options)
+        fig.savefig(path, format=os.path.splitext(path)[1][1:], dpi=options['dpi'])
+    finally:
+        plt.close(fig)
+    return path
+
+
+# Pool shared by every Renderer, see start_pool()
+_shared = None
+
+
+def _fork_pool(max_workers):
+    # Workers are forked: the numbered scripts have no __main__ guard, so a
+    # 'spawn' worker would run the whole script again. No fork (Windows) -> drawn here.
+    # All workers are forked right away, before the caller starts threaded work
+    # (pyarrow, BLAS, thread pools) - a fork while other threads hold locks can deadlock.
+    # So the pool MUST be forked 1st: Renderer() / start_pool() before any
+    # Parquet read or write (pyarrow's threads are native, not visible to a check here).
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    pool = ProcessPoolExecutor(max_workers, initializer=_init_worker,
+                               mp_context=multiprocessing.get_context('fork'))
+    pool.submit(int).result()   # a fork pool starts every worker w/the 1st task
+    return pool
+
+
+def start_pool(max_workers=None):
+    """Fork the workers now & share them w/every Renderer until stop_pool()
+    (pipeline.py, before any stage has started a thread)."""
+    global _shared
+    if _shared is None:
+        _shared = _fork_pool(max_workers or min(4, os.cpu_count() or 1))
+    return _shared
+
+
+def stop_pool():
+    global _shared
+    if _shared is not None:
+        _shared.shutdown()
+        _shared = None
+
+
+class Renderer:
+    """Renders jobs in a process pool; add() as figures are ready, wait() at the end.
+
+    Create it at the top of a script, before any Parquet I/O (the pool is
+    forked then), or share the pipeline's pool (start_pool).
+    """
+
+    def __init__(self, production=None, max_workers=None, manifest=MANIFEST):
+        self.production = PRODUCTION if production is None else production
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.manifest_path = manifest
+        self.manifest = {}
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                self.manifest = json.load(f)
+        self.status = {}    # path -> 'rendered' | 'unchanged' | 'skipped'
+        self._pending = {}  # path -> (future or None, digest)
+        self._own = _shared is None
+        self._pool = _fork_pool(self.max_workers) if self._own else _shared
+
+    def add(self, job):
+        if self.production and job.check:
+            self.status[job.path] = 'skipped'
+            return
+        digest = job.digest()
+        if self.manifest.get(job.path) == digest and os.path.exists(job.path):
+            self.status[job.path] = 'unchanged'
+            return
+        pool = self._pool
+        if pool is None:
+            _render(job.path, job.draw, job.data, job.options)
+            self._pending[job.path] = (None, digest)
+        else:
+            self._pending[job.path] = (pool.submit(_render, job.path, job.draw,
+                                                   job.data, job.options), digest)
+
+    def wait(self):
+        """Finish all figures & record their input hashes -> {path: status}."""
+        for path, (future, digest) in self._pending.items():
+            if future is not None:
+                future.result()
+            self.manifest[path] = digest
+            self.status[path] = 'rendered'
+        self._pending = {}
+        if self._own and self._pool is not None:
+            self._pool.shutdown()
+        self._pool = None
+        os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+        with open(self.manifest_path, 'w') as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        return self.status
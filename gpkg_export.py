@@ -0,0 +1,67 @@
+#
+## Purpose
+#
+    # Write splash_down.gpkg layers in bulk
+    # 1. pyogrio write_dataframe w/use_arrow=True - columns handed to GDAL
+    #    as Arrow arrays (to_file w/fiona writes feature by feature)
+    # 2. Each layer written into the same file - layers already there are
+    #    replaced, other layers are kept; GDAL builds the spatial index (rtree)
+    # 3. Timestamps written as UTC (DATETIME w/'Z', as the GeoPackage spec asks)
+    # 4. Record counts kept in gpkg_ogr_contents - layer_counts() reads them
+    #    w/o opening every layer (replaces the fiona.listlayers loops)
+
+## Used by '2. clean_input_data.py', '3. landing_site_data.py' & '4. site_evaluation.py'
+
+# Note: use_arrow needs GDAL >= 3.8 & pyarrow (already used by obs_store.py)
+
+import os
+import sqlite3
+
+import geopandas
+import pandas as pd
+import pyogrio
+
+GPKG = 'splash_down.gpkg'
+
+
+def _frame(data):
+    # GeoSeries / named index -> columns (as to_file does), naive timestamps -> UTC
+    if isinstance(data, geopandas.GeoSeries):
+        data = geopandas.GeoDataFrame(geometry=data)
+    if data.index.name is not None or any(data.index.names):
+        data = data.reset_index()
+    naive = [c for c in data.columns
+             if pd.api.types.is_datetime64_dtype(data[c].dtype) and c != data.geometry.name]
+    if naive:
+        data = data.assign(**{c: data[c].dt.tz_localize('UTC') for c in naive})
+    return data
+
+
+def write(layers, path=GPKG):
+    """Write {layer name: GeoDataFrame/GeoSeries} to the GeoPackage.
+
+    Layers already in the file are replaced, other layers are kept.
+    """
+    for name, data in layers.items():
+        pyogrio.write_dataframe(_frame(data), path, layer=name, driver='GPKG', use_arrow=True)
+
+
+def layer_counts(path=GPKG):
+    """{layer name: records} from the GeoPackage metadata (no layer is read)."""
+    if not os.path.exists(path):
+        return {}
+    con = sqlite3.connect(path)
+    try:
+        names = [r[0] for r in con.execute(
+            "SELECT table_name FROM gpkg_contents WHERE data_type = 'features' ORDER BY table_name")]
+        counts = {}
+        try:
+            counts = dict(con.execute('SELECT table_name, feature_count FROM gpkg_ogr_contents'))
+        except sqlite3.OperationalError:
+            pass    # written by a tool w/o gpkg_ogr_contents
+        for name in names:
+            if counts.get(name) is None:
+                counts[name] = con.execute('SELECT COUNT(*) FROM "%s"' % name).fetchone()[0]
+        return {name: counts[name] for name in names}
+    finally:
+        con.close()
@@ -0,0 +1,496 @@
+#
+## Purpose
+#
+    # Concurrent downloader for NDBC realtime2 station files (.txt, .spec)
+    # 1. One keep-alive connection per worker thread (reused across files)
+    # 2. Configurable concurrency, per-file timeout, retries w/backoff
+    # 3. Stations w/out a file are reported back, not raised (save_missing)
+    # 4. Incremental mode - only pull rows newer than the last run
+        # conditional GET (ETag/If-Modified-Since) skips unchanged files
+        # Range GET reads only the top of the file (files are newest-first)
+        # data_raw/ files trimmed to the last 72 hrs, new rows also queued
+        # in data_raw/new/ for '2. clean_input_data.py'
+    # 5. Fetch planner - latest_obs.txt as a change index
+        # only stations that reported since the last run & are not stale
+
+## Used by '1. get_web_data.py'
+
+## User-input:
+    # base_url - point at a local http server for testing
+    # max_workers, timeout, retries, backoff
+
+import calendar
+import email.utils
+import glob
+import http.client
+import json
+import math
+import os
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+REALTIME2_URL = 'https://www.ndbc.noaa.gov/data/realtime2/'
+LATEST_OBS_URL = 'https://www.ndbc.noaa.gov/data/latest_obs/latest_obs.txt'
+
+FILE_TYPES = ('.txt', '.spec')
+
+# Where '2. clean_input_data.py' expects each file type
+OUT_DIRS = {'.txt': 'data_raw/', '.spec': 'data_raw/spec/'}
+
+# Rows added since '2. clean_input_data.py' last ran (it parses only these);
+# the folder exists only while script 2's window matches data_raw/
+PENDING_DIRS = {'.txt': 'data_raw/new/', '.spec': 'data_raw/new/spec/'}
+
+# Hours of rows kept in data_raw/ (the realtime window the scripts use)
+KEEP_HOURS = 72
+
+# Status codes worth another try (server busy / hiccup)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# Per-file state from the last run (ETag, newest row, row size)
+STATE_FILE = 'data_raw/fetch_state.json'
+
+# Extra rows requested in a Range read, in case a station reports off-cycle
+RANGE_SLACK_ROWS = 6
+
+
+class FetchError(Exception):
+    """Raised when a file could not be fetched after all retries."""
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections, one per worker thread, to one host."""
+
+    def __init__(self, base_url, timeout=10):
+        parts = urllib.parse.urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path if parts.path.endswith('/') else parts.path + '/'
+        self.timeout = timeout
+        self._local = threading.local()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.scheme == 'https':
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def reset(self):
+        # Drop this thread's connection after an error; next call reconnects
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def request(self, name, headers=None):
+        """GET base_url + name on this thread's connection -> (status, headers, body)."""
+        conn = self.connection()
+        conn.request('GET', self.path + name, headers=headers or {})
+        resp = conn.getresponse()
+        body = resp.read()          # always drain so the connection can be reused
+        if resp.will_close:
+            self.reset()
+        return resp.status, dict(resp.getheaders()), body
+
+    def close(self):
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all = []
+
+
+def _get(pool, name, headers=None, retries=3, backoff=0.5):
+    # GET w/retries -> (status, headers, body); gives up w/FetchError
+    for attempt in range(retries + 1):
+        try:
+            status, resp_headers, body = pool.request(name, headers)
+        except (OSError, http.client.HTTPException) as err:
+            # timeout, reset, dropped keep-alive, ...
+            pool.reset()
+            last = err
+        else:
+            if status not in RETRY_STATUS:
+                return status, resp_headers, body
+            last = 'HTTP %s' % status
+        if attempt < retries:
+            time.sleep(backoff * 2 ** attempt)
+    raise FetchError('%s: %s' % (name, last))
+
+
+def fetch(pool, name, retries=3, backoff=0.5):
+    """Fetch one file; returns bytes, or None if the server says it does not exist."""
+    status, _, body = _get(pool, name, retries=retries, backoff=backoff)
+    if status == 200:
+        return body
+    return None                     # 404 etc. = station has no file of this type
+
+
+def fetch_all(stations, file_types=FILE_TYPES, base_url=REALTIME2_URL,
+              max_workers=32, timeout=10, retries=3, backoff=0.5):
+    """Download every station/file type concurrently.
+
+    Returns (payloads, missing):
+        payloads = {file_type: {station: bytes}}
+        missing  = {file_type: [station, ...]}
+    """
+    pool = ConnectionPool(base_url, timeout=timeout)
+    payloads = {ft: {} for ft in file_types}
+    missing = {ft: [] for ft in file_types}
+    jobs = [(station, ft) for ft in file_types for station in stations]
+
+    def work(job):
+        station, ft = job
+        try:
+            return job, fetch(pool, station + ft, retries=retries, backoff=backoff)
+        except FetchError:
+            return job, None
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            for (station, ft), body in ex.map(work, jobs):
+                if body is None:
+                    missing[ft].append(station)
+                else:
+                    payloads[ft][station] = body
+    finally:
+        pool.close()
+
+    return payloads, missing
+
+
+def fetch_latest_obs(url=LATEST_OBS_URL, timeout=10, retries=3, backoff=0.5):
+    """Download latest_obs.txt (master list of reporting stations)."""
+    base, name = url.rsplit('/', 1)
+    pool = ConnectionPool(base + '/', timeout=timeout)
+    try:
+        body = fetch(pool, name, retries=retries, backoff=backoff)
+    finally:
+        pool.close()
+    if body is None:
+        raise FetchError(url + ': not found')
+    return body
+
+
+def poll_latest_obs(last_modified=None, url=LATEST_OBS_URL, timeout=10, retries=3, backoff=0.5):
+    """Conditional GET of latest_obs.txt -> (body, Last-Modified); body is None
+    while the file is unchanged since last_modified (HTTP 304)."""
+    base, name = url.rsplit('/', 1)
+    pool = ConnectionPool(base + '/', timeout=timeout)
+    headers = {'If-Modified-Since': last_modified} if last_modified else {}
+    try:
+        status, resp_headers, body = _get(pool, name, headers, retries, backoff)
+    finally:
+        pool.close()
+    if status == 304:
+        return None, last_modified
+    if status != 200:
+        raise FetchError('%s: HTTP %s' % (url, status))
+    return body, resp_headers.get('Last-Modified', last_modified)
+
+
+def save_payloads(payloads, out_dirs=OUT_DIRS, pending_dirs=PENDING_DIRS):
+    """Write downloaded files to the raw data folders (station + file type)."""
+    clear_pending(pending_dirs, remove=True)   # whole files replaced -> script 2 parses all
+    for ft, files in payloads.items():
+        out = out_dirs[ft]
+        os.makedirs(out, exist_ok=True)
+        for station, body in files.items():
+            with open(os.path.join(out, station + ft), 'wb') as fh:
+                fh.write(body)
+
+
+# Report of stations w/out a file, per file type
+MISSING_FILES = {'.txt': 'stations_missing_.csv', '.spec': 'stations_missing_.spec'}
+
+
+def save_missing(missing, files=MISSING_FILES):
+    """Write the stations w/out a file (fetch_all 'missing') -> one station_id column per report."""
+    for ft, path in files.items():
+        with open(path, 'w') as fh:
+            fh.write('station_id\n' + ''.join(str(s) + '\n' for s in missing.get(ft, [])))
+
+
+#
+# Incremental (delta) fetch
+#
+
+# realtime2 rows are newest-first, fixed width & start w/'YYYY MM DD hh mm'.
+# A row's time key is those 5 fields joined by spaces, which sorts as text.
+
+def row_key(line):
+    """'YYYY MM DD hh mm' key of one data row (bytes or str)."""
+    if isinstance(line, bytes):
+        line = line.decode('ascii', 'replace')
+    return ' '.join(line.split()[:5])
+
+
+def split_rows(body):
+    """Split a raw file into (header bytes, [data row bytes]); 2 header rows."""
+    lines = body.splitlines(keepends=True)
+    n_head = 0
+    while n_head < len(lines) and lines[n_head].startswith(b'#'):
+        n_head += 1
+    return b''.join(lines[:n_head]), [l for l in lines[n_head:] if l.strip()]
+
+
+def new_rows(rows, newest):
+    """Rows newer than key 'newest' (all rows if newest is None)."""
+    if newest is None:
+        return rows
+    out = []
+    for row in rows:
+        if row_key(row) <= newest:
+            break
+        out.append(row)
+    return out
+
+
+def load_state(path=STATE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def save_state(state, path=STATE_FILE):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(state, fh, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _range_end(entry, now):
+    # Last byte to request: header + rows expected since 'newest' + slack
+    if not entry.get('row_bytes') or not entry.get('newest'):
+        return None
+    newest = time.strptime(entry['newest'], '%Y %m %d %H %M')
+    minutes = max(0, (now - calendar.timegm(newest)) / 60)
+    rows = math.ceil(minutes / 10) + RANGE_SLACK_ROWS
+    return entry['head_bytes'] + rows * entry['row_bytes'] - 1
+
+
+def fetch_delta(pool, name, entry, retries=3, backoff=0.5, now=None):
+    """Fetch only what changed in one file since the last run.
+
+    entry - this file's state from the last run ({} on first run)
+
+    Returns (status, header, rows, entry):
+        status  'new' | 'unchanged' | 'missing'
+        header  header bytes (2 rows)
+        rows    [new data rows], newest-first
+        entry   updated state for this file
+    """
+    now = time.time() if now is None else now
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    end = _range_end(entry, now)
+    if end is not None:
+        headers['Range'] = 'bytes=0-%d' % end
+
+    status, resp_headers, body = _get(pool, name, headers, retries, backoff)
+    if status == 304:
+        return 'unchanged', b'', [], entry
+    if status == 416:
+        # file shrank below our guess - take the whole thing
+        headers.pop('Range')
+        status, resp_headers, body = _get(pool, name, headers, retries, backoff)
+    if status not in (200, 206):
+        return 'missing', b'', [], entry
+
+    if status == 206 and not body.endswith(b'\n'):
+        body = body[:body.rfind(b'\n') + 1]    # drop the cut-off last row
+    header, rows = split_rows(body)
+    fresh = new_rows(rows, entry.get('newest'))
+    if status == 206 and len(fresh) == len(rows):
+        # the slice never reached an old row - more is new than we guessed
+        headers.pop('Range')
+        status, resp_headers, body = _get(pool, name, headers, retries, backoff)
+        if status != 200:
+            return 'missing', b'', [], entry
+        header, rows = split_rows(body)
+        fresh = new_rows(rows, entry.get('newest'))
+
+    entry = dict(entry)
+    entry['etag'] = resp_headers.get('ETag', entry.get('etag'))
+    entry['last_modified'] = resp_headers.get('Last-Modified', entry.get('last_modified'))
+    if rows:
+        entry['head_bytes'] = len(header)
+        entry['row_bytes'] = len(rows[0])
+    if fresh:
+        entry['newest'] = row_key(fresh[0])
+    return ('new' if fresh else 'unchanged'), header, fresh, entry
+
+
+def fetch_all_delta(stations, state, file_types=FILE_TYPES, base_url=REALTIME2_URL,
+                    max_workers=32, timeout=10, retries=3, backoff=0.5):
+    """Incremental version of fetch_all.
+
+    state is updated in place (save it w/save_state after the rows are stored).
+
+    Returns (deltas, unchanged, missing):
+        deltas    = {file_type: {station: (header, [new rows])}}
+        unchanged = {file_type: [station, ...]}
+        missing   = {file_type: [station, ...]}
+    """
+    pool = ConnectionPool(base_url, timeout=timeout)
+    deltas = {ft: {} for ft in file_types}
+    unchanged = {ft: [] for ft in file_types}
+    missing = {ft: [] for ft in file_types}
+    jobs = [(station, ft) for ft in file_types for station in stations]
+    now = time.time()
+
+    def work(job):
+        station, ft = job
+        entry = state.get(station + ft, {})
+        try:
+            return job, fetch_delta(pool, station + ft, entry, retries, backoff, now)
+        except FetchError:
+            return job, ('missing', b'', [], entry)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            for (station, ft), (status, header, rows, entry) in ex.map(work, jobs):
+                state[station + ft] = entry
+                if status == 'new':
+                    deltas[ft][station] = (header, rows)
+                elif status == 'unchanged':
+                    unchanged[ft].append(station)
+                else:
+                    missing[ft].append(station)
+    finally:
+        pool.close()
+
+    return deltas, unchanged, missing
+
+
+def keep_rows(rows, hours=KEEP_HOURS):
+    """Rows (newest-first) w/in 'hours' of the newest row."""
+    if not rows:
+        return rows
+    newest = calendar.timegm(time.strptime(row_key(rows[0]), '%Y %m %d %H %M'))
+    cutoff = time.strftime('%Y %m %d %H %M', time.gmtime(newest - hours * 3600))
+    return [row for row in rows if row_key(row) > cutoff]
+
+
+def _prepend(path, header, rows, hours):
+    # new rows on top of the file's rows, older than 'hours' dropped
+    old = []
+    if os.path.exists(path):
+        with open(path, 'rb') as fh:
+            old_header, old = split_rows(fh.read())
+        header = header or old_header
+    with open(path, 'wb') as fh:
+        fh.write(header + b''.join(keep_rows(rows + old, hours)))
+
+
+def apply_deltas(deltas, out_dirs=OUT_DIRS, pending_dirs=PENDING_DIRS, keep_hours=KEEP_HOURS):
+    """Add new rows to the top of each saved raw file (files stay newest-first)
+    & drop rows older than keep_hours. The new rows are also queued in
+    pending_dirs, if that folder is there (see pending())."""
+    queue = os.path.isdir(pending_dirs['.txt'])
+    for ft, files in deltas.items():
+        os.makedirs(out_dirs[ft], exist_ok=True)
+        if queue:
+            os.makedirs(pending_dirs[ft], exist_ok=True)
+        for station, (header, rows) in files.items():
+            _prepend(os.path.join(out_dirs[ft], station + ft), header, rows, keep_hours)
+            if queue:
+                _prepend(os.path.join(pending_dirs[ft], station + ft), header, rows, keep_hours)
+
+
+def pending(pending_dirs=PENDING_DIRS):
+    """True if pending_dirs holds every row added since script 2 last ran.
+
+    The folder is made by script 2 (clear_pending) once it has parsed
+    data_raw/; a full download removes it, so the next run parses all again.
+    """
+    return os.path.isdir(pending_dirs['.txt'])
+
+
+def clear_pending(pending_dirs=PENDING_DIRS, remove=False):
+    """Empty the queue of new rows (remove=True: drop the folder as well)."""
+    for ft, folder in pending_dirs.items():
+        for path in glob.glob(os.path.join(folder, '*' + ft)):
+            os.remove(path)
+    if remove:
+        for folder in sorted(pending_dirs.values(), reverse=True):   # spec/ 1st
+            if os.path.isdir(folder):
+                os.rmdir(folder)
+    else:
+        for folder in pending_dirs.values():
+            os.makedirs(folder, exist_ok=True)
+
+
+#
+# Fetch planner - latest_obs.txt as a change index
+#
+
+# latest_obs.txt has 1 row per station w/its newest 'YYYY MM DD hh mm'.
+# A station is due when that is newer than the newest .txt row we hold.
+# The .spec file rides along w/the .txt, but can be written later than it:
+# a station stays due while its .spec is older (Last-Modified) than its .txt,
+# the conditional GET then answers 304 until the .spec file changes.
+
+def latest_obs_times(body):
+    """{station: 'YYYY MM DD hh mm'} from latest_obs.txt bytes."""
+    times = {}
+    for line in body.decode('ascii', 'replace').splitlines():
+        if not line.strip() or line.startswith('#'):
+            continue
+        parts = line.split()
+        times[parts[0]] = ' '.join(parts[3:8])     # skip #STN LAT LON
+    return times
+
+
+def _spec_behind(station, state, cutoff):
+    # .spec not rewritten since the .txt was (& still reporting)
+    spec, txt = state.get(station + '.spec', {}), state.get(station + '.txt', {})
+    if not spec.get('last_modified') or not txt.get('last_modified'):
+        return False
+    if spec.get('newest', '') < cutoff:
+        return False
+    return (email.utils.parsedate_to_datetime(spec['last_modified'])
+            < email.utils.parsedate_to_datetime(txt['last_modified']))
+
+
+def plan_fetch(latest, state, max_age_hours=6, now=None):
+    """Pick which stations to download this cycle.
+
+    latest        {station: 'YYYY MM DD hh mm'} (see latest_obs_times)
+    state         fetch state from load_state()
+    max_age_hours drop stations whose latest report is older than this
+
+    Returns (due, stale):
+        due   = [station, ...] reported since last ingested row, or
+                .spec file last written before the .txt (late .spec rows)
+        stale = [station, ...] not reported w/in max_age_hours
+    """
+    now = time.time() if now is None else now
+    cutoff = time.strftime('%Y %m %d %H %M', time.gmtime(now - max_age_hours * 3600))
+    due, stale = [], []
+    for station, key in latest.items():
+        if key < cutoff:
+            stale.append(station)
+        elif key > state.get(station + '.txt', {}).get('newest', ''):
+            due.append(station)
+        elif _spec_behind(station, state, cutoff):
+            due.append(station)
+    return sorted(due), sorted(stale)
@@ -0,0 +1,217 @@
+#
+## Purpose
+#
+    # Parse NDBC whitespace-aligned text (realtime2 .txt/.spec, latest_obs.txt)
+    # straight from bytes into one in-memory table w/station_id attached.
+    # No intermediate per-station .csv files (optional, for debugging only).
+    # Typed at parse time (pandas C tokenizer, no per-line python):
+        # 'MM' -> NaN, dtypes from NOAA_columns.csv (see obs_schema.py)
+        # date fields collapsed into one 'timestamp' once columns are named
+    # TableBuilder collects many station files & builds ONE table at the end
+        # (no DataFrame.append per file - that copies everything each time)
+
+## Used by '1. get_web_data.py', '2. clean_input_data.py' & backfill.py (archives)
+
+## File layout:
+    # row 1: column headers (i.e. #YY  MM DD hh mm WDIR ...)
+    # row 2: units of measure (skipped)
+    # row 3+: data, 'MM' = missing measurement
+
+import glob
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+import obs_schema
+
+COLUMNS_FILE = obs_schema.COLUMNS_FILE
+
+# Missing measurement markers
+NUM_MISSING = ['MM']
+TEXT_MISSING = ['MM', 'N/A', '-']
+
+# Historical archives (.txt.gz) mark missing values w/9s instead of 'MM'
+    # matched as numbers, i.e. '99' also matches 99.0 & 99.00
+ARCHIVE_MISSING = {'WDIR': '999', 'WSPD': '99', 'GST': '99', 'WVHT': '99', 'DPD': '99',
+                   'APD': '99', 'MWD': '999', 'PRES': '9999', 'ATMP': '999', 'WTMP': '999',
+                   'DEWP': '999', 'VIS': '99', 'TIDE': '99'}
+
+# Older archive headers -> current NOAA headers
+HEADER_ALIASES = {'WD': 'WDIR', 'BAR': 'PRES'}
+
+
+def column_names(path=COLUMNS_FILE):
+    """{NOAA header: our column name} from NOAA_columns.csv."""
+    names = pd.read_csv(path, header=None, index_col=0, encoding='utf-8-sig')
+    return names[1].to_dict()
+
+
+def header(body):
+    """NOAA column headers from the 1st row of a file."""
+    return body[:body.find(b'\n')].decode('ascii').split()
+
+
+def read_options(cols, path=COLUMNS_FILE):
+    """dtype & NaN markers per NOAA header, for pd.read_csv."""
+    schema = obs_schema.noaa_dtypes(path)
+    dtype, na = {}, {}
+    for col in cols:
+        dtype[col] = schema.get(col, obs_schema.DEFAULT)
+        if dtype[col] == 'category':
+            na[col] = TEXT_MISSING
+        elif dtype[col].startswith('Int'):
+            dtype[col] = 'float32'      # nullable ints parse slowly, cast after
+            na[col] = NUM_MISSING
+        elif dtype[col].startswith('float'):
+            na[col] = NUM_MISSING
+    return dict(sep=r'\s+', header=None, names=cols, dtype=dtype,
+                na_values=na, keep_default_na=False)
+
+
+def _finish(data, names):
+    # nullable int columns, our column names & one timestamp column
+    schema = obs_schema.noaa_dtypes()
+    ints = {col: schema[col] for col in data.columns
+            if schema.get(col, '').startswith('Int')}
+    if ints:
+        data = data.astype(ints)
+    if names:
+        data = data.rename(names, axis='columns')
+        data = obs_schema.collapse_time(data)
+    return data
+
+
+def parse(body, station_id=None, names=None):
+    """One NDBC file (bytes) -> DataFrame w/typed columns.
+
+    station_id - added as the first column (realtime2 files don't carry it)
+    names      - {NOAA header: new name}, see column_names()
+    """
+    cols = header(body)
+    data = pd.read_csv(io.BytesIO(body), skiprows=2,   # header & units rows
+                       **read_options(cols))
+    if station_id is not None:
+        data.insert(0, 'station_id', pd.Categorical([station_id] * len(data)))
+    return _finish(data, names)
+
+
+def read_stream(stream, station_id=None, names=None, chunk_rows=200_000, missing=ARCHIVE_MISSING):
+    """NDBC text from a binary stream (i.e. a gzip archive) -> DataFrames of
+    up to chunk_rows rows, read as the stream is consumed (bounded memory).
+
+    Archive header variants:
+        '#YY  MM DD hh mm ...' + units row   (2007 on, same as realtime2)
+        'YYYY MM DD hh mm ...' / 'YYYY MM DD hh ...'   (no units row, minute
+        missing before 2005 -> 0); 2-digit 'YY' years -> 19YY
+    """
+    cols = [HEADER_ALIASES.get(c, c) for c in stream.readline().decode('ascii').split()]
+    if not cols:
+        return
+    if cols[0].startswith('#'):
+        stream.readline()   # units of measure
+    options = read_options(cols)
+    for col, marker in (missing or {}).items():
+        if col in options['na_values']:
+            options['na_values'][col] = options['na_values'][col] + [marker]
+    year = cols[0]
+    for data in pd.read_csv(stream, chunksize=chunk_rows, **options):
+        if year == 'YY' and len(data) and data[year].max() < 100:
+            data[year] = data[year] + 1900
+        if 'mm' not in data.columns:
+            data.insert(cols.index('hh') + 1, 'mm', 0)
+        if station_id is not None:
+            data.insert(0, 'station_id', pd.Categorical([station_id] * len(data)))
+        yield _finish(data, names)
+
+
+class TableBuilder:
+    """Collect station files, then parse them into one table in a single pass.
+
+    Files w/the same header row are joined & parsed together, so the
+    combined table is built once (not copied once per station). Raw text is
+    referenced, not copied, & parsed in batches of ~batch_bytes to keep
+    peak memory near 2x the final table.
+    """
+
+    def __init__(self, names=None, batch_bytes=8 * 2**20):
+        self.names = names
+        self.batch_bytes = batch_bytes
+        self._codes = {}    # station -> category code
+        self._groups = {}   # header row -> [(data rows, station code, n rows)]
+
+    def add(self, station_id, body):
+        start = body.find(b'\n')
+        start = body.find(b'\n', start + 1) + 1   # skip 2nd row with units of measure
+        if not start or not body[start:].strip():
+            return
+        rest = memoryview(body)[start:]
+        if not body.endswith(b'\n'):
+            rest = bytes(rest) + b'\n'
+        code = self._codes.setdefault(station_id, len(self._codes))
+        head = bytes(body[:body.find(b'\n')]).strip()
+        self._groups.setdefault(head, []).append((rest, code, body.count(b'\n', start)
+                                                  + (not body.endswith(b'\n'))))
+
+    def _parse(self, cols, files, stations):
+        # one batch of files w/the same header -> DataFrame
+        body = b''.join(f[0] for f in files)
+        data = pd.read_csv(io.BytesIO(body), skip_blank_lines=False,
+                           **read_options(cols))
+        del body
+        rows = [f[2] for f in files]
+        if len(data) != sum(rows):
+            raise ValueError('row count mismatch in %d files w/header %s'
+                             % (len(files), ' '.join(cols)))
+        codes = np.repeat(np.array([f[1] for f in files], dtype=np.int32), rows)
+        data.insert(0, 'station_id', pd.Categorical.from_codes(codes, stations))
+        return _finish(data, self.names)
+
+    def build(self):
+        """Parse everything collected -> DataFrame (station_id first)."""
+        stations = list(self._codes)    # same categories in every batch
+        tables = []
+        for head, files in self._groups.items():
+            cols = head.decode('ascii').split()
+            batch, size = [], 0
+            for f in files:
+                batch.append(f)
+                size += len(f[0])
+                if size >= self.batch_bytes:
+                    tables.append(self._parse(cols, batch, stations))
+                    batch, size = [], 0
+            if batch:
+                tables.append(self._parse(cols, batch, stations))
+        self._codes, self._groups = {}, {}
+        if not tables:
+            return pd.DataFrame()
+        if len(tables) == 1:
+            return tables[0]
+        # text categories differ between batches - cast back after joining
+        return obs_schema.apply(pd.concat(tables, ignore_index=True))
+
+
+def build_table(files, names=None):
+    """{station: bytes} -> one DataFrame, see TableBuilder."""
+    builder = TableBuilder(names)
+    for station, body in files.items():
+        builder.add(station, body)
+    return builder.build()
+
+
+def read_raw(pattern):
+    """{station: bytes} for raw files matching a glob (i.e. 'data_raw/*.txt')."""
+    files = {}
+    for file in glob.glob(pattern):
+        stem = os.path.splitext(os.path.basename(file))[0]
+        with open(file, 'rb') as fh:
+            files[stem] = fh.read()
+    return files
+
+
+def write_debug_csv(data, out_dir):
+    """Debug only. One .csv per station (the old data_clean/csv layout)."""
+    os.makedirs(out_dir, exist_ok=True)
+    for station, rows in data.groupby('station_id', sort=False):
+        rows.to_csv(os.path.join(out_dir, str(station) + '.csv'), index=False)
@@ -0,0 +1,122 @@
+#
+## Purpose
+#
+    # Join .txt (general) & .spec (wave) readings on (station_id, timestamp)
+    # 1. Both tables sorted by one int64 key: station code | minutes since 1970
+        # realtime2 files are already time-ordered (newest-first), so the
+        # stable sort is close to a reversal
+    # 2. Duplicates dropped on the sorted key (1st occurrence kept)
+    # 3. .spec rows matched to .txt rows by binary search on the sorted keys
+    # 4. lat/long from a station lookup array, indexed by station code
+    # Only the kept columns are gathered - no wide merged table
+    # update() writes late .spec rows onto rows joined on an earlier run
+
+## Used by '2. clean_input_data.py'
+
+import numpy as np
+import pandas as pd
+
+import obs_schema
+
+MINUTE = 60 * 10**9     # ns
+
+
+def _codes(ids, col):
+    # station codes in 'ids' order (-1 = not in ids), via the categories
+    col = col if isinstance(col.dtype, pd.CategoricalDtype) else col.astype('category')
+    remap = ids.get_indexer(col.cat.categories.astype(str))
+    codes = col.cat.codes.to_numpy().astype(np.int64)
+    return np.where(codes >= 0, remap[codes], -1)
+
+
+def _keys(data, ids, t0):
+    # codes & int64 keys (station code | minutes since t0)
+    codes = _codes(ids, data['station_id'])
+    minutes = (data['timestamp'].to_numpy('datetime64[ns]').view(np.int64)
+               - pd.Timestamp(t0).value) // MINUTE
+    return codes, (codes << 40) | minutes
+
+
+def _sorted_unique(key, codes):
+    # positions that sort by key, 1st of each duplicate, known stations only
+    order = np.argsort(key, kind='stable')
+    key = key[order]
+    first = np.ones(len(key), dtype=bool)
+    first[1:] = key[1:] != key[:-1]
+    keep = first & (codes[order] >= 0)
+    return order[keep], int((~first).sum())
+
+
+def join(txt, spec, stations, txt_cols, spec_cols):
+    """Left join .spec onto .txt by (station_id, timestamp) in sorted order.
+
+    txt, spec  parsed tables (station_id, timestamp, ...)
+    stations   station lookup (station_id, latitude, longitude)
+    txt_cols   columns to keep from .txt
+    spec_cols  columns to keep from .spec
+
+    Returns station_id, timestamp, latitude, longitude, txt_cols, spec_cols,
+    sorted by station & time. data.attrs['duplicates'] = rows dropped.
+    """
+    ids = txt['station_id'].astype('category').cat.categories.astype(str)
+
+    # Shared minute origin, so .txt & .spec keys line up
+    t0 = txt['timestamp'].min()
+    if len(spec):
+        t0 = min(t0, spec['timestamp'].min())
+    codes, key = _keys(txt, ids, t0)
+    t_order, t_dups = _sorted_unique(key, codes)
+    t_key, t_codes = key[t_order], codes[t_order]
+
+    s_codes, s_key = _keys(spec, ids, t0)
+    s_order, _ = _sorted_unique(s_key, s_codes)
+    s_key = s_key[s_order]
+
+    # .spec row for each .txt row (-1 = none)
+    pos = np.searchsorted(s_key, t_key)
+    pos[pos == len(s_key)] = 0
+    hit = (s_key[pos] == t_key) if len(s_key) else np.zeros(len(t_key), dtype=bool)
+    s_rows = np.where(hit, s_order[pos] if len(s_order) else 0, -1)
+
+    # lat/long per station code
+    lut = stations.assign(station_id=stations['station_id'].astype(str)) \
+                  .drop_duplicates('station_id').set_index('station_id').reindex(ids)
+
+    out = {'station_id': pd.Categorical.from_codes(t_codes, ids),
+           'timestamp': txt['timestamp'].to_numpy('datetime64[ns]')[t_order],
+           'latitude': lut['latitude'].to_numpy()[t_codes],
+           'longitude': lut['longitude'].to_numpy()[t_codes]}
+    for col in txt_cols:
+        out[col] = txt[col].array.take(t_order)
+    for col in spec_cols:
+        out[col] = spec[col].array.take(s_rows, allow_fill=True)
+
+    data = obs_schema.apply(pd.DataFrame(out))
+    data.attrs['duplicates'] = t_dups
+    return data
+
+
+def update(data, spec, spec_cols):
+    """Write .spec values onto the rows of data w/the same (station_id, timestamp).
+
+    For .spec rows that arrive after their .txt row was joined (e.g. onto the
+    last run's window). Returns (data, mask of the rows updated).
+    """
+    hit = np.zeros(len(data), dtype=bool)
+    if not len(spec) or not len(data):
+        return data, hit
+    spec = spec.assign(station_id=spec['station_id'].astype(str)) \
+               .drop_duplicates(['station_id', 'timestamp'])
+    index = pd.MultiIndex.from_arrays([spec['station_id'],
+                                       spec['timestamp'].to_numpy('datetime64[ns]')])
+    rows = index.get_indexer(pd.MultiIndex.from_arrays(
+        [data['station_id'].astype(str), data['timestamp'].to_numpy('datetime64[ns]')]))
+    hit = rows >= 0
+    if hit.any():
+        data = data.copy()
+        for col in spec_cols:
+            values = data[col].to_numpy(dtype=object, copy=True)
+            values[hit] = spec[col].astype(object).to_numpy()[rows[hit]]
+            data[col] = values
+        data = obs_schema.apply(data)
+    return data, hit
@@ -0,0 +1,90 @@
+#
+## Purpose
+#
+    # One compact schema for observations, shared by every stage
+    # Driven by NOAA_columns.csv: NOAA header, our column name, dtype
+        # station_id, compass points, steepness -> category
+        # measurements -> float32
+        # directions -> small ints (Int16, allows missing)
+        # year/month/day/hour/minute -> collapsed into one 'timestamp'
+
+## Used by ndbc_parse.py, obs_store.py, '2. clean_input_data.py', watch.py & backfill.py
+
+import functools
+
+import numpy as np
+import pandas as pd
+
+COLUMNS_FILE = 'NOAA_columns.csv'
+
+TIME_PARTS = ['year', 'month', 'day', 'hour', 'minute']
+
+# Columns we add that are not in the NOAA files
+EXTRA = {'timestamp': 'datetime64[ns]'}
+
+DEFAULT = 'float32'     # NOAA header missing from NOAA_columns.csv
+
+# Wind speed unit of the cleaned data: 1 knot = 1.68781 ft/sec
+KNOTS_TO_FTS = 1.68781
+
+
+def _read(path):
+    return pd.read_csv(path, header=None, names=['noaa', 'name', 'dtype'],
+                       encoding='utf-8-sig')
+
+
+@functools.lru_cache()
+def noaa_dtypes(path=COLUMNS_FILE):
+    """{NOAA header: dtype} - what each raw column is read as (don't modify)."""
+    cols = _read(path)
+    return dict(zip(cols['noaa'], cols['dtype']))
+
+
+@functools.lru_cache()
+def dtypes(path=COLUMNS_FILE):
+    """{column name: dtype} for cleaned observations, time parts dropped (don't modify)."""
+    cols = _read(path)
+    out = dict(zip(cols['name'], cols['dtype']))
+    for part in TIME_PARTS:
+        out.pop(part, None)
+    out.update(EXTRA)
+    return out
+
+
+def timestamps(year, month, day, hour, minute):
+    """datetime64[ns] array from integer date fields, by vector math.
+
+    Days since 1970-01-01 via the civil-calendar formula (March-based
+    years, 400-year eras), so no per-row date parsing. Two-digit years
+    (old 'YY' files) are taken as 1950-2049.
+    """
+    year = np.asarray(year, dtype=np.int64)
+    year = np.where(year < 100, year + np.where(year < 50, 2000, 1900), year)
+    month = np.asarray(month, dtype=np.int64)
+    y = year - (month <= 2)
+    era = y // 400
+    yoe = y - era * 400                                     # [0, 399]
+    doy = (153 * ((month + 9) % 12) + 2) // 5 + np.asarray(day, dtype=np.int64) - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy           # [0, 146096]
+    days = era * 146097 + doe - 719468
+    minutes = (days * 24 + np.asarray(hour, dtype=np.int64)) * 60 \
+        + np.asarray(minute, dtype=np.int64)
+    return (minutes * 60_000_000_000).view('datetime64[ns]')
+
+
+def collapse_time(data):
+    """Replace year/month/day/hour/minute w/one 'timestamp' column."""
+    if not set(TIME_PARTS).issubset(data.columns):
+        return data
+    stamp = timestamps(*(data[part].to_numpy() for part in TIME_PARTS))
+    data = data.drop(columns=TIME_PARTS)
+    data.insert(1 if 'station_id' in data.columns else 0, 'timestamp', stamp)
+    return data
+
+
+def apply(data, path=COLUMNS_FILE):
+    """Cast the columns that are in the schema to their schema dtype."""
+    schema = dtypes(path)
+    cast = {col: schema[col] for col in data.columns
+            if col in schema and str(data[col].dtype) != schema[col]}
+    return data.astype(cast) if cast else data
@@ -0,0 +1,156 @@
+#
+## Purpose
+#
+    # On-disk columnar store for cleaned observations (replaces the zipped
+    # pickle 'cleaned_wx_data.pkl.zip')
+    # 1. Parquet files partitioned by station & date
+        # obs_store/station_id=41001/date=2021-05-18/part-....parquet
+    # 2. Read only the columns, stations & time range needed
+        # station/date filters skip whole folders, timestamp filter skips row groups
+        # window_start() -> start of the last 72 hrs held (newest date folder only)
+    # 3. Append - each write adds new files, nothing is rewritten
+        # append_new() writes only rows newer than the store holds per station
+        # (a rerun over the same 72 hrs adds nothing)
+    # 4. Loaded w/the shared schema (see obs_schema.py)
+
+## Used by '2. clean_input_data.py' & backfill.py (write), '4. site_evaluation.py' (read)
+
+# Note: pyarrow is not always an automatic Anaconda module
+    # To add, (1) Open Anacoda Command Window, (2) enter command below
+    # `conda install pyarrow -c conda-forge`
+
+import os
+import time
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+import obs_schema
+
+STORE = 'obs_store'
+
+PARTITIONING = ds.partitioning(pa.schema([('station_id', pa.string()),
+                                          ('date', pa.string())]),
+                               flavor='hive')
+
+
+def write(data, path=STORE, basename=None):
+    """Append observations (needs 'station_id' & 'timestamp' columns).
+
+    basename  fixed file name template w/'{i}' (i.e. per archive chunk) -
+              writing the same rows again replaces those files, no duplicates
+    """
+    if len(data) == 0:
+        return
+    data = pd.DataFrame(data).drop(columns='geometry', errors='ignore')
+    data = data.assign(station_id=data['station_id'].astype(str),
+                       date=data['timestamp'].dt.strftime('%Y-%m-%d'))
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    # text columns w/o any value (i.e. no .spec rows) come out w/o a string type -
+    # cast, so every file has the same schema (the 1st file read sets it)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type) and field.type.value_type != pa.string():
+            table = table.set_column(i, field.name, table.column(i).cast(pa.dictionary(pa.int8(), pa.string())))
+    # unique file names per write, so appends never overwrite earlier files
+    name = 'part-%d-%s-{i}.parquet' % (time.time(), uuid.uuid4().hex[:8])
+    ds.write_dataset(table, path, format='parquet', partitioning=PARTITIONING,
+                     basename_template=name if basename is None else basename,
+                     existing_data_behavior='overwrite_or_ignore')
+
+
+def newest(path=STORE, stations=None, since=None):
+    """{station_id: latest timestamp in the store} (stations/since narrow the scan)."""
+    if not os.path.isdir(path):
+        return {}
+    cond = None
+    if stations is not None:
+        cond = ds.field('station_id').isin([str(s) for s in stations])
+    if since is not None:
+        since = pd.Timestamp(since)
+        after = (ds.field('date') >= since.strftime('%Y-%m-%d')) & (ds.field('timestamp') >= since)
+        cond = after if cond is None else cond & after
+    table = dataset(path).to_table(columns=['station_id', 'timestamp'], filter=cond)
+    if not table.num_rows:
+        return {}
+    last = table.group_by('station_id').aggregate([('timestamp', 'max')]).to_pandas()
+    return dict(zip(last['station_id'], last['timestamp_max']))
+
+
+def window_start(path=STORE, stations=None, hours=72):
+    """Newest timestamp in the store - hours (None if empty), to bound read().
+
+    The newest date comes from the partition folder names; only that
+    date's files are read for the newest timestamp.
+    """
+    if not os.path.isdir(path):
+        return None
+    cond = None
+    if stations is not None:
+        cond = ds.field('station_id').isin([str(s) for s in stations])
+    dates = [ds.get_partition_keys(f.partition_expression).get('date')
+             for f in dataset(path).get_fragments(filter=cond)]
+    dates = [d for d in dates if d]
+    if not dates:
+        return None
+    last = newest(path, stations, since=max(dates))
+    if not last:
+        return None
+    return max(last.values()) - pd.Timedelta(hours=hours)
+
+
+def append_new(data, path=STORE):
+    """Write only the rows newer than the store's latest for their station -> rows written."""
+    if len(data) == 0:
+        return 0
+    ids = data['station_id'].astype(str)
+    last = newest(path, stations=ids.unique(), since=data['timestamp'].min())
+    cutoff = pd.to_datetime(ids.map(last))
+    keep = (cutoff.isna() | (data['timestamp'] > cutoff)).to_numpy()
+    write(data[keep], path)
+    return int(keep.sum())
+
+
+def dataset(path=STORE):
+    return ds.dataset(path, format='parquet', partitioning=PARTITIONING)
+
+
+def read(path=STORE, stations=None, start=None, end=None, columns=None,
+         dedupe=True):
+    """Load observations -> DataFrame.
+
+    stations    list of station ids (None = all)
+    start, end  timestamp range, end exclusive (None = open)
+    columns     columns to load (None = all); station_id & timestamp always kept
+    dedupe      drop repeated (station_id, timestamp) rows from overlapping appends
+    """
+    data = dataset(path)
+    cond = None
+
+    def both(a, b):
+        return b if a is None else a & b
+
+    if stations is not None:
+        cond = both(cond, ds.field('station_id').isin([str(s) for s in stations]))
+    if start is not None:
+        start = pd.Timestamp(start)
+        cond = both(cond, ds.field('date') >= start.strftime('%Y-%m-%d'))
+        cond = both(cond, ds.field('timestamp') >= start)
+    if end is not None:
+        end = pd.Timestamp(end)
+        cond = both(cond, ds.field('date') <= end.strftime('%Y-%m-%d'))
+        cond = both(cond, ds.field('timestamp') < end)
+
+    if columns is not None:
+        keep = ['station_id', 'timestamp']
+        columns = keep + [c for c in columns if c not in keep]
+
+    table = data.to_table(columns=columns, filter=cond)
+    out = table.to_pandas()
+    out = out.drop(columns='date', errors='ignore')
+    out = out[['station_id'] + [c for c in out.columns if c != 'station_id']]
+    out = obs_schema.apply(out)
+    if dedupe:
+        out = out.drop_duplicates(subset=['station_id', 'timestamp'], keep='last')
+    return out.sort_values(['station_id', 'timestamp']).reset_index(drop=True)
@@ -0,0 +1,244 @@
+#
+## Purpose
+#
+    # Run the whole workflow w/one command:
+    #   download -> clean -> site selection -> evaluation
+    # 1. Each numbered .py is a stage; stages form a DAG by what they need
+    #    (in-memory values from earlier stages & input files)
+    # 2. Values are handed over in memory - no write & read back of
+    #    splash_down.gpkg layers, obs_store or wx_grid.npz between stages
+    # 3. Each stage has a content hash (script + helper modules it imports + input files
+    #    + input values + persist); if it matches the last run, the stage is skipped
+    #    & its cached outputs (cache/pipeline/) are used
+    # 4. persist=False (default) skips the gpkg/Parquet/npz exports
+
+## Run from the repository folder:
+    # python pipeline.py                   # all stages
+    # python pipeline.py --skip-download   # use data_raw/ as is
+    # python pipeline.py --persist         # also write the exports
+    # python pipeline.py --force           # ignore the stage cache
+
+## Data files are read/written in the current folder (as for the scripts)
+
+## The scripts still run on their own (e.g. in Spyder) - handoff() then
+## falls back to reading the file, persist() is True
+
+import argparse
+import ast
+import glob
+import hashlib
+import os
+import pickle
+import runpy
+import sys
+import time
+from graphlib import TopologicalSorter
+
+import numpy as np
+import pandas as pd
+
+import figures
+from figures import hash_frame
+
+CACHE_DIR = 'cache/pipeline'
+SCRIPTS = os.path.dirname(os.path.abspath(__file__))    # the numbered .py files
+RUNNER = os.path.abspath(__file__)      # not part of any stage's hash
+
+
+class Stage:
+    """One numbered script: what it needs & what it hands on.
+
+    needs    names of values from earlier stages
+    outputs  {name handed on: variable in the script}
+    files    input files/folders whose contents are part of the stage hash
+    after    stages that must run 1st w/o a value handed over (i.e. via files)
+    """
+
+    def __init__(self, name, script, needs=(), outputs=None, files=(), after=()):
+        self.name, self.script = name, os.path.join(SCRIPTS, script)
+        self.needs, self.outputs = list(needs), dict(outputs or {})
+        self.files, self.after = list(files), list(after)
+
+
+STAGES = [
+    Stage('download', '1. get_web_data.py'),
+    Stage('clean', '2. clean_input_data.py',
+          outputs={'buoys_all': 'buoys_all', 'wx_data': 'data', 'field': 'field'},
+          files=['data_raw/*.txt', 'data_raw/spec/*.spec', 'latest_obs.txt', 'NOAA_columns.csv'],
+          after=['download']),
+    Stage('sites', '3. landing_site_data.py',
+          needs=['buoys_all'],
+          outputs={'sites': 'sites', 'nearby': 'in_buffer'},
+          files=['NASA_sites.csv']),
+    Stage('evaluation', '4. site_evaluation.py',
+          needs=['nearby', 'wx_data', 'sites', 'field'],
+          outputs={'by_timestamp': 'by_timestamp', 'site_units': 'site_units',
+                   'site_status': 'site_status', 'site_latest': 'site_latest',
+                   'site_picture': 'site_picture'},
+          files=['CG_units.csv', 'splashdown_criteria.csv']),
+]
+
+# Set by run() while a stage executes
+_values = None
+_persist = True
+
+
+def handoff(name, load):
+    """Value from an earlier stage when run by the pipeline, else load()."""
+    if _values is not None and name in _values:
+        return _values[name]
+    return load()
+
+
+def persist():
+    """True if the stage should write its exports (always, when run on its own)."""
+    return _persist
+
+
+def order(stages):
+    """Stages in dependency order (needs -> producing stage, plus after)."""
+    producer = {out: s.name for s in stages for out in s.outputs}
+    graph = {s.name: {producer[n] for n in s.needs} | set(s.after) for s in stages}
+    by_name = {s.name: s for s in stages}
+    return [by_name[n] for n in TopologicalSorter(graph).static_order()]
+
+
+def _update(h, value):
+    # content, not pickle bytes (pickle output depends on object identity)
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        hash_frame(value, h)
+    elif isinstance(value, np.ndarray) and value.dtype != object:
+        h.update(('%s%s' % (value.dtype, value.shape)).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value, key=str):
+            h.update(str(key).encode())
+            _update(h, value[key])
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _update(h, item)
+    elif hasattr(value, '__dict__'):
+        _update(h, vars(value))     # e.g. wx_grid.Field
+    else:
+        h.update(repr(value).encode())
+
+
+def _digest(value):
+    h = hashlib.sha1()
+    _update(h, value)
+    return h.hexdigest()
+
+
+def helper_modules(script, folder=SCRIPTS):
+    """Local modules (folder/<name>.py) a script imports, directly or via each other."""
+    seen, todo = set(), [script]
+    while todo:
+        with open(todo.pop(), 'rb') as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):     # incl. imports inside if blocks & functions
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                path = os.path.join(folder, name.split('.')[0] + '.py')
+                if path not in seen and path != RUNNER and os.path.exists(path):
+                    seen.add(path)
+                    todo.append(path)
+    return sorted(seen)
+
+
+def stage_key(stage, digests, persist=False):
+    """Hash of the script, the helper modules it imports, its input files (name, size,
+    modified time), input values & persist (a --persist run writes exports
+    that a cached run without it never made)."""
+    with open(stage.script, 'rb') as f:
+        h = hashlib.sha1(f.read())
+    h.update(b'persist|%d' % bool(persist))
+    for path in helper_modules(stage.script):
+        with open(path, 'rb') as f:     # e.g. wx_grid.py VARIABLES changes the field
+            h.update(os.path.basename(path).encode() + f.read())
+    for pattern in stage.files:
+        for path in sorted(glob.glob(pattern)):
+            st = os.stat(path)
+            h.update(('%s|%d|%d' % (path, st.st_size, st.st_mtime_ns)).encode())
+    for name in stage.needs:
+        h.update(('%s|%s' % (name, digests[name])).encode())
+    return h.hexdigest()
+
+
+def run(stages=STAGES, skip=(), persist=False, force=False, cache_dir=CACHE_DIR):
+    """Run the stages in order -> (values {name: value}, report {stage: status & seconds})."""
+    global _values, _persist
+    values, digests, report = {}, {}, {}
+    os.makedirs(cache_dir, exist_ok=True)
+    figures.start_pool()    # figure workers forked before any stage starts threads
+
+    try:
+        for stage in order(stages):
+            start = time.perf_counter()
+            if stage.name in skip:
+                report[stage.name] = ('skipped', 0.0)
+                continue
+
+            key = stage_key(stage, digests, persist)
+            cache = os.path.join(cache_dir, stage.name + '.pkl')
+            cached = None
+            if not force and stage.outputs and os.path.exists(cache):
+                with open(cache, 'rb') as f:
+                    cached = pickle.load(f)
+
+            if cached is not None and cached['key'] == key:
+                outputs, status = cached['outputs'], 'cached'
+            else:
+                _values, _persist = {n: values[n] for n in stage.needs}, persist
+                try:
+                    namespace = runpy.run_path(stage.script, run_name='__pipeline__')
+                finally:
+                    _values, _persist = None, True
+                outputs = {name: namespace[var] for name, var in stage.outputs.items()}
+                if stage.outputs:
+                    with open(cache, 'wb') as f:
+                        pickle.dump({'key': key, 'outputs': outputs}, f, protocol=pickle.HIGHEST_PROTOCOL)
+                status = 'ran'
+
+            values.update(outputs)
+            digests.update({name: _digest(v) for name, v in outputs.items()})
+            report[stage.name] = (status, time.perf_counter() - start)
+    finally:
+        figures.stop_pool()
+    return values, report
+
+
+def load_outputs(stages=STAGES, cache_dir=CACHE_DIR):
+    """Values from the last run of each stage (cache/pipeline/), w/o running anything."""
+    values = {}
+    for stage in stages:
+        cache = os.path.join(cache_dir, stage.name + '.pkl')
+        if stage.outputs and os.path.exists(cache):
+            with open(cache, 'rb') as f:
+                values.update(pickle.load(f)['outputs'])
+    return values
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='download -> clean -> sites -> evaluation')
+    parser.add_argument('--skip-download', action='store_true', help='use data_raw/ as is')
+    parser.add_argument('--persist', action='store_true', help='write gpkg/Parquet/npz exports')
+    parser.add_argument('--force', action='store_true', help='run every stage')
+    args = parser.parse_args(argv)
+
+    _, report = run(skip=['download'] if args.skip_download else (),
+                    persist=args.persist, force=args.force)
+    print('\n Pipeline:')
+    for name, (status, seconds) in report.items():
+        print('   %-11s %-8s %6.1f s' % (name, status, seconds))
+
+
+if __name__ == '__main__':
+    # Scripts 'import pipeline' - run through that module, not __main__,
+    # so handoff() & persist() see the values set by run()
+    sys.modules.setdefault('pipeline', sys.modules['__main__'])
+    main()
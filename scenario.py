@@ -0,0 +1,166 @@
+#
+## Purpose
+#
+    # Scenario sweep - selection radius x candidate site sets, in one pass
+    # (instead of editing radius_nm / NASA_sites.csv & rerunning 3. & 4.)
+    # 1. Observations & station positions loaded once (last pipeline.py run,
+    #    else the geopackage & obs_store/)
+    # 2. One distance matrix for all sites of all sets (site_distance, cached);
+    #    each radius is a cut of it, no new distance computation
+    # 3. Readings binned per station & 10 min step once (site_series.bin_stations);
+    #    each radius only adds the bins up for its site x station pairs
+    # 4. A site's result does not depend on the set it is in, so every
+    #    (radius, site) is rated once & the sets just pick their rows
+    # 5. Output: one comparison table, a row per set x radius x site
+    #    (stations, data coverage, wind & waves, Go/Marginal/No-Go share of
+    #    the period & latest status) + a summary per set x radius
+
+## Run from the data folder (as for the scripts):
+    # python scenario.py                                     # NASA_sites.csv, 60/90/120/180 nm
+    # python scenario.py --sites NASA_sites.csv alt_sites.csv --radii 60 120
+        # a site file is one set (named after the file), or several w/a 'set' column
+    # -> data_clean/scenarios.csv
+
+import argparse
+import os
+import warnings
+
+import geopandas
+import numpy as np
+import pandas as pd
+
+import criteria
+import obs_store
+import pipeline
+import site_distance
+import site_series
+
+RADII = [60, 90, 120, 180]      # nm
+SITES = ['NASA_sites.csv']
+OUTPUT = 'data_clean/scenarios.csv'
+METRICS = ['wind_spd', 'wind_gust', 'wind_wave_height', 'swell_height', 'ave_period']
+
+
+def load_sets(paths):
+    """Site files -> (site sets {set: [Name]}, all sites: Name (index), latitude, longitude)."""
+    sets, tables = {}, []
+    for path in paths:
+        table = pd.read_csv(path)
+        if 'set' not in table.columns:
+            table['set'] = os.path.splitext(os.path.basename(path))[0]
+        for name, group in table.groupby('set', sort=False):
+            sets[str(name)] = list(pd.unique(group['Name']))
+        tables.append(table[['Name', 'latitude', 'longitude']])
+    sites = pd.concat(tables).drop_duplicates()
+    clash = sites['Name'][sites['Name'].duplicated()]
+    if len(clash):
+        raise ValueError('same site name w/different positions: %s' % sorted(set(clash)))
+    return sets, sites.set_index('Name')
+
+
+def load_inputs():
+    """Station positions & observations (or a function stations -> observations)
+    - last pipeline.py run, else the geopackage & obs_store/."""
+    values = pipeline.load_outputs()
+    buoys = values.get('buoys_all')
+    if buoys is None:
+        buoys = geopandas.read_file('splash_down.gpkg', layer='buoys_all')
+    wx = values.get('wx_data')
+    if wx is None:
+        def wx(stations):
+            # last 72 hrs held, not every year backfilled
+            stations = list(stations)
+            return obs_store.read(stations=stations, start=obs_store.window_start(stations=stations),
+                                  columns=METRICS)
+    return pd.DataFrame(buoys[['station_id', 'latitude', 'longitude']]), wx
+
+
+def rate(series, rules):
+    """Per site of a SiteSeries -> stations' data coverage, wind & waves, status shares."""
+    wind = series.metrics.get_loc('wind_spd')
+    wave = series.metrics.get_loc('wind_wave_height')
+    status = criteria.evaluate(series.arrays(), rules, series.sites, series.times)
+    steps = max(len(series.times), 1)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)     # sites w/all NaN
+        out = pd.DataFrame({
+            'coverage_pct': (series.readings[:, :, wind] > 0).sum(axis=1) / steps * 100,
+            'wind_mean': np.nanmean(series.values[:, :, wind], axis=1),
+            'wind_max': np.nanmax(series.values[:, :, wind], axis=1),
+            'wave_max': np.nanmax(series.values[:, :, wave], axis=1),
+        }, index=series.sites)
+    for code, label in enumerate(criteria.STATUS):
+        out[label + '_pct'] = (status.overall == code).sum(axis=1) / steps * 100
+    latest = status.latest().set_index('Name')
+    out['latest'] = latest['status']
+    out['latest_rule'] = latest['rule']
+    return out
+
+
+def sweep(sets, sites, buoys, wx, radii=RADII, rules=None, freq='10min'):
+    """All set x radius scenarios -> (per site table, summary per set & radius).
+
+    wx  observations, or a function stations -> observations (only the
+        stations w/in the largest radius are read)
+    """
+    rules = criteria.load() if rules is None else rules
+
+    # Distances once for every site of every set (cached, unchanged cells reused)
+    dm = site_distance.DistanceMatrix.load()
+    dm.update(sites=sites, stations=buoys)
+    dm.save()
+    pairs = dm.within(max(radii))
+
+    # Readings binned once, stations w/in the largest radius of any site
+    if callable(wx):
+        wx = wx(pd.unique(pairs['station_id']))
+    bins = site_series.bin_stations(wx, pairs['station_id'], METRICS, freq)
+
+    # Every site once per radius
+    rated = []
+    for radius in radii:
+        near = pairs[pairs['distance_nm'] <= radius]
+        per_site = rate(bins.to_sites(near), rules)
+        per_site = per_site.reindex(sites.index)    # sites w/o stations -> NaN
+        per_site.insert(0, 'stations', near.groupby('Name').size().reindex(sites.index, fill_value=0))
+        per_site['latest'] = per_site['latest'].fillna('no stations')
+        per_site.insert(0, 'radius_nm', radius)
+        rated.append((radius, near, per_site))
+
+    # Sets pick their rows
+    table, summary = [], []
+    for name, members in sets.items():
+        for radius, near, per_site in rated:
+            rows = per_site.loc[members].reset_index()
+            rows.insert(0, 'set', name)
+            table.append(rows)
+            summary.append({'set': name, 'radius_nm': radius, 'sites': len(members),
+                            'sites_no_station': int((rows['stations'] == 0).sum()),
+                            'stations': near.loc[near['Name'].isin(members), 'station_id'].nunique(),
+                            'coverage_pct': rows['coverage_pct'].mean(),
+                            'Go_pct': rows['Go_pct'].mean(),
+                            'latest_go': int((rows['latest'] == 'Go').sum()),
+                            'latest_no_go': int((rows['latest'] == 'No-Go').sum())})
+    return pd.concat(table, ignore_index=True), pd.DataFrame(summary)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare selection radii & site sets')
+    parser.add_argument('--sites', nargs='+', default=SITES, help='site files (Name, latitude, longitude[, set])')
+    parser.add_argument('--radii', nargs='+', type=float, default=RADII, help='nm')
+    parser.add_argument('--output', default=OUTPUT)
+    args = parser.parse_args(argv)
+
+    sets, sites = load_sets(args.sites)
+    buoys, wx = load_inputs()
+    table, summary = sweep(sets, sites, buoys, wx, args.radii)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    table.round(2).to_csv(args.output, index=False)
+    print('\n %d scenarios (%d sets x %d radii), %d sites -> %s'
+          % (len(summary), len(sets), len(args.radii), len(sites), args.output))
+    print(summary.round(1).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
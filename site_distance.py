@@ -0,0 +1,134 @@
+#
+## Purpose
+#
+    # Great-circle distance matrix (nautical miles), sites x stations
+    # 1. Computed in one vectorized pass (haversine, numpy broadcasting)
+    # 2. Cached - update() only recomputes rows/columns for sites or
+    #    stations that are new or moved; save()/load() keep it between runs
+    # 3. Queries: stations w/in R nm, k nearest per site
+    # 4. circles() - geodesic range rings for maps (replaces 2-degree buffers)
+
+## Used by scenario.py (matrix) & '3. landing_site_data.py' (range rings)
+
+import os
+
+import numpy as np
+import pandas as pd
+from shapely.geometry import Polygon
+
+from station_index import EARTH_RADIUS_NM, haversine_nm
+
+CACHE = 'cache/distance_matrix.npz'
+
+
+def _points(table, id_col):
+    # (ids, lat, lon) from a table w/id column (or named index), latitude, longitude
+    if id_col not in table.columns:
+        table = table.reset_index()
+    return (pd.Index(table[id_col].astype(str).to_numpy()),
+            table['latitude'].to_numpy(np.float64),
+            table['longitude'].to_numpy(np.float64))
+
+
+def _match(old_ids, old_lat, old_lon, ids, lat, lon):
+    # old position of each id, -1 if new or moved
+    pos = old_ids.get_indexer(ids)
+    known = pos >= 0
+    moved = np.zeros(len(ids), dtype=bool)
+    moved[known] = (old_lat[pos[known]] != lat[known]) | (old_lon[pos[known]] != lon[known])
+    pos[moved] = -1
+    return pos
+
+
+class DistanceMatrix:
+    """Sites x stations great-circle distances (nm), cached & updated in place."""
+
+    def __init__(self):
+        empty = pd.Index([], dtype=object)
+        self.sites, self.stations = empty, empty
+        self.site_lat = self.site_lon = np.empty(0)
+        self.station_lat = self.station_lon = np.empty(0)
+        self.nm = np.empty((0, 0))
+        self.recomputed = 0     # cells computed by the last update()
+
+    def update(self, sites=None, stations=None):
+        """Set sites (Name, latitude, longitude) and/or stations
+        (station_id, latitude, longitude); unchanged cells are reused."""
+        s_ids, s_lat, s_lon = (_points(sites, 'Name') if sites is not None
+                               else (self.sites, self.site_lat, self.site_lon))
+        t_ids, t_lat, t_lon = (_points(stations, 'station_id') if stations is not None
+                               else (self.stations, self.station_lat, self.station_lon))
+        rows = _match(self.sites, self.site_lat, self.site_lon, s_ids, s_lat, s_lon)
+        cols = _match(self.stations, self.station_lat, self.station_lon, t_ids, t_lat, t_lon)
+
+        nm = np.empty((len(s_ids), len(t_ids)))
+        keep_r, keep_c = np.flatnonzero(rows >= 0), np.flatnonzero(cols >= 0)
+        new_r, new_c = np.flatnonzero(rows < 0), np.flatnonzero(cols < 0)
+
+        # reuse old cells, compute new rows (all stations) & new columns (old sites)
+        nm[np.ix_(keep_r, keep_c)] = self.nm[np.ix_(rows[keep_r], cols[keep_c])]
+        nm[new_r, :] = haversine_nm(s_lat[new_r, None], s_lon[new_r, None], t_lat, t_lon)
+        nm[np.ix_(keep_r, new_c)] = haversine_nm(s_lat[keep_r, None], s_lon[keep_r, None],
+                                                 t_lat[new_c], t_lon[new_c])
+        self.recomputed = len(new_r) * len(t_ids) + len(keep_r) * len(new_c)
+
+        self.sites, self.site_lat, self.site_lon = s_ids, s_lat, s_lon
+        self.stations, self.station_lat, self.station_lon = t_ids, t_lat, t_lon
+        self.nm = nm
+        return self
+
+    def frame(self):
+        """Matrix as a DataFrame (index Name, columns station_id)."""
+        return pd.DataFrame(self.nm, index=self.sites.rename('Name'),
+                            columns=self.stations.rename('station_id'))
+
+    def within(self, radius_nm):
+        """(site, station) pairs w/in radius_nm -> Name, station_id, distance_nm."""
+        r, c = np.nonzero(self.nm <= radius_nm)
+        return pd.DataFrame({'Name': self.sites[r], 'station_id': self.stations[c],
+                             'distance_nm': self.nm[r, c]})
+
+    def nearest(self, k):
+        """k nearest stations per site -> Name, rank (1 = nearest), station_id, distance_nm."""
+        k = min(k, len(self.stations))
+        part = np.argpartition(self.nm, k - 1, axis=1)[:, :k] if k else np.empty((len(self.sites), 0), int)
+        dist = np.take_along_axis(self.nm, part, axis=1)
+        order = np.argsort(dist, axis=1)
+        part = np.take_along_axis(part, order, axis=1)
+        dist = np.take_along_axis(dist, order, axis=1)
+        return pd.DataFrame({'Name': np.repeat(self.sites, k),
+                             'rank': np.tile(np.arange(1, k + 1), len(self.sites)),
+                             'station_id': self.stations[part.ravel()],
+                             'distance_nm': dist.ravel()})
+
+    def save(self, path=CACHE):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez(path, nm=self.nm,
+                 sites=self.sites.to_numpy(str), site_lat=self.site_lat, site_lon=self.site_lon,
+                 stations=self.stations.to_numpy(str),
+                 station_lat=self.station_lat, station_lon=self.station_lon)
+
+    @classmethod
+    def load(cls, path=CACHE):
+        """Cached matrix from save(), or an empty one if there is none."""
+        dm = cls()
+        if os.path.exists(path):
+            with np.load(path) as f:
+                dm.nm = f['nm']
+                dm.sites = pd.Index(f['sites'].astype(object))
+                dm.site_lat, dm.site_lon = f['site_lat'], f['site_lon']
+                dm.stations = pd.Index(f['stations'].astype(object))
+                dm.station_lat, dm.station_lon = f['station_lat'], f['station_lon']
+        return dm
+
+
+def circles(lat, lon, radius_nm, n=72):
+    """Geodesic range rings -> list of shapely Polygons (lon/lat, EPSG:4326)."""
+    lat1 = np.radians(np.asarray(lat, dtype=np.float64))[:, None]
+    lon1 = np.radians(np.asarray(lon, dtype=np.float64))[:, None]
+    d = np.asarray(radius_nm, dtype=np.float64).reshape(-1, 1) / EARTH_RADIUS_NM
+    bearing = np.linspace(0, 2 * np.pi, n, endpoint=False)[None, :]
+    lat2 = np.arcsin(np.sin(lat1) * np.cos(d) + np.cos(lat1) * np.sin(d) * np.cos(bearing))
+    lon2 = lon1 + np.arctan2(np.sin(bearing) * np.sin(d) * np.cos(lat1),
+                             np.cos(d) - np.sin(lat1) * np.sin(lat2))
+    return [Polygon(zip(x, y)) for x, y in zip(np.degrees(lon2), np.degrees(lat2))]
@@ -0,0 +1,138 @@
+#
+## Purpose
+#
+    # Site time series on a common time grid
+    # 1. Stations report at different minute offsets - every reading is
+    #    put in its 10 min (or freq) step, same as wx_grid.bin_observations
+    # 2. All metrics of all sites averaged in one pass, one bincount per metric:
+    #    sums & counts per station & step, then added to every site the
+    #    station is near (site x station pairs) - no row by row merge
+    # 3. Result is dense: values[site, time, metric], NaN where no station
+    #    reported - plots & criteria.evaluate() use it w/o further merges
+    # 4. bin_stations() alone keeps the per station sums, so other site x
+    #    station pairs (e.g. scenario.py radii) reuse them w/o rebinning
+
+## Used by '4. site_evaluation.py', watch.py & scenario.py
+
+import numpy as np
+import pandas as pd
+
+
+class SiteSeries:
+    """values (site, time, metric) float32 & readings (site, time, metric) per cell."""
+
+    def __init__(self, sites, times, metrics, values, readings):
+        self.sites, self.times, self.metrics = sites, times, metrics
+        self.values, self.readings = values, readings
+
+    def frame(self, metric):
+        """One metric -> DataFrame (rows time, columns site)."""
+        return pd.DataFrame(self.values[:, :, self.metrics.get_loc(metric)].T,
+                            index=self.times, columns=self.sites)
+
+    def arrays(self):
+        """{metric: (site, time) array} - e.g. for criteria.evaluate()."""
+        return {m: self.values[:, :, j] for j, m in enumerate(self.metrics)}
+
+    def long(self, dropna=True):
+        """Long table, index (timestamp, Name), one column per metric; cells
+        w/o any reading dropped."""
+        n_site, n_time, n_metric = self.values.shape
+        index = pd.MultiIndex.from_product([self.times, self.sites], names=['timestamp', 'Name'])
+        out = pd.DataFrame(self.values.transpose(1, 0, 2).reshape(-1, n_metric),
+                           index=index, columns=self.metrics)
+        if dropna:
+            out = out[self.readings.transpose(1, 0, 2).reshape(-1, n_metric).any(axis=1)]
+        return out
+
+
+class StationBins:
+    """Sums & counts per (station, time step, metric) - binned once, then
+    added up for any set of site x station pairs (to_sites)."""
+
+    def __init__(self, stations, times, metrics, totals, counts):
+        self.stations, self.times, self.metrics = stations, times, metrics
+        self.totals, self.counts = totals, counts   # (metric, station * time)
+
+    def to_sites(self, pairs):
+        """Average per site over its stations -> SiteSeries.
+
+        pairs  (Name, station_id) - stations near each site; stations not
+               binned are ignored, sites w/o any station get no row
+        """
+        pairs = pairs[['Name', 'station_id']].astype(str).drop_duplicates()
+        pair_st = self.stations.get_indexer(pairs['station_id'])
+        pairs = pairs[pair_st >= 0]
+        sites = pd.Index(pd.unique(pairs['Name']), name='Name')
+        n_st, n_site, n_time = len(self.stations), len(sites), len(self.times)
+        totals, counts = self.totals, self.counts
+
+        # Each station & step w/readings -> every site near the station
+        cell = np.flatnonzero(counts.any(axis=0))
+        cell_st, cell_t = np.divmod(cell, n_time) if n_time else (cell, cell)
+        pair_st = self.stations.get_indexer(pairs['station_id'])
+        order = np.argsort(pair_st, kind='stable')
+        pair_site = sites.get_indexer(pairs['Name'])[order]
+        ptr = np.searchsorted(pair_st[order], np.arange(n_st + 1))
+        n = ptr[cell_st + 1] - ptr[cell_st]
+        row = np.repeat(np.arange(len(cell)), n)
+        offset = np.arange(len(row)) - np.repeat(np.cumsum(n) - n, n)
+        site_cell = pair_site[ptr[cell_st][row] + offset] * n_time + cell_t[row]
+
+        out = np.full((n_site, n_time, len(self.metrics)), np.nan, dtype=np.float32)
+        readings = np.zeros((n_site, n_time, len(self.metrics)), dtype=np.int32)
+        for j in range(len(self.metrics)):
+            total = np.bincount(site_cell, weights=totals[j, cell][row], minlength=n_site * n_time)
+            count = np.bincount(site_cell, weights=counts[j, cell][row], minlength=n_site * n_time)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out[:, :, j] = (total / count).reshape(n_site, n_time)
+            readings[:, :, j] = count.reshape(n_site, n_time)
+        return SiteSeries(sites, self.times, self.metrics, out, readings)
+
+
+def bin_stations(obs, stations, metrics, freq='10min', start=None, end=None):
+    """Sums & counts of readings per station & time step -> StationBins.
+
+    obs         station_id, timestamp & the metric columns
+    stations    station ids kept (others ignored)
+    start, end  grid limits (default: 1st & last step w/a reading)
+    """
+    stations = pd.Index(pd.unique(pd.Index(stations).astype(str)))
+    metrics = pd.Index(metrics)
+    ids = obs['station_id']
+    if isinstance(ids.dtype, pd.CategoricalDtype):     # map the categories, not every row
+        st = stations.get_indexer(ids.cat.categories.astype(str))
+        st = np.append(st, -1)[ids.cat.codes.to_numpy()]
+    else:
+        st = stations.get_indexer(ids.astype(str))
+    keep = st >= 0
+    slot = pd.DatetimeIndex(obs['timestamp'][keep]).as_unit('ns').floor(freq)
+    start = slot.min() if start is None else pd.Timestamp(start).as_unit('ns').floor(freq)
+    end = slot.max() if end is None else pd.Timestamp(end).as_unit('ns').floor(freq)
+    times = pd.date_range(start, end, freq=freq, name='timestamp') if len(slot) else \
+        pd.DatetimeIndex([], name='timestamp')
+    t = (slot.asi8 - (start.value if len(slot) else 0)) // pd.Timedelta(freq).value
+    inside = (t >= 0) & (t < len(times))
+    n_st, n_time = len(stations), len(times)
+    station_cell = st[keep][inside] * n_time + t[inside]
+    values = obs.loc[keep, list(metrics)].to_numpy(np.float64)[inside]
+
+    # One bincount per metric
+    totals = np.zeros((len(metrics), n_st * n_time))
+    counts = np.zeros((len(metrics), n_st * n_time), dtype=np.int64)
+    for j in range(len(metrics)):
+        have = np.isfinite(values[:, j])
+        totals[j] = np.bincount(station_cell[have], weights=values[have, j], minlength=n_st * n_time)
+        counts[j] = np.bincount(station_cell[have], minlength=n_st * n_time)
+    return StationBins(stations, times, metrics, totals, counts)
+
+
+def resample(obs, pairs, metrics, freq='10min', start=None, end=None):
+    """Average readings per site & time step.
+
+    obs      station_id, timestamp & the metric columns
+    pairs    (Name, station_id) - stations near each site (e.g. 'nearby')
+    start, end  grid limits (default: 1st & last step w/a reading)
+    """
+    bins = bin_stations(obs, pairs['station_id'], metrics, freq, start, end)
+    return bins.to_sites(pairs)
@@ -0,0 +1,258 @@
+#
+## Purpose
+#
+    # Running 72 hr picture per site, updated as observations arrive
+    # (no reload, merge & groupby of the whole 72 hrs on every run)
+    # 1. Ring buffer per station: one slot per 10 min step, 72 hrs deep;
+    #    a slot is reused when its step falls out of the window (evicted)
+    # 2. Running aggregates per site over its nearby stations:
+        # sum & count      -> mean
+        # monotonic deque  -> max (amortized O(1) per step)
+        # fixed histogram  -> percentiles (to the bin width, see BINS)
+    # 3. update() adds new observations & evicts expired steps - the cost
+    #    is per new observation, not per observation in the window
+    # 4. snapshot() -> current per-site table; save()/load() keep the state
+    #    between runs (cache/site_window.pkl)
+
+## Used by '4. site_evaluation.py'
+
+import collections
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+CACHE = 'cache/site_window.pkl'
+STEP = pd.Timedelta('10min')
+WINDOW = pd.Timedelta('72h')
+
+# Histogram bins per variable: (lowest, highest, bin width), units as in wx_data
+BINS = {'wind_spd': (0.0, 120.0, 0.25),          # ft/sec
+        'wind_gust': (0.0, 150.0, 0.25),         # ft/sec
+        'wind_wave_height': (0.0, 20.0, 0.05),   # m
+        'swell_height': (0.0, 20.0, 0.05)}       # m
+
+VARIABLES = ['wind_spd', 'wind_wave_height']
+
+
+class SiteWindow:
+    """Rolling window of station observations & per-site aggregates.
+
+    pairs      (Name, station_id) frame - stations near each site (e.g. 'nearby')
+    variables  columns aggregated (each needs a BINS entry)
+    """
+
+    def __init__(self, pairs, variables=VARIABLES, step=STEP, window=WINDOW):
+        self.variables = list(variables)
+        self.step_ns, self.depth = step.value, int(window / step)
+        pairs = pairs[['Name', 'station_id']].astype(str).drop_duplicates()
+        self.pairs = pairs.sort_values(['station_id', 'Name']).reset_index(drop=True)
+        self.sites = pd.Index(pd.unique(self.pairs['Name']))
+        self.stations = pd.Index(pd.unique(self.pairs['station_id']))
+
+        # station -> sites (CSR, pairs are sorted by station) & site -> stations
+        pair_st = self.stations.get_indexer(self.pairs['station_id'])
+        self._pair_site = self.sites.get_indexer(self.pairs['Name'])
+        self._ptr = np.searchsorted(pair_st, np.arange(len(self.stations) + 1))
+        self._site_stations = [pair_st[self._pair_site == s] for s in range(len(self.sites))]
+
+        lo, hi, width = np.array([BINS[v] for v in self.variables]).T
+        self._lo, self._width = lo, width
+        self._nbins = np.ceil((hi - lo) / width).astype(int)
+        self._reset()
+
+    def _reset(self):
+        n_st, n_site, n_var = len(self.stations), len(self.sites), len(self.variables)
+        self.ring_tick = np.full((n_st, self.depth), -1, dtype=np.int64)
+        self.ring = np.full((n_st, self.depth, n_var), np.nan, dtype=np.float32)
+        self.tick = -1      # latest step held (steps of 10 min since 1970)
+        self.sums = np.zeros((n_site, n_var))
+        self.counts = np.zeros((n_site, n_var), dtype=np.int64)
+        self.hist = np.zeros((n_site, n_var, self._nbins.max()), dtype=np.int64)
+        self._max = [[collections.deque() for _ in self.variables] for _ in self.sites]
+        self._dirty = set()     # sites whose max deques need a rebuild
+
+    def _expand(self, st):
+        # observation rows -> (row, site) for every site near the station
+        n = self._ptr[st + 1] - self._ptr[st]
+        row = np.repeat(np.arange(len(st)), n)
+        offset = np.arange(len(row)) - np.repeat(np.cumsum(n) - n, n)
+        return row, self._pair_site[self._ptr[st][row] + offset]
+
+    def _apply(self, st, values, sign):
+        # add (sign=1) or remove (sign=-1) observations from the site aggregates
+        row, site = self._expand(st)
+        n_site, nb = len(self.sites), self.hist.shape[2]
+        for j in range(len(self.variables)):
+            v = values[row, j].astype(np.float64)
+            ok = np.isfinite(v)
+            s, v = site[ok], v[ok]
+            b = ((v - self._lo[j]) // self._width[j]).astype(np.int64).clip(0, self._nbins[j] - 1)
+            self.sums[:, j] += sign * np.bincount(s, weights=v, minlength=n_site)
+            self.counts[:, j] += sign * np.bincount(s, minlength=n_site)
+            self.hist[:, j, :] += sign * np.bincount(s * nb + b, minlength=n_site * nb).reshape(n_site, nb)
+        return row, site
+
+    def _advance(self, tick):
+        # move the window end to tick, evicting steps that fall out of it
+        first = self.tick - self.depth + 1      # oldest step held
+        last = tick - self.depth                # newest step to evict
+        if self.tick < 0 or last >= self.tick:
+            self._reset()       # empty, or a gap longer than the window - nothing is kept
+        else:
+            for old in range(first, last + 1):
+                slot = old % self.depth
+                st = np.flatnonzero(self.ring_tick[:, slot] == old)
+                if len(st):
+                    self._apply(st, self.ring[st, slot], -1)
+                    self.ring_tick[st, slot] = -1
+                    self.ring[st, slot] = np.nan
+        self.tick = tick
+
+    def _push_max(self, t, row, site, values):
+        # one (step, max) per site & variable; smaller earlier values can never be the max again
+        for j in range(len(self.variables)):
+            x = values[row, j]
+            ok = np.isfinite(x)
+            best = np.full(len(self.sites), -np.inf)
+            np.maximum.at(best, site[ok], x[ok])
+            for k in np.flatnonzero(np.isfinite(best)):
+                d = self._max[k][j]
+                while d and d[-1][1] <= best[k]:
+                    d.pop()
+                d.append((t, float(best[k])))
+
+    def update(self, obs):
+        """Add observations (station_id, timestamp & the variables) -> rows applied.
+
+        Rows for other stations, for steps already out of the window, or
+        unchanged since they were added, are ignored. Timestamps are
+        floored to the 10 min step; the last row per station & step wins.
+        """
+        st = self.stations.get_indexer(obs['station_id'].astype(str))
+        tick = (pd.to_datetime(obs['timestamp']).to_numpy('datetime64[ns]').astype(np.int64)
+                // self.step_ns)
+        values = obs[self.variables].to_numpy(np.float32)
+        newest = max(self.tick, int(tick.max(initial=-1)))
+        keep = (st >= 0) & (tick > newest - self.depth)
+        st, tick, values = st[keep], tick[keep], values[keep]
+        if not len(st):
+            return 0
+
+        # step by step in time order, last row per station & step
+        order = np.lexsort((-np.arange(len(st)), st, tick))
+        st, tick, values = st[order], tick[order], values[order]
+        first = np.ones(len(st), dtype=bool)
+        first[1:] = (st[1:] != st[:-1]) | (tick[1:] != tick[:-1])
+        st, tick, values = st[first], tick[first], values[first]
+
+        applied = 0
+        bounds = np.flatnonzero(np.diff(tick)) + 1
+        for s, t, v in zip(np.split(st, bounds), np.split(tick, bounds), np.split(values, bounds)):
+            t = int(t[0])
+            if t > self.tick:
+                self._advance(t)
+            slot = t % self.depth
+
+            # already held: skip if unchanged, else take the old values out
+            held = self.ring_tick[s, slot] == t
+            if held.any():
+                old = self.ring[s, slot]
+                same = ((old == v) | (np.isnan(old) & np.isnan(v))).all(axis=1)
+                changed = held & ~same
+                _, sites = self._apply(s[changed], old[changed], -1)
+                self._dirty.update(sites.tolist())      # a max may have been taken out
+                s, v = s[~held | changed], v[~held | changed]
+            if not len(s):
+                continue
+
+            self.ring_tick[s, slot] = t
+            self.ring[s, slot] = v
+            row, site = self._apply(s, v, 1)
+            applied += len(s)
+            if t < self.tick:
+                self._dirty.update(site.tolist())       # late data, max rebuilt on read
+            else:
+                self._push_max(t, row, site, v)
+        return applied
+
+    def _rebuild(self, k):
+        # max deques of site k from the station rings (after late/changed data)
+        st = self._site_stations[k]
+        ticks, values = self.ring_tick[st].ravel(), self.ring[st].reshape(-1, len(self.variables))
+        held = ticks >= 0
+        ticks, values = ticks[held], values[held]
+        for j in range(len(self.variables)):
+            d = self._max[k][j] = collections.deque()
+            ok = np.isfinite(values[:, j])
+            if not ok.any():
+                continue
+            frame = pd.Series(values[ok, j], index=ticks[ok]).groupby(level=0).max()
+            for t, x in zip(frame.index.tolist(), frame.tolist()):
+                while d and d[-1][1] <= x:
+                    d.pop()
+                d.append((t, x))
+
+    def maxima(self):
+        """Max per site (rows) & variable (columns) over the window."""
+        for k in self._dirty:
+            self._rebuild(k)
+        self._dirty = set()
+        out = np.full((len(self.sites), len(self.variables)), np.nan)
+        oldest = self.tick - self.depth + 1
+        for k, deques in enumerate(self._max):
+            for j, d in enumerate(deques):
+                while d and d[0][0] < oldest:
+                    d.popleft()
+                if d:
+                    out[k, j] = d[0][1]
+        return pd.DataFrame(out, index=self.sites, columns=self.variables)
+
+    def percentiles(self, q):
+        """q-th percentile (0-100) per site & variable, from the histograms
+        (linear within a bin, so to about the bin width)."""
+        target = self.counts[:, :, None] * (q / 100.0)
+        cum = np.cumsum(self.hist, axis=2)
+        b = (cum < target).sum(axis=2).clip(max=self.hist.shape[2] - 1)    # bin holding the target
+        before = np.take_along_axis(cum, b[:, :, None], axis=2)[:, :, 0] - \
+            np.take_along_axis(self.hist, b[:, :, None], axis=2)[:, :, 0]
+        inside = np.take_along_axis(self.hist, b[:, :, None], axis=2)[:, :, 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frac = np.where(inside > 0, (target[:, :, 0] - before) / inside, 0.0)
+        out = self._lo + (b + frac) * self._width
+        out[self.counts == 0] = np.nan
+        return pd.DataFrame(out, index=self.sites, columns=self.variables)
+
+    def snapshot(self, q=(50, 90)):
+        """Current picture per site: records, mean, max & percentiles of each variable."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = pd.DataFrame(self.sums / self.counts, index=self.sites, columns=self.variables)
+        parts = {'records': pd.DataFrame(self.counts, index=self.sites, columns=self.variables),
+                 'mean': mean, 'max': self.maxima()}
+        parts.update({'p%g' % p: self.percentiles(p) for p in q})
+        out = pd.concat(parts, axis=1).swaplevel(axis=1)
+        out = out[[(v, stat) for v in self.variables for stat in parts]]
+        out.index.name = 'Name'
+        return out
+
+    @property
+    def latest(self):
+        """End of the window (last step held), NaT if empty."""
+        return pd.NaT if self.tick < 0 else pd.Timestamp(self.tick * self.step_ns)
+
+    def save(self, path=CACHE):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, pairs, variables=VARIABLES, path=CACHE):
+        """Saved window if it covers the same site/station pairs & variables, else a new one."""
+        fresh = cls(pairs, variables)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                saved = pickle.load(f)
+            if saved.variables == fresh.variables and saved.pairs.equals(fresh.pairs):
+                return saved
+        return fresh
@@ -0,0 +1,94 @@
+#
+## Purpose
+#
+    # Spatial index over station lat/long for "stations w/in R nm of a site"
+    # 1. Stations placed on a unit sphere (x, y, z) & put in a KD-tree
+    # 2. R nautical miles -> straight-line (chord) distance on the sphere,
+    #    so one ball query = one great-circle radius query
+    # 3. Build once, then query any number of sites & radii
+
+## Used by '3. landing_site_data.py', watch.py & status_service.py
+
+# Note: scipy is an automatic Anaconda module
+    # If missing, `conda install scipy`
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_NM = 3440.065
+
+
+def to_xyz(lat, lon):
+    """lat/long (degrees) -> unit sphere x, y, z (n x 3)."""
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    return np.column_stack([np.cos(lat) * np.cos(lon),
+                            np.cos(lat) * np.sin(lon),
+                            np.sin(lat)])
+
+
+def chord(radius_nm):
+    """Great-circle distance (nm) -> chord length on the unit sphere."""
+    return 2 * np.sin(np.minimum(np.asarray(radius_nm) / EARTH_RADIUS_NM, np.pi) / 2)
+
+
+def haversine_nm(lat1, lon1, lat2, lon2):
+    """Great-circle distance in nautical miles (broadcasts)."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64))
+                              for v in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_NM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class StationIndex:
+    """KD-tree of station positions for great-circle radius queries."""
+
+    def __init__(self, station_ids, lat, lon):
+        self.station_ids = np.asarray(station_ids).astype(str)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        ok = np.isfinite(self.lat) & np.isfinite(self.lon)
+        self._rows = np.flatnonzero(ok)          # tree position -> station row
+        self.tree = cKDTree(to_xyz(self.lat[ok], self.lon[ok]))
+
+    @classmethod
+    def from_frame(cls, stations):
+        """From a table w/station_id, latitude & longitude columns."""
+        return cls(stations['station_id'], stations['latitude'], stations['longitude'])
+
+    def within(self, lat, lon, radius_nm):
+        """Station rows w/in radius_nm of each point -> list of int arrays."""
+        points = to_xyz(np.atleast_1d(lat), np.atleast_1d(lon))
+        hits = self.tree.query_ball_point(points, r=chord(radius_nm))
+        return [self._rows[np.sort(np.asarray(h, dtype=np.int64))] for h in hits]
+
+    def nearest(self, lat, lon, k=1):
+        """k nearest stations to each point -> (station rows, distance_nm), both
+        points x k, nearest 1st (k capped at the stations w/a position)."""
+        lat, lon = np.atleast_1d(lat).astype(np.float64), np.atleast_1d(lon).astype(np.float64)
+        k = min(k, len(self._rows))
+        if k < 1:
+            return np.empty((len(lat), 0), dtype=np.int64), np.empty((len(lat), 0))
+        _, hits = self.tree.query(to_xyz(lat, lon), k=list(range(1, k + 1)))   # k as a list -> always 2D
+        rows = self._rows[hits]
+        return rows, haversine_nm(lat[:, None], lon[:, None], self.lat[rows], self.lon[rows])
+
+    def within_sites(self, sites, radius_nm):
+        """All (site, station) pairs w/in radius_nm.
+
+        sites  table w/Name, latitude, longitude (Name may be the index)
+        Returns DataFrame: Name, station_id, distance_nm
+        """
+        sites = sites.reset_index() if 'Name' not in sites.columns else sites
+        hits = self.within(sites['latitude'], sites['longitude'], radius_nm)
+        site_rows = np.repeat(np.arange(len(sites)), [len(h) for h in hits])
+        rows = np.concatenate(hits) if hits else np.array([], dtype=np.int64)
+        return pd.DataFrame({
+            'Name': sites['Name'].to_numpy()[site_rows],
+            'station_id': self.station_ids[rows],
+            'distance_nm': haversine_nm(sites['latitude'].to_numpy()[site_rows],
+                                        sites['longitude'].to_numpy()[site_rows],
+                                        self.lat[rows], self.lon[rows]),
+        })
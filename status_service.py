@@ -0,0 +1,340 @@
+#
+## Purpose
+#
+    # Local HTTP/JSON service for command-center tools
+    #   "current status of site X", "nearest CG units & conditions at point P"
+    # 1. Answers come from a Snapshot built ahead of time, in memory:
+    #    site answers are JSON bytes already; point queries use a KD-tree
+    #    (stations), the spatial index of the CG areas & status already
+    #    rated at every grid node -> ~1 ms per site, ~3 ms per point
+    #    (requests served by a fixed thread pool)
+    # 2. New results (a pipeline run, or a watch.py cycle) are turned into a
+    #    NEW snapshot in a background thread & swapped in w/one assignment;
+    #    a request keeps the snapshot it started with - reads never wait
+    #    on ingestion & never see half an update
+    # 3. Endpoints (GET, JSON):
+        # /health                      snapshot source, time & age
+        # /sites                       every site: status, failing rule, 72 hr picture
+        # /sites/<Name>                one site + nearby stations & CG units in 1 hr reach
+        # /point?lat=..&lon=..&n=3     n nearest CG units & stations, conditions & status
+
+## Run from the data folder (as for the scripts):
+    # python status_service.py            # results of the last pipeline.py run, reloaded when they change
+    # python status_service.py --watch    # live: watch.py cycles feed the service
+    # python status_service.py --port 8765
+    # curl 'http://127.0.0.1:8765/sites/Tampa,%20FL'
+
+import argparse
+import json
+import math
+import os
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+import cg_coverage
+import criteria
+import pipeline
+import station_index
+
+PORT = 8765
+WORKERS = 8         # request threads, reused (1st use of a thread costs ~3 ms in shapely)
+READINGS = ['wind_spd', 'wind_gust', 'wind_wave_height', 'swell_height', 'ave_period']
+
+
+def _clean(value):
+    # numpy / pandas scalars -> JSON values (NaN & NaT -> null)
+    if isinstance(value, dict):
+        return {str(k): _clean(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_clean(v) for v in value]
+    if value is pd.NaT:
+        return None
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return None if pd.isna(value) else pd.Timestamp(value).isoformat()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def _records(frame):
+    return _clean(frame.to_dict('records'))
+
+
+def _dumps(obj):
+    return json.dumps(_clean(obj), separators=(',', ':')).encode()
+
+
+class Snapshot:
+    """Read-only answers for one set of results.
+
+    sites     Name (index), latitude, longitude
+    latest    criteria.Evaluation.latest() - Name, timestamp, status, rule, value, limit, reason
+    picture   site_window snapshot (columns variable x stat), or None
+    nearby    Name, station_id, distance_nm
+    stations  station_id, latitude, longitude & latest readings (timestamp, READINGS)
+    coverage  cg_coverage.Coverage
+    field     wx_grid.Field for conditions at a point (latest step used), or None
+    """
+
+    def __init__(self, sites, latest, picture, nearby, stations, coverage, field=None,
+                 rules=None, source='', created=None):
+        self.created = time.time() if created is None else created
+        self.source, self.coverage, self.field = source, coverage, field
+        self.rules = criteria.load() if rules is None else rules
+        self.stations = stations.reset_index(drop=True)
+        self.index = station_index.StationIndex.from_frame(self.stations)
+        self._station_rows = _records(self.stations)
+        units = coverage.units
+        self._unit_lat = units['Latitude'].to_numpy(np.float64)
+        self._unit_lon = units['Longitude'].to_numpy(np.float64)
+        self._unit_speed = units['Transit_Spd'].to_numpy(np.float64)
+        self._unit_name = units['Unit'].to_numpy()
+        self._cells = self._grid_status()
+
+        # Per site answers, serialized once
+        sites = sites.reset_index() if 'Name' not in sites.columns else sites
+        latest = latest.set_index('Name') if len(latest) else pd.DataFrame()   # none yet (watch start)
+        reach = coverage.reach_sites(sites)
+        readings = self.stations.set_index('station_id')
+        self.sites = {}
+        for name, lat, lon in zip(sites['Name'], sites['latitude'], sites['longitude']):
+            site = {'Name': name, 'latitude': lat, 'longitude': lon}
+            if name in latest.index:
+                site.update(latest.loc[name, ['timestamp', 'status', 'rule', 'value',
+                                              'limit', 'reason']].to_dict())
+            if picture is not None and name in picture.index:
+                row = picture.loc[name]
+                site['picture'] = {var: row[var].to_dict() for var in row.index.get_level_values(0).unique()}
+            self.sites[name] = site
+        self._all = _dumps({'source': source, 'created': pd.Timestamp(self.created, unit='s'),
+                            'sites': list(self.sites.values())})
+
+        self._site = {}
+        for name, site in self.sites.items():
+            near = nearby[nearby['Name'] == name][['station_id', 'distance_nm']]
+            near = near.merge(readings, left_on='station_id', right_index=True, how='left')
+            units = reach[reach['Name'] == name].drop(columns='Name')
+            self._site[name] = _dumps(dict(site, stations=_records(near.sort_values('distance_nm')),
+                                           units=_records(units.sort_values('transit_min'))))
+
+    def all_sites(self):
+        return self._all
+
+    def site(self, name):
+        return self._site.get(name)
+
+    def _grid_status(self):
+        # conditions & status at every grid node, latest step - a point query picks one
+        f = self.field
+        if f is None:
+            return None
+        values = {var: g[-1].ravel() for var, g in f.data.items()}
+        metrics = {name: values.get(name, np.full(len(f.lat) * len(f.lon), np.nan))[:, None]
+                   for name in criteria.inputs(self.rules)}
+        status = criteria.evaluate(metrics, self.rules, np.arange(len(f.lat) * len(f.lon)),
+                                   f.times[-1:]).latest().drop(columns='Name')
+        conditions = pd.DataFrame(values)
+        return [{'timestamp': f.times[-1], 'conditions': c, 'status': st}
+                for c, st in zip(_records(conditions), _records(status))]
+
+    def point(self, lat, lon, n=3):
+        """n nearest CG units (w/1 hr reach flag) & stations, conditions & status
+        at the nearest grid node."""
+        nm = station_index.haversine_nm(lat, lon, self._unit_lat, self._unit_lon)
+        reaches = set(self.coverage.reach(lat, lon)['Unit'])
+        units = [{'Unit': self._unit_name[i], 'distance_nm': nm[i],
+                  'transit_min': nm[i] / self._unit_speed[i] * 60,
+                  'in_reach': self._unit_name[i] in reaches} for i in np.argsort(nm)[:n]]
+
+        rows, dist = self.index.nearest(lat, lon, n)
+        stations = [dict(self._station_rows[r], distance_nm=float(d)) for r, d in zip(rows[0], dist[0])]
+
+        out = {'latitude': lat, 'longitude': lon, 'units': units, 'stations': stations}
+        f = self.field
+        if self._cells is not None and f.lat[0] <= lat <= f.lat[-1] and f.lon[0] <= lon <= f.lon[-1]:
+            y = int(np.abs(f.lat - lat).argmin())
+            x = int(np.abs(f.lon - lon).argmin())
+            out.update(self._cells[y * len(f.lon) + x], grid_node=[f.lat[y], f.lon[x]])
+        return _dumps(out)
+
+
+def from_pipeline(values, coverage, source='pipeline'):
+    """Snapshot from pipeline.py outputs (see pipeline.load_outputs)."""
+    wx = values['wx_data']
+    readings = [c for c in READINGS if c in wx.columns]
+    last = (pd.DataFrame(wx[['station_id', 'timestamp'] + readings])
+            .sort_values('timestamp').drop_duplicates('station_id', keep='last'))
+    last['station_id'] = last['station_id'].astype(str)
+    buoys = pd.DataFrame(values['buoys_all'][['station_id', 'latitude', 'longitude']])
+    buoys['station_id'] = buoys['station_id'].astype(str)
+    stations = buoys.merge(last, on='station_id', how='left')
+    sites = pd.DataFrame(values['sites'].drop(columns='geometry', errors='ignore'))
+    nearby = pd.DataFrame(values['nearby'][['Name', 'station_id', 'distance_nm']])
+    return Snapshot(sites, values['site_latest'], values.get('site_picture'), nearby,
+                    stations, coverage, field=values.get('field'), source=source)
+
+
+def from_watcher(watcher, coverage, source='watch'):
+    """Snapshot from the in-memory state of a watch.Watcher."""
+    stations = watcher.buoys
+    if watcher.obs is not None:
+        obs = watcher.obs
+        readings = [c for c in READINGS if c in obs.columns]
+        last = (pd.DataFrame(obs[['station_id', 'timestamp'] + readings])
+                .sort_values('timestamp').drop_duplicates('station_id', keep='last'))
+        last['station_id'] = last['station_id'].astype(str)
+        stations = stations.merge(last, on='station_id', how='left')
+    return Snapshot(watcher.sites, watcher.summary(), watcher.window.snapshot(), watcher.nearby,
+                    stations, coverage, rules=watcher.rules, source=source)
+
+
+class Service:
+    """Holds the current snapshot; publish() swaps in a new one."""
+
+    def __init__(self):
+        self.snapshot = None
+
+    def publish(self, snapshot):
+        self.snapshot = snapshot     # one reference assignment - atomic for readers
+
+    def answer(self, path):
+        """Request path -> (HTTP status, JSON bytes); an error in one request -> 500."""
+        try:
+            return self._answer(path)
+        except Exception as e:      # the server & other requests keep going
+            print(' Request failed:', path, repr(e))
+            return 500, _dumps({'error': 'internal error', 'detail': repr(e)})
+
+    def _answer(self, path):
+        snap = self.snapshot         # this request's view, even if a new one is published meanwhile
+        url = urllib.parse.urlsplit(path)
+        parts = [urllib.parse.unquote(p) for p in url.path.strip('/').split('/') if p]
+        if parts == ['health']:
+            if snap is None:
+                return 503, _dumps({'status': 'loading'})
+            return 200, _dumps({'status': 'ok', 'source': snap.source,
+                                'created': pd.Timestamp(snap.created, unit='s'),
+                                'age_sec': round(time.time() - snap.created, 1)})
+        if snap is None:
+            return 503, _dumps({'error': 'no results loaded yet'})
+        if parts == ['sites']:
+            return 200, snap.all_sites()
+        if len(parts) == 2 and parts[0] == 'sites':
+            body = snap.site(parts[1])
+            if body is None:
+                return 404, _dumps({'error': 'unknown site', 'sites': list(snap.sites)})
+            return 200, body
+        if parts == ['point']:
+            query = urllib.parse.parse_qs(url.query)
+            try:
+                lat, lon = float(query['lat'][0]), float(query['lon'][0])
+                n = int(query.get('n', ['3'])[0])
+            except (KeyError, ValueError):
+                return 400, _dumps({'error': 'use /point?lat=<deg>&lon=<deg>[&n=3]'})
+            if not (-90 <= lat <= 90 and -180 <= lon <= 180 and n > 0):
+                return 400, _dumps({'error': 'lat/lon out of range or n < 1'})
+            return 200, snap.point(lat, lon, n)
+        return 404, _dumps({'error': 'not found',
+                            'endpoints': ['/health', '/sites', '/sites/<Name>', '/point?lat=&lon=&n=']})
+
+    def server(self, host='127.0.0.1', port=PORT):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = service.answer(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', 'no-store')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass    # no line per request
+
+        return _PooledServer((host, port), Handler)
+
+
+class _PooledServer(ThreadingHTTPServer):
+    # ThreadingHTTPServer w/a fixed pool instead of a new thread per request
+    def __init__(self, address, handler, workers=WORKERS):
+        super().__init__(address, handler)
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='status')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
+
+
+def _follow_pipeline(service, coverage, every=30):
+    # Reload when a stage cache changes (pipeline.py run elsewhere)
+    seen = None
+    while True:
+        paths = sorted(os.path.join(pipeline.CACHE_DIR, s.name + '.pkl') for s in pipeline.STAGES)
+        stamp = [os.stat(p).st_mtime_ns for p in paths if os.path.exists(p)]
+        if stamp != seen:
+            try:
+                values = pipeline.load_outputs()
+                if 'site_latest' in values:
+                    service.publish(from_pipeline(values, coverage))
+                    print(' Loaded pipeline results', time.strftime('%H:%M:%S'))
+            except Exception as e:      # keep answering from the last good snapshot
+                print(' Reload failed, keeping the last results:', repr(e))
+            seen = stamp
+        time.sleep(every)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Site status & CG units as JSON over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--watch', action='store_true',
+                        help='live results from watch.py cycles (watch.py options allowed)')
+    parser.add_argument('--refresh', type=float, default=30, help='seconds between pipeline cache checks')
+    parser.add_argument('--units', default='CG_units.csv')
+    parser.add_argument('--land', default='cb_2018_us_state_500k.zip')
+
+    service = Service()
+    if parser.parse_known_args(argv)[0].watch:
+        import watch
+        watcher, args = watch.from_args(argv, parser)
+        coverage = cg_coverage.Coverage.load(args.units, args.land, minutes=60)
+
+        def target():
+            watcher.start()
+            service.publish(from_watcher(watcher, coverage))
+            watch.run(watcher, cycles=args.cycles,
+                      on_cycle=lambda w, report: service.publish(from_watcher(w, coverage)))
+    else:
+        args = parser.parse_args(argv)
+        coverage = cg_coverage.Coverage.load(args.units, args.land, minutes=60)
+
+        def target():
+            _follow_pipeline(service, coverage, args.refresh)
+    threading.Thread(target=target, daemon=True).start()
+
+    httpd = service.server(args.host, args.port)
+    print(' Serving on http://%s:%d  (/health, /sites, /sites/<Name>, /point?lat=&lon=)'
+          % (args.host, args.port))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
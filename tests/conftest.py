@@ -0,0 +1,17 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+# The modules live at the top of the repository (no package)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Empty data folder w/NOAA_columns.csv, as the current folder (as for the scripts)."""
+    shutil.copy(os.path.join(ROOT, 'NOAA_columns.csv'), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
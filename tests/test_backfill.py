@@ -0,0 +1,144 @@
+import glob
+import gzip
+import os
+
+import numpy as np
+import pandas as pd
+
+import backfill
+import ndbc_parse
+import obs_store
+
+# 2007 on: '#YY' header + units row (same as realtime2)
+CURRENT = """\
+#YY  MM DD hh mm WDIR WSPD GST  WVHT   DPD   APD MWD   PRES  ATMP  WTMP  DEWP  VIS  TIDE
+#yr  mo dy hr mn degT m/s  m/s     m   sec   sec degT   hPa  degC  degC  degC  mi    ft
+2019 01 01 00 00 120  5.0  6.0  1.20  8.00  5.50 110 1015.0  20.0  22.0  15.0 99.0 99.00
+2019 01 01 00 10 999 99.0 99.0 99.00 99.00 99.00 999 9999.0 999.0 999.0 999.0 99.0 99.00
+2019 01 01 00 20 130  6.0  7.5  1.30  8.00  5.60 115 1014.8  20.1  22.0  15.1 99.0 99.00
+2019 01 01 00 30 140  7.0  8.0  1.40  9.00  5.70 120 1014.5  20.2  22.1  15.2 99.0 99.00
+2019 01 01 00 40 150  8.0  9.0  1.50  9.00  5.80 125 1014.2  20.3  22.1  15.3 99.0 99.00
+"""
+
+# 2000-2004: 4-digit year, no units row, old WD/BAR names
+NO_UNITS = """\
+YYYY MM DD hh mm  WD WSPD GST  WVHT  DPD   APD MWD  BAR    ATMP  WTMP  DEWP  VIS  TIDE
+2003 06 01 12 00 200  4.1  5.2  0.80  7.00  5.00 190 1012.1  26.0  27.0  21.0 99.0 99.00
+2003 06 01 13 00 210 99.0 99.0  0.90  7.00  5.10 999 9999.0  26.1  27.0  21.1 99.0 99.00
+"""
+
+# before 1999: 2-digit year, no minute column
+TWO_DIGIT = """\
+YY MM DD hh  WD WSPD GST  WVHT  DPD   APD MWD  BAR    ATMP  WTMP  DEWP  VIS
+97 03 04 05 300  3.0  4.0  0.50  6.00  4.00 280 1018.0  15.0  16.0  10.0 99.0
+97 03 04 06 310  3.5  4.5  0.60  6.00  4.10 290 1017.5  15.1  16.0  10.1 99.0
+"""
+
+POSITIONS = pd.DataFrame({'station_id': ['41009', '42036'],
+                          'latitude': [28.5, 28.5], 'longitude': [-80.2, -84.5]})
+
+
+def archive(folder, name, text):
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, name)
+    with gzip.open(path, 'wt') as fh:
+        fh.write(text)
+    return path
+
+
+def read(path, chunk_rows=200_000):
+    with gzip.open(path, 'rb') as stream:
+        return pd.concat(ndbc_parse.read_stream(stream, 'X', ndbc_parse.column_names(), chunk_rows),
+                         ignore_index=True)
+
+
+def test_header_variants(workdir):
+    current = read(archive('h', 'xh2019.txt.gz', CURRENT))
+    no_units = read(archive('h', 'xh2003.txt.gz', NO_UNITS))
+    two_digit = read(archive('h', 'xh1997.txt.gz', TWO_DIGIT))
+
+    assert len(current) == 5 and len(no_units) == 2 and len(two_digit) == 2
+    assert current['timestamp'].iloc[2] == pd.Timestamp('2019-01-01 00:20')
+    assert no_units['timestamp'].iloc[1] == pd.Timestamp('2003-06-01 13:00')
+    assert two_digit['timestamp'].iloc[0] == pd.Timestamp('1997-03-04 05:00')   # 19YY, minute 0
+    # WD & BAR are the old names of WDIR & PRES
+    for data in (no_units, two_digit):
+        assert {'wind_dirT', 'pressure'} <= set(data.columns)
+        assert not {'WD', 'BAR'} & set(data.columns)
+    assert no_units['wind_dirT'].iloc[0] == 200
+    assert two_digit['pressure'].iloc[1] == np.float32(1017.5)
+
+
+def test_missing_markers(workdir):
+    current = read(archive('h', 'xh2019.txt.gz', CURRENT))
+    gone = current.iloc[1]
+    for col in ['wind_dirT', 'wind_spd', 'wind_gust', 'wave_height', 'mean_wave_dirT',
+                'pressure', 'air_temp', 'water_temp', 'dewpoint']:
+        assert pd.isna(gone[col]), col
+    assert current['vis'].isna().all() and current['tide_height'].isna().all()
+    assert current['wind_spd'].iloc[0] == 5.0 and current['pressure'].iloc[4] == np.float32(1014.2)
+
+    no_units = read(archive('h', 'xh2003.txt.gz', NO_UNITS))
+    assert no_units[['wind_spd', 'mean_wave_dirT', 'pressure']].iloc[1].isna().all()
+
+
+def test_chunks_match_whole_file(workdir):
+    path = archive('h', 'xh2019.txt.gz', CURRENT)
+    pd.testing.assert_frame_equal(read(path, chunk_rows=2), read(path))
+
+
+def run(folder, **kwargs):
+    return backfill.run(backfill.local_archives(folder), POSITIONS, store='store',
+                        manifest='store/_backfill.json', workers=1, log=lambda *a: None, **kwargs)
+
+
+def test_rerun_skipped(workdir):
+    archive('historical', '41009h2019.txt.gz', CURRENT)
+    archive('historical', '42036h2003.txt.gz', NO_UNITS)
+
+    first = run('historical')
+    assert sorted(first) == ['41009h2019.txt.gz', '42036h2003.txt.gz']
+    assert first['41009h2019.txt.gz']['rows'] == 5
+    files = sorted(glob.glob('store/**/*.parquet', recursive=True))
+
+    assert run('historical') == {}
+    assert sorted(glob.glob('store/**/*.parquet', recursive=True)) == files
+    assert len(obs_store.read('store', dedupe=False)) == 7
+
+
+def test_interrupted_archive_rewritten(workdir):
+    archive('historical', '41009h2019.txt.gz', CURRENT)
+    job, = backfill.local_archives('historical')
+
+    # killed midway: some chunk files written, archive not in the manifest
+    backfill.ingest(job, POSITIONS[:1], store='store', chunk_rows=2)
+    chunks = sorted(glob.glob('store/**/bf-41009h2019-*.parquet', recursive=True))
+    assert len(chunks) == 3
+    os.remove(chunks[-1])
+
+    finished = run('historical', chunk_rows=3)     # other chunk size, other file names
+    assert finished['41009h2019.txt.gz']['rows'] == 5
+    data = obs_store.read('store', dedupe=False)
+    assert len(data) == 5
+    assert not data.duplicated(['station_id', 'timestamp']).any()
+    # same units as script 2 (ft/sec)
+    assert data['wind_spd'].iloc[0] == np.float32(round(5.0 * 1.68781, 2))
+    assert (data['latitude'] == 28.5).all()
+
+
+def test_window_start_skips_backfilled_years(workdir):
+    archive('historical', '41009h2019.txt.gz', CURRENT)
+    archive('historical', '42036h2003.txt.gz', NO_UNITS)
+    run('historical')
+    recent = pd.DataFrame({'station_id': ['41009'] * 3,
+                           'timestamp': pd.to_datetime(['2021-05-15 12:00', '2021-05-17 00:00',
+                                                        '2021-05-18 12:00']),
+                           'wind_spd': np.float32([1, 2, 3])})
+    obs_store.write(recent, 'store')
+
+    start = obs_store.window_start('store')
+    assert start == pd.Timestamp('2021-05-15 12:00')
+    data = obs_store.read('store', start=start)
+    assert list(data['wind_spd']) == [1, 2, 3]      # no 2003 or 2019 rows
+    assert obs_store.window_start('store', stations=['42036']) == pd.Timestamp('2003-06-01 13:00') - pd.Timedelta(hours=72)
+    assert obs_store.window_start('nothing') is None
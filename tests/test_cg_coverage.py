@@ -0,0 +1,50 @@
+import geopandas
+import numpy as np
+import pandas as pd
+import shapely
+
+import cg_coverage
+
+UNITS = pd.DataFrame({'Unit': ['Mayport', 'Canaveral', 'Fort Pierce', 'Key West'],
+                      'Asset': ['RB-M', 'RB-S', 'RB-S', 'WPB'],
+                      'Latitude': [30.39, 28.41, 27.47, 24.56],
+                      'Longitude': [-81.42, -80.60, -80.31, -81.80],
+                      'Transit_Spd': [30.0, 40.0, 40.0, 25.0]})     # knots
+
+# 'Land': a block around Canaveral
+LAND = geopandas.GeoDataFrame(geometry=[shapely.box(-80.9, 28.2, -80.45, 28.7)], crs=4326)
+
+
+def coverage(minutes=60):
+    units = geopandas.GeoDataFrame(UNITS, crs=4326,
+                                   geometry=geopandas.points_from_xy(UNITS.Longitude, UNITS.Latitude))
+    return cg_coverage.Coverage(units, cg_coverage.build(units, LAND, minutes), minutes)
+
+
+def test_covered_matches_reach_areas():
+    cov = coverage()
+    rng = np.random.default_rng(3)
+    lat, lon = rng.uniform(23.5, 31.5, 2000), rng.uniform(-82.5, -79.0, 2000)
+
+    got = cov.covered(lat, lon)
+
+    points = shapely.points(lon, lat)
+    want = sum(shapely.intersects(area, points).astype(int) for area in cov.areas.geometry)
+    assert (got == want).all()
+    assert got.max() >= 2 and (got == 0).any()      # overlap (Canaveral/Fort Pierce) & open water
+    assert len(cov.reach(lat, lon)) == want.sum()
+
+
+def test_land_not_covered():
+    cov = coverage()
+    assert list(cov.covered([28.5], [-80.7])) == [0]    # on land, ~8 nm from Canaveral
+    assert list(cov.covered([28.5], [-80.2])) == [1]    # offshore, ~22 nm
+
+
+def test_range_grows_with_minutes():
+    near, far = coverage(30), coverage(120)
+    lat, lon = [25.0, 24.56, 26.0], [-81.3, -81.80, -79.0]     # ~38 nm from Key West, at it, open sea
+
+    assert list(near.covered(lat, lon)) == [0, 1, 0]
+    assert list(far.covered(lat, lon)) == [1, 1, 0]
+    assert list(near.covered([], [])) == []
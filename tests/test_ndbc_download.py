@@ -0,0 +1,308 @@
+import calendar
+import hashlib
+import http.server
+import threading
+import time
+
+import pytest
+
+import ndbc_download
+
+TXT = b'#YY  MM DD hh mm WSPD\n#yr  mo dy hr mn m/s\n2021 05 18 16 00  5.0\n'
+
+
+class Server(http.server.ThreadingHTTPServer):
+    """Local realtime2 stand-in: files by name, scripted failures, counters."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.files = {}         # name -> body (others -> 404)
+        self.fail = {}          # name -> [status or 'slow', ...] answered 1st, in order
+        self.delay = 0          # seconds per request
+        self.requests = {}      # name -> count
+        self.headers = {}       # name -> headers of the last request
+        self.modified = {}      # name -> Last-Modified (sent w/an ETag of the body)
+        self.ranges = True      # False = ignore Range, always the whole file
+        self.connections = 0
+        self.active = self.max_active = 0
+        self.lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        pass    # clients hanging up on purpose (timeouts)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/data/realtime2/' % self.server_address[1]
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        server = self.server
+        name = self.path.rsplit('/', 1)[1]
+        with server.lock:
+            server.requests[name] = server.requests.get(name, 0) + 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            step = server.fail[name].pop(0) if server.fail.get(name) else None
+        try:
+            time.sleep(server.delay)
+            if step == 'slow':
+                time.sleep(1)       # past the client timeout
+                return
+            with server.lock:
+                server.headers[name] = dict(self.headers)
+            status = step or (200 if name in server.files else 404)
+            body = server.files.get(name, b'') if status == 200 else b'nope'
+            extra = {}
+            if status == 200:
+                extra['ETag'] = '"%s"' % hashlib.md5(body).hexdigest()
+                if name in server.modified:
+                    extra['Last-Modified'] = server.modified[name]
+                span = self.headers.get('Range')
+                if self.headers.get('If-None-Match') == extra['ETag']:
+                    status, body = 304, b''
+                elif span and server.ranges:
+                    end = min(int(span.split('-')[1]), len(body) - 1)
+                    extra['Content-Range'] = 'bytes 0-%d/%d' % (end, len(body))
+                    status, body = 206, body[:end + 1]
+            self.send_response(status)
+            for key, value in extra.items():
+                self.send_header(key, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+HEAD = b'#YY  MM DD hh mm WSPD\n#yr  mo dy hr mn m/s\n'
+NOW = calendar.timegm((2021, 5, 18, 16, 0, 0))
+
+
+def realtime(newest, n):
+    """n rows every 10 min, newest-first, ending 'newest' minutes after NOW."""
+    rows = [time.strftime('%Y %m %d %H %M', time.gmtime(NOW + (newest - 10 * i) * 60))
+            + '  %4.1f\n' % (i % 50) for i in range(n)]
+    return HEAD + ''.join(rows).encode()
+
+
+def delta(server, name, entry, now=NOW):
+    pool = ndbc_download.ConnectionPool(server.url, timeout=2)
+    try:
+        return ndbc_download.fetch_delta(pool, name, entry, retries=0, now=now)
+    finally:
+        pool.close()
+
+
+@pytest.fixture
+def server():
+    srv = Server()
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_concurrent_fetch(server):
+    stations = ['%05d' % i for i in range(16)]
+    server.files = {s + ft: TXT + s.encode() for s in stations for ft in ('.txt', '.spec')}
+    server.delay = 0.05
+
+    started = time.perf_counter()
+    payloads, missing = ndbc_download.fetch_all(stations, base_url=server.url, max_workers=8)
+    seconds = time.perf_counter() - started
+
+    assert missing == {'.txt': [], '.spec': []}
+    assert payloads['.txt']['00003'] == TXT + b'00003'
+    assert set(payloads['.spec']) == set(stations)
+    assert server.max_active > 1
+    assert seconds < 32 * server.delay / 2      # well under one file at a time
+
+
+def test_keep_alive_reuse(server):
+    stations = ['%05d' % i for i in range(20)]
+    server.files = {s + '.txt': TXT for s in stations}
+
+    payloads, _ = ndbc_download.fetch_all(stations, file_types=('.txt',), base_url=server.url,
+                                          max_workers=2)
+
+    assert len(payloads['.txt']) == 20
+    assert sum(server.requests.values()) == 20
+    assert server.connections <= 2      # one connection per worker, reused
+
+
+def test_retry_backoff_on_5xx(server):
+    server.files = {'41001.txt': TXT}
+    server.fail = {'41001.txt': [503, 500]}
+    pool = ndbc_download.ConnectionPool(server.url, timeout=2)
+
+    started = time.perf_counter()
+    try:
+        body = ndbc_download.fetch(pool, '41001.txt', retries=3, backoff=0.1)
+    finally:
+        pool.close()
+
+    assert body == TXT
+    assert server.requests['41001.txt'] == 3
+    assert time.perf_counter() - started >= 0.1 + 0.2      # backoff 0.1 s, then 0.2 s
+
+
+def test_retry_on_timeout(server):
+    server.files = {'41001.txt': TXT}
+    server.fail = {'41001.txt': ['slow']}
+    pool = ndbc_download.ConnectionPool(server.url, timeout=0.3)
+    try:
+        body = ndbc_download.fetch(pool, '41001.txt', retries=2, backoff=0.01)
+    finally:
+        pool.close()
+
+    assert body == TXT
+    assert server.requests['41001.txt'] == 2
+    assert server.connections == 2      # timed out connection dropped, new one opened
+
+
+def test_gives_up_after_retries(server):
+    server.files = {'41001.txt': TXT, '41002.txt': TXT}
+    server.fail = {'41002.txt': [502] * 10}
+
+    payloads, missing = ndbc_download.fetch_all(['41001', '41002'], file_types=('.txt',),
+                                                base_url=server.url, retries=2, backoff=0.01)
+
+    assert list(payloads['.txt']) == ['41001']
+    assert missing['.txt'] == ['41002']
+    assert server.requests['41002.txt'] == 3
+
+
+def test_missing_stations_reported(server, workdir):
+    server.files = {'41001.txt': TXT, '41001.spec': TXT, '41002.txt': TXT}
+
+    _, missing = ndbc_download.fetch_all(['41001', '41002', '41003'], base_url=server.url)
+    ndbc_download.save_missing(missing)
+
+    assert missing == {'.txt': ['41003'], '.spec': ['41002', '41003']}
+    with open('stations_missing_.csv') as fh:
+        assert fh.read() == 'station_id\n41003\n'
+    with open('stations_missing_.spec') as fh:
+        assert fh.read() == 'station_id\n41002\n41003\n'
+    assert server.requests['41003.txt'] == 1    # 404 is an answer, not retried
+
+
+def test_range_end():
+    assert ndbc_download._range_end({}, NOW) is None       # 1st run: whole file
+    entry = {'head_bytes': 44, 'row_bytes': 22, 'newest': '2021 05 18 15 30'}
+    rows = 3 + ndbc_download.RANGE_SLACK_ROWS                # 30 min -> 3 rows + slack
+    assert ndbc_download._range_end(entry, NOW) == 44 + rows * 22 - 1
+    assert ndbc_download._range_end(entry, NOW - 3600) == 44 + ndbc_download.RANGE_SLACK_ROWS * 22 - 1
+
+
+def test_fetch_delta_new_station(server):
+    server.files = {'41001.txt': realtime(0, 100)}
+
+    status, header, rows, entry = delta(server, '41001.txt', {})
+
+    assert status == 'new' and header == HEAD and len(rows) == 100
+    assert 'Range' not in server.headers['41001.txt']
+    assert entry['newest'] == '2021 05 18 16 00'
+    assert entry['head_bytes'] == len(HEAD) and entry['row_bytes'] == len(rows[0])
+    assert entry['etag']
+
+
+def test_fetch_delta_range_206(server):
+    server.files = {'41001.txt': realtime(0, 400)}
+    _, _, _, first = delta(server, '41001.txt', {})
+    server.files = {'41001.txt': realtime(20, 400)}         # 2 rows on top
+
+    status, _, rows, entry = delta(server, '41001.txt', first, now=NOW + 1200)
+
+    sent = server.headers['41001.txt']
+    assert sent['Range'] == 'bytes=0-%d' % ndbc_download._range_end(first, NOW + 1200)
+    assert sent['If-None-Match']
+    assert status == 'new'
+    assert [r[:16] for r in rows] == [b'2021 05 18 16 20', b'2021 05 18 16 10']
+    assert entry['newest'] == '2021 05 18 16 20'
+    assert server.requests['41001.txt'] == 2            # no fallback to the whole file
+
+
+def test_fetch_delta_304(server):
+    server.files = {'41001.txt': realtime(0, 10)}
+    _, _, _, entry = delta(server, '41001.txt', {})
+
+    status, header, rows, after = delta(server, '41001.txt', entry, now=NOW + 600)
+
+    assert status == 'unchanged' and rows == [] and after == entry
+    assert server.headers['41001.txt']['If-None-Match'] == entry['etag']
+
+
+def test_fetch_delta_200_without_range(server):
+    # server ignores Range -> whole file, still only the new rows
+    server.files = {'41001.txt': realtime(0, 50)}
+    server.ranges = False
+    _, _, _, entry = delta(server, '41001.txt', {})
+    server.files = {'41001.txt': realtime(10, 50)}
+
+    status, _, rows, entry = delta(server, '41001.txt', entry, now=NOW + 600)
+
+    assert status == 'new' and [r[:16] for r in rows] == [b'2021 05 18 16 10']
+    assert entry['newest'] == '2021 05 18 16 10'
+
+
+def test_fetch_delta_truncated_row(server):
+    # rows wider than last run -> the Range slice ends mid-row; that row is dropped
+    server.files = {'41001.txt': realtime(0, 50)}
+    _, _, _, entry = delta(server, '41001.txt', {})
+    server.files = {'41001.txt': realtime(20, 50).replace(b'  ', b'   ')}
+
+    status, _, rows, entry = delta(server, '41001.txt', entry, now=NOW + 1200)
+
+    assert status == 'new'
+    assert all(r.endswith(b'\n') for r in rows)
+    assert [r[:16] for r in rows] == [b'2021 05 18 16 20', b'2021 05 18 16 10']
+
+
+def test_fetch_delta_more_than_range(server):
+    # more new rows than the slice holds -> whole file fetched again
+    server.files = {'41001.txt': realtime(0, 200)}
+    _, _, _, entry = delta(server, '41001.txt', {})
+    server.files = {'41001.txt': realtime(300, 200)}        # 30 rows on top, guess is 6 + slack
+
+    status, _, rows, entry = delta(server, '41001.txt', entry, now=NOW + 3600)
+
+    assert status == 'new' and len(rows) == 30
+    assert server.requests['41001.txt'] == 3
+    assert 'Range' not in server.headers['41001.txt']
+
+
+def test_plan_fetch():
+    now = NOW
+    txt = {'newest': '2021 05 18 15 50', 'last_modified': 'Tue, 18 May 2021 15:55:00 GMT'}
+    state = {'41001.txt': txt,                              # up to date
+             '41002.txt': txt,                              # new .txt row
+             '41003.txt': txt,                              # .spec written before the .txt
+             '41003.spec': {'newest': '2021 05 18 15 40',
+                            'last_modified': 'Tue, 18 May 2021 15:45:00 GMT'},
+             '41004.txt': txt,                              # .spec caught up
+             '41004.spec': {'newest': '2021 05 18 15 40',
+                            'last_modified': 'Tue, 18 May 2021 15:56:00 GMT'},
+             '41005.txt': txt}                              # stale
+    latest = {'41001': '2021 05 18 15 50', '41002': '2021 05 18 16 00',
+              '41003': '2021 05 18 15 50', '41004': '2021 05 18 15 50',
+              '41005': '2021 05 18 08 00', '41006': '2021 05 18 15 50'}     # 41006 new
+
+    due, stale = ndbc_download.plan_fetch(latest, state, max_age_hours=6, now=now)
+
+    assert due == ['41002', '41003', '41006']
+    assert stale == ['41005']
@@ -0,0 +1,149 @@
+import json
+import os
+
+import geopandas
+import numpy as np
+import pandas as pd
+import shapely
+
+import cg_coverage
+import criteria
+import station_index
+import status_service
+import wx_grid
+
+RULES = criteria.load(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                   'splashdown_criteria.csv'))
+T = pd.Timestamp('2021-05-18 16:00')
+
+
+class Broken:
+    source, created = 'test', 0.0
+
+    def all_sites(self):
+        raise KeyError('wind_spd')
+
+
+def test_error_in_request_is_500_json():
+    service = status_service.Service()
+    service.publish(Broken())
+
+    status, body = service.answer('/sites')
+    assert status == 500
+    assert json.loads(body) == {'error': 'internal error', 'detail': "KeyError('wind_spd')"}
+    assert service.answer('/health')[0] == 200      # other requests still answered
+
+
+def test_nearest_matches_brute_force():
+    rng = np.random.default_rng(3)
+    lat, lon = rng.uniform(15, 45, 200), rng.uniform(-98, -60, 200)
+    lat[7] = np.nan     # no position -> never returned
+    index = station_index.StationIndex(np.arange(200), lat, lon)
+
+    rows, dist = index.nearest([28.4, 30.0], [-80.0, -88.0], k=5)
+
+    assert rows.shape == dist.shape == (2, 5)
+    for i, (y, x) in enumerate([(28.4, -80.0), (30.0, -88.0)]):
+        nm = station_index.haversine_nm(y, x, lat, lon)
+        want = np.argsort(np.where(np.isnan(nm), np.inf, nm))[:5]
+        assert list(rows[i]) == list(want)
+        np.testing.assert_allclose(dist[i], nm[want])
+    assert index.nearest(28.4, -80.0, k=500)[0].shape == (1, 199)
+
+
+def snapshot():
+    """2 sites, 3 stations, 2 CG units (60 min reach, land block cut out) & a small grid."""
+    sites = pd.DataFrame({'Name': ['Tampa, FL', 'Cape Canaveral, FL'],
+                          'latitude': [27.6, 28.4], 'longitude': [-83.0, -80.3]}).set_index('Name')
+    stations = pd.DataFrame({'station_id': ['42036', '41009', '41113'],
+                             'latitude': [28.5, 28.5, 28.4], 'longitude': [-84.5, -80.2, -80.5],
+                             'timestamp': [T] * 3, 'wind_spd': [10.0, 20.0, 12.0],
+                             'wind_wave_height': [0.5, 1.0, np.nan]})
+    nearby = pd.DataFrame({'Name': ['Tampa, FL', 'Cape Canaveral, FL', 'Cape Canaveral, FL'],
+                           'station_id': ['42036', '41009', '41113'],
+                           'distance_nm': [96.0, 6.0, 12.0]})
+    metrics = {'wind_spd': np.array([[10.0], [20.0]]), 'wind_wave_height': np.array([[0.5], [1.0]]),
+               'ave_period': np.array([[5.0], [5.0]])}
+    latest = criteria.evaluate(metrics, RULES, sites.index, [T]).latest()
+    units = pd.DataFrame({'Unit': ['Canaveral', 'St Petersburg'], 'Asset': ['RB-S', 'RB-M'],
+                          'Latitude': [28.41, 27.76], 'Longitude': [-80.60, -82.63],
+                          'Transit_Spd': [40.0, 30.0]})
+    units = geopandas.GeoDataFrame(units, crs=4326,
+                                   geometry=geopandas.points_from_xy(units.Longitude, units.Latitude))
+    land = geopandas.GeoDataFrame(geometry=[shapely.box(-80.9, 28.2, -80.45, 28.7)], crs=4326)
+    coverage = cg_coverage.Coverage(units, cg_coverage.build(units, land, 60), 60)
+    lat, lon = wx_grid.grid(27, 29, -81, -79, step=0.5)
+    ones = np.ones((1, len(lat), len(lon)), dtype=np.float32)
+    field = wx_grid.Field(pd.DatetimeIndex([T]), lat, lon,
+                          {'wind_spd': 5 * ones, 'wind_wave_height': 0.5 * ones, 'ave_period': 5 * ones})
+    return status_service.Snapshot(sites, latest, None, nearby, stations, coverage, field=field,
+                                   rules=RULES, source='test')
+
+
+def service():
+    out = status_service.Service()
+    out.publish(snapshot())
+    return out
+
+
+def answer(service, path):
+    status, body = service.answer(path)
+    return status, json.loads(body)
+
+
+def test_sites():
+    status, body = answer(service(), '/sites')
+
+    assert status == 200 and body['source'] == 'test'
+    by_name = {s['Name']: s for s in body['sites']}
+    assert by_name['Tampa, FL']['status'] == 'Go'
+    assert by_name['Cape Canaveral, FL']['status'] == 'No-Go'
+    assert by_name['Cape Canaveral, FL']['rule'] == 'wind'
+    assert by_name['Cape Canaveral, FL']['limit'] == 15
+
+
+def test_one_site():
+    svc = service()
+    status, body = answer(svc, '/sites/Cape%20Canaveral,%20FL')
+
+    assert status == 200 and body['Name'] == 'Cape Canaveral, FL'
+    assert [s['station_id'] for s in body['stations']] == ['41009', '41113']     # nearest 1st
+    assert body['stations'][1]['wind_wave_height'] is None                     # NaN -> null
+    assert [u['Unit'] for u in body['units']] == ['Canaveral']
+
+    status, body = answer(svc, '/sites/Nowhere')
+    assert status == 404 and sorted(body['sites']) == ['Cape Canaveral, FL', 'Tampa, FL']
+
+
+def test_point_inside_coverage():
+    status, body = answer(service(), '/point?lat=28.5&lon=-80.2&n=2')
+
+    assert status == 200
+    assert [u['Unit'] for u in body['units']] == ['Canaveral', 'St Petersburg']
+    assert [u['in_reach'] for u in body['units']] == [True, False]
+    assert body['stations'][0]['station_id'] == '41009' and len(body['stations']) == 2
+    assert body['grid_node'] == [28.5, -80.0]
+    assert body['status']['status'] == 'Go' and body['conditions']['wind_spd'] == 5
+
+
+def test_point_outside_coverage():
+    # on the land block - w/in 40 nm of Canaveral, but not in its clipped area
+    status, body = answer(service(), '/point?lat=28.5&lon=-80.7')
+    assert status == 200
+    assert not any(u['in_reach'] for u in body['units']) and len(body['units']) == 2
+    assert 'conditions' in body         # still on the grid
+
+    # open sea far from both units & off the grid
+    status, body = answer(service(), '/point?lat=25.0&lon=-90.0&n=1')
+    assert status == 200
+    assert len(body['units']) == 1 and not body['units'][0]['in_reach']
+    assert 'conditions' not in body and 'grid_node' not in body
+
+
+def test_bad_query_is_400():
+    svc = service()
+    for path in ['/point', '/point?lat=abc&lon=-80', '/point?lat=28', '/point?lat=95&lon=-80',
+                 '/point?lat=28&lon=-80&n=0']:
+        status, body = answer(svc, path)
+        assert status == 400, path
+        assert 'error' in body
@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+import wx_grid
+
+
+def field():
+    lat, lon = wx_grid.grid(20, 22, -90, -87, step=1)
+    times = pd.date_range('2021-05-18', periods=2, freq='10min')
+    values = (lat[:, None] * 10 + lon[None, :]).astype(np.float32)    # linear in lat & lon
+    return wx_grid.Field(times, lat, lon, {'wind_spd': np.stack([values, values + 1])})
+
+
+def test_bilinear_inside():
+    out = field().at([20.5, 22, 20], [-88.25, -87, -90], 'wind_spd')
+    np.testing.assert_allclose(out.iloc[0], [205 - 88.25, 220 - 87, 200 - 90], rtol=1e-6)
+    np.testing.assert_allclose(out.iloc[1] - out.iloc[0], 1, rtol=1e-6)
+
+
+def test_outside_grid_is_nan():
+    out = field().at([19.9, 22.1, 21, 21, 21], [-88, -88, -90.5, -86.9, -88], 'wind_spd')
+    assert out.iloc[:, :4].isna().all().all()
+    assert out.iloc[:, 4].notna().all()
@@ -0,0 +1,311 @@
+#
+## Purpose
+#
+    # Watch mode - keep the splashdown site status current as NDBC publishes
+    # (instead of running the 4 scripts by hand before each decision gate)
+    # 1. Polls on the NDBC cadence: readings every 10 min, published a few
+    #    min later; each cycle starts at :00, :10, ... + an offset learned
+    #    from when latest_obs.txt actually changed
+    # 2. Each cycle does only the new work, state stays in memory:
+        # latest_obs.txt (conditional GET) -> stations near a site w/new rows
+        #    (station list refreshed from it; site windows rebuilt if the
+        #    stations near a site changed)
+        # -> Range/conditional GETs of their new rows (ndbc_download)
+        # -> parse & join the new rows only (late .spec rows written onto
+        #    the rows held) -> rolling window, 10 min site
+        #    series & Go/Marginal/No-Go (site_window, site_series, criteria)
+    # 3. Latency: published (Last-Modified of latest_obs.txt) -> site status
+    #    updated, per cycle; a warning when over the target
+    # 4. Backpressure: one cycle at a time. A slow cycle that runs past the
+    #    next slot(s) is followed by ONE catch-up cycle - missed slots are
+    #    coalesced (the delta fetch picks up everything new anyway)
+
+## Run from the data folder (as for the scripts):
+    # python watch.py                      # until Ctrl+C
+    # python watch.py --cycles 6           # 6 cycles (~1 hr), then stop
+    # python watch.py --persist            # also update data_raw/ & the window cache
+    # python watch.py --target 300         # latency target, seconds
+
+## Uses 1. - 4. building blocks: ndbc_download, ndbc_parse, obs_join,
+## station_index, site_window, site_series & criteria
+
+import argparse
+import collections
+import statistics
+import time
+from email.utils import parsedate_to_datetime
+
+import numpy as np
+import pandas as pd
+
+import criteria
+import ndbc_download
+import ndbc_parse
+import obs_join
+import obs_schema
+import site_series
+import site_window
+import station_index
+
+CADENCE = 600       # seconds between NDBC reporting slots
+OFFSET = 300        # 1st guess: latest_obs.txt updated ~5 min after the slot
+RETRY = 30          # seconds between polls while the slot is not published yet
+TARGET = 300        # seconds, published -> status updated
+
+# Same columns & units as '2. clean_input_data.py'
+KEEP_TXT = ['wind_spd', 'wind_gust', 'ave_period']
+KEEP_SPEC = ['swell_height', 'swell_period', 'wind_wave_height', 'steepness']
+METRICS = ['wind_spd', 'wind_gust', 'wind_wave_height', 'swell_height', 'ave_period']
+
+
+def next_slot(now, cadence=CADENCE, offset=OFFSET):
+    """1st poll time (epoch sec) after now: a multiple of cadence + offset."""
+    return (np.floor((now - offset) / cadence) + 1) * cadence + offset
+
+
+class Watcher:
+    """In-memory state between cycles & one cycle of incremental work.
+
+    sites      NASA_sites.csv (Name, latitude, longitude)
+    radius_nm  stations used per site (as in '3. landing_site_data.py')
+    cadence, offset, retry, target  seconds, see above
+    persist    also append new rows to data_raw/ & save the fetch state/window
+    """
+
+    def __init__(self, sites='NASA_sites.csv', radius_nm=120, rules=criteria.CRITERIA,
+                 base_url=ndbc_download.REALTIME2_URL, latest_url=ndbc_download.LATEST_OBS_URL,
+                 cadence=CADENCE, offset=OFFSET, retry=RETRY, target=TARGET,
+                 persist=False, max_workers=32):
+        self.sites = pd.read_csv(sites).set_index('Name')
+        self.radius_nm, self.rules = radius_nm, criteria.load(rules)
+        self.base_url, self.latest_url = base_url, latest_url
+        self.cadence, self.default_offset, self.retry = cadence, offset, retry
+        self.offset_used = offset
+        self.target, self.persist, self.max_workers = target, persist, max_workers
+        self.names = ndbc_parse.column_names()
+        self.fetch_state = ndbc_download.load_state()
+        self.last_modified = None       # of latest_obs.txt
+        self.buoys = None               # station_id, latitude, longitude
+        self.nearby = None              # Name, station_id, distance_nm
+        self.obs = None                 # last 72 hrs, stations near a site
+        self.window = None
+        self.status = None              # criteria.Evaluation of the last cycle
+        self.delays = collections.deque(maxlen=12)      # slot -> published, sec
+        self.history = collections.deque(maxlen=144)    # cycle reports, 24 hrs
+
+    def _stations(self, body):
+        # latest_obs.txt -> station positions & the (site, station) pairs
+        buoys = ndbc_parse.parse(body, names=self.names)
+        self.buoys = buoys[['station_id', 'latitude', 'longitude']].astype({'station_id': str})
+        index = station_index.StationIndex.from_frame(self.buoys)
+        self.nearby = index.within_sites(self.sites, self.radius_nm)
+
+    def _read(self, stations):
+        # rows already in data_raw/ for these stations, joined & converted
+        txt = {s: b for s, b in ndbc_parse.read_raw('data_raw/*.txt').items() if s in stations}
+        spec = {s: b for s, b in ndbc_parse.read_raw('data_raw/spec/*.spec').items() if s in stations}
+        return self._clean(ndbc_parse.build_table(txt, self.names),
+                           ndbc_parse.build_table(spec, self.names))
+
+    def _refresh(self, body):
+        # new latest_obs.txt -> station list; True if the stations near a site
+        # changed (new, moved or gone) & the site windows were rebuilt
+        pairs = set(map(tuple, self.nearby[['Name', 'station_id']].to_numpy()))
+        self._stations(body)
+        if set(map(tuple, self.nearby[['Name', 'station_id']].to_numpy())) == pairs:
+            return False
+        stations = set(self.nearby['station_id'])
+        held = set() if self.obs is None else set(self.obs['station_id'].astype(str))
+        frames = [f for f in (self.obs, self._read(stations - held)) if f is not None]
+        self.obs = None
+        if frames:
+            obs = pd.concat(frames, ignore_index=True)
+            obs = obs[obs['station_id'].astype(str).isin(stations)]
+            obs = obs.drop_duplicates(['station_id', 'timestamp'], keep='last')
+            self.obs = obs_schema.apply(obs.reset_index(drop=True))
+        self.window = site_window.SiteWindow(self.nearby)
+        if self.obs is not None:
+            self.window.update(self.obs)
+        return True
+
+    def _clean(self, txt, spec):
+        # parsed .txt & .spec rows -> joined & converted, as in '2. clean_input_data.py'
+        if not len(txt):
+            return None
+        if not len(spec):
+            spec = pd.DataFrame(columns=['station_id', 'timestamp'] + KEEP_SPEC)
+        data = obs_join.join(txt, spec, self.buoys, KEEP_TXT, KEEP_SPEC)
+        data['wind_spd'] = round(data['wind_spd'] * obs_schema.KNOTS_TO_FTS, 2)
+        return data
+
+    def start(self):
+        """1st state: station list & the raw files already in data_raw/ (nearby stations)."""
+        body, self.last_modified = ndbc_download.poll_latest_obs(url=self.latest_url)
+        self._stations(body)
+        self.obs = self._read(set(self.nearby['station_id']))
+        self.window = site_window.SiteWindow.load(self.nearby) if self.persist \
+            else site_window.SiteWindow(self.nearby)
+        if self.obs is not None:
+            self.window.update(self.obs)
+        self._evaluate()
+
+    def _evaluate(self):
+        if self.obs is None or not len(self.obs):
+            return
+        end = self.obs['timestamp'].max()
+        self.obs = self.obs[self.obs['timestamp'] > end - site_window.WINDOW]
+        series = site_series.resample(self.obs, self.nearby, METRICS,
+                                      start=end - site_window.WINDOW + site_window.STEP, end=end)
+        self.status = criteria.evaluate(series.arrays(), self.rules, series.sites, series.times)
+
+    def cycle(self, slot=None):
+        """One poll -> report dict, or None if latest_obs.txt has not changed yet."""
+        started = time.time()
+        body, modified = ndbc_download.poll_latest_obs(self.last_modified, url=self.latest_url)
+        if body is None:
+            return None
+        self.last_modified = modified
+        published = parsedate_to_datetime(modified).timestamp() if modified else started
+        rebuilt = self._refresh(body)
+
+        # Stations near a site that reported since the rows we hold
+        latest = ndbc_download.latest_obs_times(body)
+        nearby = set(self.nearby['station_id'])
+        due, stale = ndbc_download.plan_fetch({s: k for s, k in latest.items() if s in nearby},
+                                              self.fetch_state)
+        deltas, _, missing = ndbc_download.fetch_all_delta(due, self.fetch_state, base_url=self.base_url,
+                                                           max_workers=self.max_workers)
+        if self.persist:
+            ndbc_download.apply_deltas(deltas)
+            ndbc_download.save_state(self.fetch_state)
+
+        # Parse only the new rows
+        txt, spec = [ndbc_parse.build_table({s: header + b''.join(rows) for s, (header, rows) in files.items()},
+                                            self.names) for files in (deltas['.txt'], deltas['.spec'])]
+        new = self._clean(txt, spec)
+        late = 0
+        if new is not None:
+            self.obs = new if self.obs is None else pd.concat([self.obs, new], ignore_index=True)
+        if self.obs is not None:
+            # late .spec rows, for .txt rows held from an earlier cycle
+            self.obs, changed = obs_join.update(self.obs, spec, KEEP_SPEC)
+            if new is not None:
+                late = int(changed[:len(self.obs) - len(new)].sum())
+                changed[len(self.obs) - len(new):] = True
+            else:
+                late = int(changed.sum())
+            if changed.any() or rebuilt:
+                self.window.update(self.obs[changed])
+                self._evaluate()
+                if self.persist:
+                    self.window.save()
+
+        done = time.time()
+        if slot is not None:
+            self.delays.append(published - (slot - self.offset_used))
+        report = {'published': pd.Timestamp(published, unit='s'),
+                  'stations': len(due), 'stale': len(stale), 'missing': len(missing['.txt']),
+                  'new_rows': 0 if new is None else len(new), 'late_spec_rows': late,
+                  'stations_changed': rebuilt,
+                  'cycle_sec': round(done - started, 2), 'latency_sec': round(done - published, 1)}
+        self.history.append(report)
+        return report
+
+    def offset(self, margin=15):
+        """Poll offset after the slot: typical publication delay + margin."""
+        if not self.delays:
+            return self.default_offset
+        return min(max(statistics.median(self.delays) + margin, 0), self.cadence - self.retry)
+
+    def summary(self):
+        """Latest status per site (see criteria.Evaluation.latest)."""
+        if self.status is None:
+            return pd.DataFrame()
+        return self.status.latest()[['Name', 'timestamp', 'status', 'rule', 'value', 'limit', 'reason']]
+
+
+def run(watcher, cycles=None, log=print, on_cycle=None):
+    """Poll on the cadence until stopped (or cycles done) -> number of missed slots coalesced.
+
+    on_cycle(watcher, report) is called after each cycle w/new data
+    (e.g. status_service publishes a new snapshot).
+    """
+    cadence, retry = watcher.cadence, watcher.retry
+    coalesced = 0
+    done = 0
+    watcher.offset_used = watcher.offset()
+    slot = next_slot(time.time(), cadence, watcher.offset_used)
+    while cycles is None or done < cycles:
+        time.sleep(max(0.0, slot - time.time()))
+
+        # Poll until this slot is published (or the next slot is due)
+        report = watcher.cycle(slot)
+        while report is None and time.time() + retry < slot + cadence:
+            time.sleep(retry)
+            report = watcher.cycle(slot)
+        done += 1
+
+        if report is None:
+            log('%s  nothing new published' % pd.Timestamp.now(tz='UTC').strftime('%H:%M:%S'))
+        else:
+            log('%s  %d stations, %d new rows, cycle %.1f s, latency %.0f s%s' % (
+                pd.Timestamp.now(tz='UTC').strftime('%H:%M:%S'), report['stations'],
+                report['new_rows'], report['cycle_sec'], report['latency_sec'],
+                '  OVER TARGET (%d s)' % watcher.target if report['latency_sec'] > watcher.target else ''))
+            log(watcher.summary().to_string(index=False))
+            if on_cycle is not None:
+                on_cycle(watcher, report)
+
+        # Next slot; slots already past while this cycle ran are coalesced into one
+        watcher.offset_used = watcher.offset()
+        upcoming = next_slot(time.time(), cadence, watcher.offset_used)
+        missed = int(round((upcoming - slot) / cadence)) - 1
+        if missed > 0:
+            coalesced += missed
+            log('   slow cycle - %d missed slot(s) coalesced, catching up now' % missed)
+            upcoming -= cadence     # latest slot already started -> no wait
+        slot = upcoming
+    return coalesced
+
+
+def from_args(argv=None, parser=None):
+    """Watcher from command line options -> (watcher, options); parser may hold extra options."""
+    parser = parser or argparse.ArgumentParser(description='Keep the splashdown site status current')
+    parser.add_argument('--cycles', type=int, default=None, help='stop after n cycles')
+    parser.add_argument('--persist', action='store_true', help='update data_raw/ & the window cache')
+    parser.add_argument('--target', type=float, default=TARGET, help='latency target, seconds')
+    parser.add_argument('--cadence', type=float, default=CADENCE, help='seconds between slots')
+    parser.add_argument('--offset', type=float, default=OFFSET, help='1st guess, slot -> published')
+    parser.add_argument('--retry', type=float, default=RETRY, help='seconds between polls of a slot')
+    parser.add_argument('--base-url', default=ndbc_download.REALTIME2_URL)
+    parser.add_argument('--latest-url', default=ndbc_download.LATEST_OBS_URL)
+    args = parser.parse_args(argv)
+
+    watcher = Watcher(base_url=args.base_url, latest_url=args.latest_url,
+                      cadence=args.cadence, offset=args.offset, retry=args.retry,
+                      target=args.target, persist=args.persist)
+    return watcher, args
+
+
+def main(argv=None):
+    watcher, args = from_args(argv)
+    watcher.start()
+    print('\n Watching', watcher.nearby['station_id'].nunique(), 'stations near',
+          len(watcher.sites), 'sites')
+    if watcher.status is not None:
+        print(watcher.summary().to_string(index=False))
+    try:
+        coalesced = run(watcher, cycles=args.cycles)
+    except KeyboardInterrupt:
+        coalesced = None
+    latencies = [r['latency_sec'] for r in watcher.history]
+    if latencies:
+        print('\n Latency (s): median %.0f, max %.0f, over target %d of %d cycles'
+              % (np.median(latencies), max(latencies),
+                 sum(l > watcher.target for l in latencies), len(latencies)))
+    if coalesced:
+        print(' Missed slots coalesced:', coalesced)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+#
+## Purpose
+#
+    # Interpolate station observations onto a lat/long grid, per time step
+    # (the "raster interpolation" the cleaned data is prepared for)
+    # 1. Observations binned to a fixed time step (default 10 min) ->
+    #    dense time x station arrays, one per variable
+    # 2. Each grid cell takes its k nearest stations (KD-tree, great-circle)
+    #    & weights them 1/d^power; missing readings are left out
+    # 3. Evaluated in tiles of grid cells x chunks of time steps, so memory
+    #    stays bounded no matter the grid size or time span
+    # 4. Field.at() samples the grid at sites (bilinear, NaN outside the grid)
+
+## Used by '2. clean_input_data.py' (build) & '4. site_evaluation.py' (sample)
+
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from station_index import EARTH_RADIUS_NM, to_xyz
+
+GRID = 'data_clean/wx_grid.npz'
+
+VARIABLES = ['wind_spd', 'wind_gust', 'swell_height', 'wind_wave_height', 'ave_period']
+
+# Gulf of Mexico & western Atlantic
+AREA = {'lat_min': 18.0, 'lat_max': 36.0, 'lon_min': -98.0, 'lon_max': -70.0}
+
+
+def grid(lat_min, lat_max, lon_min, lon_max, step=0.25):
+    """Grid cell centres -> (lat 1-d, lon 1-d), degrees."""
+    lat = np.arange(lat_min, lat_max + step / 2, step)
+    lon = np.arange(lon_min, lon_max + step / 2, step)
+    return lat, lon
+
+
+def bin_observations(obs, variables, freq='10min'):
+    """Observations -> (times, station_ids, lat, lon, {var: time x station float32}).
+
+    Readings in the same time step & station are averaged.
+    """
+    obs = obs.dropna(subset=['latitude', 'longitude'])
+    slot = obs['timestamp'].dt.floor(freq)
+    times = pd.DatetimeIndex(np.sort(slot.unique()))
+    t = times.get_indexer(slot)
+    stations, s = np.unique(obs['station_id'].astype(str).to_numpy(), return_inverse=True)
+    n_t, n_s = len(times), len(stations)
+    flat = t * n_s + s
+
+    lat = np.zeros(n_s)
+    lat[s] = obs['latitude'].to_numpy(np.float64)
+    lon = np.zeros(n_s)
+    lon[s] = obs['longitude'].to_numpy(np.float64)
+
+    values = {}
+    for var in variables:
+        v = obs[var].to_numpy(np.float64)
+        have = np.isfinite(v)
+        total = np.bincount(flat[have], weights=v[have], minlength=n_t * n_s)
+        count = np.bincount(flat[have], minlength=n_t * n_s)
+        with np.errstate(invalid='ignore'):
+            values[var] = (total / count).astype(np.float32).reshape(n_t, n_s)
+    return times, stations, lat, lon, values
+
+
+class Field:
+    """Gridded values: data[var] is a (time, lat, lon) float32 array."""
+
+    def __init__(self, times, lat, lon, data):
+        self.times, self.lat, self.lon, self.data = times, lat, lon, data
+
+    def at(self, lat, lon, var):
+        """Bilinear sample at points -> DataFrame (rows times, one column per point).
+        Points outside the grid -> NaN (not the value at the nearest edge)."""
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        fy = np.interp(lat, self.lat, np.arange(len(self.lat)))
+        fx = np.interp(lon, self.lon, np.arange(len(self.lon)))
+        y0 = np.minimum(np.floor(fy).astype(int), len(self.lat) - 2).clip(0)
+        x0 = np.minimum(np.floor(fx).astype(int), len(self.lon) - 2).clip(0)
+        wy, wx = fy - y0, fx - x0
+        g = self.data[var]
+        out = (g[:, y0, x0] * (1 - wy) * (1 - wx) + g[:, y0 + 1, x0] * wy * (1 - wx)
+               + g[:, y0, x0 + 1] * (1 - wy) * wx + g[:, y0 + 1, x0 + 1] * wy * wx)
+        outside = ((lat < self.lat[0]) | (lat > self.lat[-1])
+                   | (lon < self.lon[0]) | (lon > self.lon[-1]))
+        out[:, outside] = np.nan
+        return pd.DataFrame(out, index=self.times)
+
+    def save(self, path=GRID):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez_compressed(path, times=self.times.to_numpy('datetime64[ns]'),
+                            lat=self.lat, lon=self.lon,
+                            **{'var_' + k: v for k, v in self.data.items()})
+
+    @classmethod
+    def load(cls, path=GRID):
+        with np.load(path) as f:
+            data = {k[4:]: f[k] for k in f.files if k.startswith('var_')}
+            return cls(pd.DatetimeIndex(f['times']), f['lat'], f['lon'], data)
+
+
+def interpolate(obs, lat, lon, variables=VARIABLES, freq='10min', k=8, power=2,
+                max_nm=None, tile_cells=4096, time_chunk=144):
+    """Inverse-distance (k nearest) interpolation onto the lat x lon grid.
+
+    obs         station_id, timestamp, latitude, longitude & variables
+    lat, lon    1-d grid axes, see grid()
+    k, power    nearest stations used per cell & weight 1/d^power
+    max_nm      ignore stations further than this (cell -> NaN if none)
+    tile_cells  grid cells per tile; time_chunk time steps per pass
+    Returns Field.
+    """
+    times, stations, s_lat, s_lon, values = bin_observations(obs, variables, freq)
+    tree = cKDTree(to_xyz(s_lat, s_lon))
+    k = min(k, len(stations))
+
+    glat, glon = np.meshgrid(lat, lon, indexing='ij')
+    cells = to_xyz(glat.ravel(), glon.ravel())
+    n_cells = len(cells)
+    data = {var: np.full((len(times), n_cells), np.nan, dtype=np.float32) for var in variables}
+
+    for c0 in range(0, n_cells, tile_cells):
+        c1 = min(c0 + tile_cells, n_cells)
+        chord, idx = tree.query(cells[c0:c1], k=k)
+        chord, idx = chord.reshape(c1 - c0, k), idx.reshape(c1 - c0, k)
+        nm = 2 * EARTH_RADIUS_NM * np.arcsin(np.clip(chord / 2, 0, 1))
+        w = (1 / np.maximum(nm, 1.0) ** power).astype(np.float32)     # (cells, k)
+        if max_nm is not None:
+            w[nm > max_nm] = 0
+
+        for t0 in range(0, len(times), time_chunk):
+            t1 = min(t0 + time_chunk, len(times))
+            for var in variables:
+                v = values[var][t0:t1][:, idx]                          # (t, cells, k)
+                have = np.isfinite(v)
+                num = np.einsum('tck,ck->tc', np.where(have, v, 0), w)
+                den = np.einsum('tck,ck->tc', have.astype(np.float32), w)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    data[var][t0:t1, c0:c1] = num / den
+
+    shape = (len(times), len(lat), len(lon))
+    return Field(times, lat, lon, {var: a.reshape(shape) for var, a in data.items()})